@@ -118,6 +118,26 @@ class MultiProcessingPool:
         flatten_results = list(itertools.chain(*results))
         return flatten_results
 
+    def iter_task_results(self):
+        """
+        yield the flattened outputs of the tasks in the Pool, in the order of
+        the tasks, as soon as each task is finished. Contrary to
+        wait_for_tasks, the output of a task is released once consumed, and
+        the outputs of all tasks are never held in memory at once.
+        """
+        # tells the pool not to accept any new job
+        self.Pool.close()
+        tasks = self.Pool_tasks
+        self.Pool_tasks = []
+        tasks.reverse()
+        try:
+            while len(tasks) > 0:
+                yield from tasks.pop().get()
+        finally:
+            # also wait for the other tasks if one of them failed, as
+            # wait_for_tasks does
+            self.Pool.join()
+
 
 """
 ####################################################################################################################
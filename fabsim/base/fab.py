@@ -1,17 +1,26 @@
+import fnmatch
+import hashlib
+import json
 import math
+import multiprocessing
 import os
 import re
+import shlex
 import subprocess
 import tempfile
 import textwrap
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import Queue
 from pathlib import Path
 from pprint import pformat, pprint
-from shutil import copy, copyfile, rmtree
+from shutil import copy, copyfile, rmtree, which
+from string import Template
 
+import yaml
 from beartype import beartype
-from beartype.typing import Callable, Optional, Tuple, Union
+from beartype.typing import Callable, Dict, List, Optional, Tuple, Union
 from rich import print as rich_print
 from rich.console import Console
 from rich.panel import Panel
@@ -22,13 +31,57 @@ from fabsim.base.decorators import load_plugin_env_vars, task
 from fabsim.base.env import env
 from fabsim.base.manage_remote_job import *
 from fabsim.base.MultiProcessingPool import MultiProcessingPool
-from fabsim.base.networks import local, put, rsync_project, run
+from fabsim.base.networks import (
+    call_async,
+    gather,
+    local,
+    put,
+    remote_concurrency,
+    rsync_project,
+    run,
+    ssh_command,
+    ssh_control_dir,
+    ssh_control_opts,
+    tarstream_get,
+    tarstream_put,
+    use_ssh_control_master,
+    use_tarstream,
+)
+from fabsim.base.profiling import (
+    disable_profiling,
+    enable_profiling,
+    profile_step,
+    profiled,
+    profiled_task,
+    profiling_enabled,
+    write_profile_report,
+)
+from fabsim.base.progress import JobProgress
 from fabsim.base.setup_fabsim import *
+from fabsim.base.utils import fabsim_cache_dir, link_file
+from fabsim.base.yaml_io import (
+    LIBYAML,
+    Dumper,
+    SafeLoader,
+    yaml_dump,
+    yaml_load_env,
+    yaml_load_file,
+)
 from fabsim.deploy.machines import *
 from fabsim.deploy.templates import (
+    clear_template_cache,
+    get_template_cache_stats,
+    prune_template_disk_cache,
+    remove_script_templates,
     script_template_content,
+    script_template_filename,
+    script_template_source,
     script_templates,
+    start_shared_template_cache,
+    stop_shared_template_cache,
     template,
+    use_shared_template_cache,
+    warm_template_cache,
 )
 
 
@@ -94,6 +147,9 @@ def fetch_results(
     regex: Optional[str] = "",
     files: Optional[str] = None,
     debug: Optional[bool] = False,
+    workers: Optional[str] = None,
+    incremental: Optional[str] = None,
+    selective: Optional[str] = None,
 ) -> None:
     """
     Fetch results of remote jobs to local result store. Specify a job
@@ -112,6 +168,17 @@ def fetch_results(
             split by `;`. For example, to fetch only `out.csv` and `env.yml`
             files, you should pass `files="out.csv;env.yml" to this function.
         debug (bool, optional): it `True`, all `env` variable will shown.
+        workers (str, optional): the number of concurrent transfers, if
+            larger than 1, the run directories (`RUNS/*`) are fetched in
+            parallel, see `fetch_results_parallel`. By default,
+            `fetch_workers` from machines.yml.
+        incremental (str, optional): if `true`, only the new or changed run
+            directories are fetched, see `fetch_results_incremental`. By
+            default, `fetch_incremental` from machines.yml.
+        selective (str, optional): if `true` and `files` is set, only the
+            matching files are listed by one remote `find` and fetched, see
+            `fetch_results_selective`. By default, `fetch_selective` from
+            machines.yml.
     """
     fetch_files = []
     if files is not None:
@@ -133,14 +200,43 @@ def fetch_results(
     if not os.path.isdir(env.job_results_local):
         os.makedirs(env.job_results_local)
 
-    if env.manual_sshpass:
+    if workers is None:
+        workers = env.get("fetch_workers", 1)
+    if incremental is None:
+        incremental = env.get("fetch_incremental", False)
+    incremental = str(incremental).lower() in ("true", "1", "yes", "on")
+    if selective is None:
+        selective = env.get("fetch_selective", False)
+    selective = str(selective).lower() in ("true", "1", "yes", "on")
+    if incremental and not env.manual_gsissh:
+        fetch_results_incremental(
+            regex, fetch_files, includes_files, int(workers)
+        )
+    elif (
+        selective
+        and len(fetch_files) > 0
+        and not (env.manual_gsissh or use_tarstream())
+    ):
+        fetch_results_selective(regex, fetch_files)
+    elif int(workers) > 1 and not env.manual_gsissh:
+        fetch_results_parallel(
+            regex, fetch_files, includes_files, int(workers)
+        )
+    elif use_tarstream():
+        tarstream_get(
+            remote_dir=env.job_results,
+            local_dir=env.job_results_local,
+            members=[regex if regex else "."],
+            name_patterns=fetch_files,
+        )
+    elif env.manual_sshpass:
         sshpass_args = "-e" if env.env_sshpass else "-f $sshpass"
         local(
             template(
-                "rsync -pthrvz -e 'sshpass {} ssh -p $port' {}"
+                "rsync -pthrvz -e 'sshpass {} ssh -p $port {}' {}"
                 "$username@$remote:$job_results/{}  "
                 "$job_results_local".format(
-                    sshpass_args, includes_files, regex
+                    sshpass_args, ssh_control_opts(), includes_files, regex
                 )
             )
         )
@@ -155,11 +251,475 @@ def fetch_results(
     else:
         local(
             template(
-                "rsync -pthrvz -e 'ssh -p $port' {}"
+                "rsync -pthrvz -e 'ssh -p $port {}' {}"
+                "$username@$remote:$job_results/{} "
+                "$job_results_local".format(
+                    ssh_control_opts(), includes_files, regex
+                )
+            )
+        )
+
+
+def list_remote_run_dirs(regex: str) -> List[str]:
+    """
+    List the run directories (`RUNS/*`) of the remote results in
+    `$job_results/<regex>`, relative to `$job_results`, with one remote
+    command.
+    """
+    output = run(
+        # the pattern is escaped instead of quoted, since the command is
+        # quoted differently by run() depending on the ssh mode
+        "cd {} && find {} -type d -path \\*/RUNS/\\* -prune -print".format(
+            env.job_results, regex if regex else "."
+        ),
+        capture=True,
+    )
+    if isinstance(output, tuple):
+        # local() returns (stdout, stderr)
+        output = output[0]
+    # skip any message printed by the login shell
+    return sorted(
+        line.strip()
+        for line in output.replace("\r", "").splitlines()
+        if "/RUNS/" in line
+    )
+
+
+def fetch_results_shard(
+    run_dirs: Optional[List[str]],
+    regex: str,
+    fetch_files: List[str],
+    includes_files: str,
+) -> None:
+    """
+    Fetch a list of run directories of `$job_results`, or, if `run_dirs` is
+    `None`, everything except the run directories, used by
+    `fetch_results_parallel`.
+    """
+    if use_tarstream():
+        if run_dirs is None:
+            tarstream_get(
+                remote_dir=env.job_results,
+                local_dir=env.job_results_local,
+                members=[regex if regex else "."],
+                name_patterns=fetch_files,
+                exclude=["RUNS/*"],
+                capture=True,
+            )
+        else:
+            tarstream_get(
+                remote_dir=env.job_results,
+                local_dir=env.job_results_local,
+                members=[shlex.quote(run_dir) for run_dir in run_dirs],
+                name_patterns=fetch_files,
+                capture=True,
+            )
+        return
+
+    rsh_opt = "-e {}".format(shlex.quote(ssh_command()))
+    if run_dirs is None:
+        local(
+            template(
+                "rsync -pthrz {} --exclude='RUNS/*' {}"
                 "$username@$remote:$job_results/{} "
-                "$job_results_local".format(includes_files, regex)
+                "$job_results_local".format(rsh_opt, includes_files, regex)
+            ),
+            capture=True,
+        )
+        return
+
+    with tempfile.NamedTemporaryFile(
+        mode="w", suffix=".files", delete=False
+    ) as files_from:
+        files_from.write("\n".join(run_dirs) + "\n")
+    try:
+        local(
+            template(
+                "rsync -pthrz {} {} --files-from={} "
+                "$username@$remote:$job_results/ "
+                "$job_results_local".format(
+                    rsh_opt, includes_files, files_from.name
+                )
+            ),
+            capture=True,
+        )
+    finally:
+        os.remove(files_from.name)
+
+
+def fetch_results_parallel(
+    regex: str, fetch_files: List[str], includes_files: str, workers: int
+) -> None:
+    """
+    Fetch the results with `workers` concurrent transfers: the remote run
+    directories (`RUNS/*`) are listed once, and fetched by
+    `fetch_run_dirs`.
+    """
+    fetch_run_dirs(
+        list_remote_run_dirs(regex),
+        regex,
+        fetch_files,
+        includes_files,
+        workers,
+    )
+
+
+def fetch_run_dirs(
+    run_dirs: List[str],
+    regex: str,
+    fetch_files: List[str],
+    includes_files: str,
+    workers: int,
+    on_fetched: Optional[Callable] = None,
+) -> None:
+    """
+    Fetch the input run directories, split in shards, each shard is fetched
+    by one rsync (or tar stream), with `workers` concurrent transfers in a
+    thread pool. The other files (e.g., `env.yml` of the job) are fetched by
+    one more transfer.
+
+    The progress is printed after each shard, and the failed shards are
+    reported at the end.
+
+    Args:
+        on_fetched (Callable, optional): called with the list of run
+            directories of each fetched shard
+    """
+    nb_shards = min(len(run_dirs), workers * 4)
+    shards = [None] + [run_dirs[i::nb_shards] for i in range(nb_shards)]
+    print(
+        "fetch {} run directories in {} shards with {} workers".format(
+            len(run_dirs), nb_shards, workers
+        )
+    )
+
+    start_time = time.time()
+    fetched_runs = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                fetch_results_shard, shard, regex, fetch_files, includes_files
+            ): shard
+            for shard in shards
+        }
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                errors.append((shard, e))
+                continue
+            if shard is None:
+                continue
+            fetched_runs += len(shard)
+            if on_fetched is not None:
+                on_fetched(shard)
+            print(
+                "fetched {}/{} run directories ({:.1f} s)".format(
+                    fetched_runs, len(run_dirs), time.time() - start_time
+                )
+            )
+
+    if len(errors) > 0:
+        for shard, e in errors:
+            print(
+                "failed to fetch {}: {}".format(
+                    "files outside RUNS" if shard is None else shard, e
+                )
+            )
+        raise RuntimeError(
+            "fetch_results: {} of {} transfers failed".format(
+                len(errors), len(shards)
+            )
+        )
+
+
+def remote_find_stat(find_args: str, mtime: bool = False) -> str:
+    """
+    Return the remote command printing one `<size>[:<mtime>]:<path>` line
+    per file found by `find <find_args>`, with the `stat -c` of GNU
+    coreutils or, e.g., on macOS, the `stat -f` of BSD.
+    """
+    return (
+        "if stat -c %s . >/dev/null 2>&1; "
+        "then find {0} -exec stat -c {1} {{}} +; "
+        "else find {0} -exec stat -f {2} {{}} +; fi".format(
+            find_args,
+            "%s:%Y:%n" if mtime else "%s:%n",
+            "%z:%m:%N" if mtime else "%z:%N",
+        )
+    )
+
+
+# The name of the local manifest of fetch_results_incremental, in the local
+# results folder
+_FETCH_MANIFEST = ".fabsim_fetch_manifest.json"
+_RUN_FILE_PATTERN = re.compile(r"^(\d+):(\d+):(.*?/RUNS/[^/]+)(/.*)?$")
+
+
+def list_remote_run_states(regex: str) -> Dict[str, List]:
+    """
+    List the state of the run directories (`RUNS/*`) of the remote results
+    in `$job_results/<regex>`, with one remote command.
+
+    Returns:
+        Dict[str, List]: the number of files, total size, latest mtime and
+            completed flag (see `fetch_completed_marker`) of each run
+            directory, relative to `$job_results`
+    """
+    output = run(
+        "cd {} && {}".format(
+            env.job_results,
+            remote_find_stat(
+                "{} -path \\*/RUNS/\\* -type f".format(
+                    regex if regex else "."
+                ),
+                mtime=True,
+            ),
+        ),
+        capture=True,
+    )
+    if isinstance(output, tuple):
+        # local() returns (stdout, stderr)
+        output = output[0]
+
+    marker = env.get("fetch_completed_marker")
+    states = {}
+    for line in output.replace("\r", "").splitlines():
+        match = _RUN_FILE_PATTERN.match(line.strip())
+        if match is None:
+            # e.g., a message printed by the login shell
+            continue
+        size, mtime, run_dir, rel_path = match.groups()
+        state = states.setdefault(run_dir, [0, 0, 0, False])
+        state[0] += 1
+        state[1] += int(size)
+        state[2] = max(state[2], int(mtime))
+        if marker and rel_path == "/" + marker:
+            state[3] = True
+    return states
+
+
+def fetch_results_incremental(
+    regex: str, fetch_files: List[str], includes_files: str, workers: int
+) -> None:
+    """
+    Only fetch the new or changed run directories since the previous
+    incremental fetch, e.g., to poll the results of a running ensemble.
+
+    The number of files, total size and latest mtime of each remote run
+    directory are listed by one remote command, and compared with the local
+    manifest of the previous fetches (`.fabsim_fetch_manifest.json` in the
+    local results folder). If `fetch_completed_marker` is set, the run
+    directories without this file are still being written, and skipped.
+    """
+    manifest_path = os.path.join(env.job_results_local, _FETCH_MANIFEST)
+    manifest = {"files": fetch_files, "runs": {}}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as manifest_file:
+            previous_manifest = json.load(manifest_file)
+        # the previous fetches only apply to the same file selection
+        if previous_manifest.get("files") == fetch_files:
+            manifest = previous_manifest
+
+    states = list_remote_run_states(regex)
+    running = []
+    changed = []
+    for run_dir, (nb_files, size, mtime, completed) in sorted(
+        states.items()
+    ):
+        if env.get("fetch_completed_marker") and not completed:
+            running.append(run_dir)
+        elif manifest["runs"].get(run_dir) != [nb_files, size, mtime]:
+            changed.append(run_dir)
+    print(
+        "run directories: {} new or changed, {} unchanged, {} still "
+        "running".format(
+            len(changed), len(states) - len(changed) - len(running),
+            len(running)
+        )
+    )
+
+    def on_fetched(run_dirs: List[str]) -> None:
+        for run_dir in run_dirs:
+            manifest["runs"][run_dir] = states[run_dir][:3]
+
+    try:
+        fetch_run_dirs(
+            changed,
+            regex,
+            fetch_files,
+            includes_files,
+            max(workers, 1),
+            on_fetched=on_fetched,
+        )
+    finally:
+        # the manifest is saved even if some transfers failed, so the
+        # fetched run directories are not fetched again
+        with open(manifest_path + ".tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+
+# The extensions of already compressed files, not compressed again by rsync
+_SKIP_COMPRESS = [
+    "7z", "avi", "bz2", "deb", "flac", "gif", "gz", "h5", "jpeg", "jpg",
+    "lz", "lz4", "lzma", "mkv", "mov", "mp3", "mp4", "nc", "npz", "ogg",
+    "png", "rar", "rpm", "tbz", "tgz", "txz", "webm", "webp", "xz", "zip",
+    "zst",
+]
+
+
+def fetch_file_selected(path: str, fetch_files: List[str]) -> bool:
+    """
+    Check if a remote result file is selected by one of the `fetch_files`
+    patterns, as by the `rsync --include` filters of `fetch_results`:
+    a pattern without `/` matches the file name, and a pattern with `/`
+    matches the end of the path.
+    """
+    for pattern in fetch_files:
+        if "/" in pattern:
+            if fnmatch.fnmatch(path, "*/" + pattern.lstrip("/")):
+                return True
+        elif fnmatch.fnmatch(os.path.basename(path), pattern):
+            return True
+    return False
+
+
+def remote_find_filters(fetch_files: List[str]) -> str:
+    """
+    Return the `find` expression selecting the same files as
+    `fetch_file_selected`, escaped for `run()`, or an empty string if a
+    pattern can not be passed to the remote shell, i.e., all files are
+    listed and filtered locally.
+    """
+    if any(char in pattern for pattern in fetch_files for char in "$`\"'\\"):
+        return ""
+
+    def escape(pattern: str) -> str:
+        return re.sub(r"([^\w./-])", r"\\\1", pattern)
+
+    return "\\( {} \\)".format(
+        " -o ".join(
+            "-path \\*/{}".format(escape(pattern.lstrip("/")))
+            if "/" in pattern
+            else "-name {}".format(escape(pattern))
+            for pattern in fetch_files
+        )
+    )
+
+
+def parse_remote_file_sizes(output: str) -> Tuple[int, List[Tuple[int, str]]]:
+    """
+    Parse the output of the remote listing of `fetch_results_selective`:
+    the `du -sk` lines of the fetched folders and one `<size>:<path>` line
+    per selected file. The other lines, e.g., printed by the login shell,
+    are ignored.
+
+    Returns:
+        Tuple[int, List[Tuple[int, str]]]: the total size of the fetched
+            folders, in bytes, and the size and path of each selected file
+    """
+    total_bytes = 0
+    files = []
+    for line in output.replace("\r", "").splitlines():
+        du_match = re.match(r"^(\d+)\t", line)
+        if du_match is not None:
+            total_bytes += 1024 * int(du_match.group(1))
+            continue
+        size, sep, path = line.strip().partition(":")
+        if sep and size.isdigit() and path:
+            files.append((int(size), path))
+    return total_bytes, files
+
+
+def fetch_results_selective(regex: str, fetch_files: List[str]) -> None:
+    """
+    Fetch only the result files matching the `fetch_files` patterns: the
+    matching remote files are listed by one remote `find`, which applies
+    the patterns, and the exact list of files is transferred with
+    `rsync --files-from`, without traversing the remote results again.
+
+    The files with an already compressed format (`fetch_skip_compress`,
+    e.g., `gz`, `png`, `h5`) are not compressed by rsync, and compression is
+    disabled if all selected files are already compressed. With
+    `fetch_report_saved`, the number of bytes saved, compared with a full
+    fetch (as reported by `du`), is also reported, at the cost of one more
+    traversal of the remote results.
+    """
+    report_saved = str(env.get("fetch_report_saved", False)).lower() in (
+        "true", "1", "yes", "on"
+    )
+    find_cmd = remote_find_stat(
+        "{} -type f {}".format(
+            regex if regex else ".", remote_find_filters(fetch_files)
+        )
+    )
+    if report_saved:
+        find_cmd = "du -sk {} && {}".format(regex if regex else ".", find_cmd)
+    output = run(
+        "cd {} && {}".format(env.job_results, find_cmd), capture=True
+    )
+    if isinstance(output, tuple):
+        # local() returns (stdout, stderr)
+        output = output[0]
+    total_bytes, files = parse_remote_file_sizes(output)
+
+    skip_compress = env.get("fetch_skip_compress", _SKIP_COMPRESS)
+    selected_bytes = compressible_bytes = 0
+    selected = []
+    for size, path in files:
+        if not fetch_file_selected(path, fetch_files):
+            continue
+        selected.append(path)
+        selected_bytes += size
+        if path.rsplit(".", 1)[-1].lower() not in skip_compress:
+            compressible_bytes += size
+    if report_saved:
+        # du counts the allocated blocks, not the file sizes
+        total_bytes = max(total_bytes, selected_bytes)
+        print(
+            "selected {} files: {:.2f} MB of {:.2f} MB, {:.2f} MB ({:.1f}%)"
+            " saved compared with a full fetch".format(
+                len(selected),
+                selected_bytes / 1e6,
+                total_bytes / 1e6,
+                (total_bytes - selected_bytes) / 1e6,
+                100 * (total_bytes - selected_bytes) / max(total_bytes, 1),
+            )
+        )
+    else:
+        print(
+            "selected {} files: {:.2f} MB".format(
+                len(selected), selected_bytes / 1e6
+            )
+        )
+    if len(selected) == 0:
+        return
+
+    if compressible_bytes > 0:
+        compress_opts = "-z --skip-compress={}".format("/".join(skip_compress))
+    else:
+        compress_opts = ""
+    with tempfile.NamedTemporaryFile(
+        mode="w", suffix=".files", delete=False
+    ) as files_from:
+        files_from.write("\n".join(selected) + "\n")
+    try:
+        local(
+            template(
+                "rsync -pthv {} -e {} --files-from={} "
+                "$username@$remote:$job_results/ "
+                "$job_results_local".format(
+                    compress_opts,
+                    shlex.quote(ssh_command()),
+                    files_from.name,
+                )
             )
         )
+    finally:
+        os.remove(files_from.name)
 
 
 @task
@@ -189,8 +749,9 @@ def fetch_configs(config: str) -> None:
     else:
         local(
             template(
-                "rsync -pthrvz $username@$remote:$job_config_path/ "
-                "$job_config_path_local"
+                "rsync -pthrvz -e 'ssh {}' "
+                "$username@$remote:$job_config_path/ "
+                "$job_config_path_local".format(ssh_control_opts())
             )
         )
 
@@ -269,19 +830,25 @@ def put_configs(config: str) -> None:
         # scp a monsoonfab:~/ ; ssh monsoonfab -C “scp ~/a xcscfab:~/”
         local(
             template(
-                "scp -r $job_config_path_local "
+                "scp -r {0} $job_config_path_local "
                 "$remote:$config_path/ && "
-                "ssh $remote -C "
+                "ssh {0} $remote -C "
                 "'scp -r $job_config_path "
-                "$remote_compute:$config_path/'"
+                "$remote_compute:$config_path/'".format(ssh_control_opts())
             )
         )
 
+    elif use_tarstream() and not rsync_delete:
+        tarstream_put(
+            local_dir=env.job_config_path_local,
+            remote_dir=env.job_config_path,
+        )
     elif env.manual_sshpass:
         sshpass_args = "-e" if env.env_sshpass else "-f $sshpass"
         local(
             template(
-                f"rsync -pthrvz --rsh='sshpass {sshpass_args} ssh -p 22  ' "
+                f"rsync -pthrvz --rsh='sshpass {sshpass_args} ssh -p 22 "
+                f"{ssh_control_opts()}' "
                 "$job_config_path_local/ "
                 "$username@$remote:$job_config_path/"
             )
@@ -289,9 +856,11 @@ def put_configs(config: str) -> None:
     elif env.manual_ssh:
         local(
             template(
-                "rsync -pthrvz "
+                "rsync -pthrvz -e 'ssh {}' "
                 "$job_config_path_local/ "
-                "$username@$remote:$job_config_path/"
+                "$username@$remote:$job_config_path/".format(
+                    ssh_control_opts()
+                )
             )
         )
     elif env.manual_gsissh:
@@ -468,6 +1037,7 @@ def add_local_paths(plugin_name: str) -> None:
     )
 
 
+@profiled("with_template_job")
 @beartype
 def with_template_job(
     ensemble_mode: Optional[bool] = False, label: Optional[str] = None
@@ -571,6 +1141,18 @@ def with_template_config() -> None:
     with_config(template(env.config_name_template))
 
 
+def set_tmp_work_path(tmp_work_path: str) -> None:
+    """
+    Set the temporary folder used to save the job files/folders/scripts
+    before transmission, and create its `results` and `scripts` folders.
+    """
+    env.tmp_work_path = tmp_work_path
+    env.tmp_results_path = env.pather.join(env.tmp_work_path, "results")
+    env.tmp_scripts_path = env.pather.join(env.tmp_work_path, "scripts")
+    os.makedirs(env.tmp_scripts_path, exist_ok=True)
+    os.makedirs(env.tmp_results_path, exist_ok=True)
+
+
 def job(*job_args):
     """
     Internal low level job launcher.
@@ -611,44 +1193,254 @@ def job(*job_args):
     ########################################################
     #  temporary folder to save job files/folders/scripts  #
     ########################################################
-    env.tmp_work_path = env.pather.join(
-        tempfile._get_default_tempdir(),
-        next(tempfile._get_candidate_names()),
-        "FabSim3",
-        # env.fabric_dir
-    )
+    # the stream queue, env_base.yml and staging manifest should be created
+    # before forking the pool workers
+    global _job_stream_queue, _env_base, _staging_manifest, _job_progress
+    _staging_manifest = None
+    if use_incremental_preparation():
+        # persistent staging folder, reused by the next invocations
+        set_tmp_work_path(staging_work_path())
+        load_staging_manifest()
+    else:
+        env.tmp_work_path = env.pather.join(
+            tempfile._get_default_tempdir(),
+            next(tempfile._get_candidate_names()),
+            "FabSim3",
+            # env.fabric_dir
+        )
 
-    if os.path.exists(env.tmp_work_path):
-        rmtree(env.tmp_work_path)
-    # the config_files folder is already transfered by put_config
-    env.tmp_results_path = env.pather.join(env.tmp_work_path, "results")
-    env.tmp_scripts_path = env.pather.join(env.tmp_work_path, "scripts")
-    os.makedirs(env.tmp_scripts_path)
-    os.makedirs(env.tmp_results_path)
+        if os.path.exists(env.tmp_work_path):
+            rmtree(env.tmp_work_path)
+        # the config_files folder is already transfered by put_config
+        set_tmp_work_path(env.tmp_work_path)
+
+    stream_transmission = use_stream_transmission()
+    if stream_transmission:
+        _job_stream_queue = Queue()
+
+    _env_base = None
+    if use_compact_env_yml():
+        env_base_yml = write_env_base_yml()
+        if stream_transmission:
+            _job_stream_queue.put(
+                [os.path.relpath(env_base_yml, env.tmp_work_path)]
+            )
 
-    POOL = MultiProcessingPool(PoolSize=int(env.nb_process))
+    _job_progress = JobProgress(total_job_scripts())
+    if use_profiling():
+        enable_profiling(
+            os.path.join(os.path.dirname(env.tmp_work_path), "profile"),
+            cprofile=str(env.get("profile_cprofile", False)).lower()
+            in ("true", "1", "yes", "on"),
+        )
 
-    #####################################
-    #       job preparation phase       #
-    #####################################
+    try:
+        shared_template_cache = use_shared_template_cache()
+        if shared_template_cache:
+            start_shared_template_cache()
+        # the job script templates are loaded and analysed once by the main
+        # process, the pool workers inherit the warmed template caches; they
+        # are processed by the workers, once the env of each job is complete
+        warm_template_cache(job_script_templates())
+
+        if use_ssh_control_master():
+            # the pool workers share the ControlMaster sockets folder of the
+            # main process, which closes their master connections at exit
+            ssh_control_dir()
+        POOL = MultiProcessingPool(PoolSize=int(env.nb_process))
 
-    # Show template cache status once per job (main process only)
-    from fabsim.deploy.templates import _get_cache_setting
-    cache_enabled = _get_cache_setting()
-    cache_status = "ENABLED" if cache_enabled else "DISABLED"
+        #####################################
+        #       job preparation phase       #
+        #####################################
 
-    msg = "tmp_work_path = {}\nTemplate cache: {}".format(
-        env.tmp_work_path,
-        cache_status
-    )
-    rich_print(
-        Panel.fit(
-            msg,
-            title="[orange_red1]job preparation phase[/orange_red1]",
-            border_style="orange_red1",
+        # Show template cache status once per job (main process only)
+        from fabsim.deploy.templates import _get_cache_setting
+        cache_enabled = _get_cache_setting()
+        cache_status = "ENABLED" if cache_enabled else "DISABLED"
+
+        msg = "tmp_work_path = {}\nTemplate cache: {}".format(
+            env.tmp_work_path,
+            cache_status
         )
-    )
+        rich_print(
+            Panel.fit(
+                msg,
+                title="[orange_red1]job preparation phase[/orange_red1]",
+                border_style="orange_red1",
+            )
+        )
+
+        if stream_transmission:
+            # transfer the generated files while job preparation continues
+            stream_errors = []
+            stream_thread = threading.Thread(
+                target=job_transmission_stream,
+                args=(_job_stream_queue, stream_errors),
+            )
+            stream_thread.daemon = True
+            stream_thread.start()
+
+        # Processing nested job scripts
+        job_scripts_to_submit = []
+        job_script_info = {}
+        _job_progress.start()
+        try:
+            with _job_progress.phase("preparation"), profile_step(
+                "preparation"
+            ):
+                submit_job_preparation_tasks(POOL, args)
+                # the outputs of each task are consumed as soon as it is
+                # finished, rather than kept until all tasks are finished
+                for item in POOL.iter_task_results():
+                    if isinstance(item, tuple) and len(item) == 2:
+                        script_path, info = item
+                        job_scripts_to_submit.append(script_path)
+                        job_script_info[script_path] = info
+                    else:
+                        job_scripts_to_submit.append(item)
+        finally:
+            # Ensure we always stop the progress indicator
+            _job_progress.stop()
+            if shared_template_cache:
+                stop_shared_template_cache()
+            # the persistent template cache is bounded once per job
+            prune_template_disk_cache()
+            # the scripts saved by the finished pool workers
+            remove_script_templates(children_only=True)
+            if stream_transmission:
+                _job_stream_queue.put(None)
+                stream_thread.join()
+                _job_stream_queue = None
+
+        if stream_transmission and len(stream_errors) > 0:
+            raise RuntimeError(
+                "job transmission failed while streaming the generated "
+                "files: {}".format(stream_errors[0])
+            )
+
+        env.job_scripts_to_submit = job_scripts_to_submit
+        env.job_script_info = job_script_info
+
+        if _staging_manifest is not None:
+            save_staging_manifest(transmitted=stream_transmission)
+
+        submit_jobs = not (
+            hasattr(env, "submit_job") and env.submit_job is False
+        )
+        batch_submission = submit_jobs and use_batch_submission()
+        if batch_submission:
+            # the submit manifests are transferred with the job scripts
+            submit_files = write_submit_manifests(job_scripts_to_submit)
+            if stream_transmission:
+                transmit_job_files(
+                    [
+                        os.path.relpath(path, env.tmp_work_path)
+                        for path in submit_files
+                    ],
+                    set(),
+                    "",
+                )
+
+        #####################################
+        #       job transmission phase      #
+        #####################################
+        if stream_transmission:
+            msg = (
+                "All generated files/folder from\n"
+                "tmp_work_path = {}\n"
+                "are already streamed to\n"
+                "work_path = {}".format(env.tmp_work_path, env.work_path)
+            )
+        else:
+            msg = (
+                "Copy all generated files/folder from\n"
+                "tmp_work_path = {}\n"
+                "to\n"
+                "work_path = {}".format(env.tmp_work_path, env.work_path)
+            )
+        rich_print(
+            Panel.fit(
+                msg,
+                title="[orange_red1]job transmission phase[/orange_red1]",
+                border_style="orange_red1",
+            )
+        )
+        if not stream_transmission:
+            with _job_progress.phase("transmission"), profile_step(
+                "transmission"
+            ):
+                job_transmission()
+            if _staging_manifest is not None:
+                save_staging_manifest(transmitted=True)
+
+        if submit_jobs:
+            if _staging_manifest is not None:
+                # saved before the submission, the outputs of a partially
+                # submitted job must also be cleaned by the next invocation
+                save_staging_manifest(transmitted=True, submitted=True)
+            # submit jobs
+            #####################################
+            #       job submission phase      #
+            #####################################
+            msg = "Submit all generated job scripts to target remote machine"
+            rich_print(
+                Panel.fit(
+                    msg,
+                    title="[orange_red1]job submission phase[/orange_red1]",
+                    border_style="orange_red1",
+                )
+            )
+            with _job_progress.phase(
+                "submission", items=len(job_scripts_to_submit)
+            ), profile_step("submission"):
+                if batch_submission:
+                    job_submission_batch(job_scripts_to_submit, submit_files)
+                elif remote_concurrency() > 1 and not env.dry_run:
+                    gather(
+                        *[
+                            call_async(
+                                job_submission, dict(job_script=job_script)
+                            )
+                            for job_script in job_scripts_to_submit
+                        ]
+                    )
+                else:
+                    for job_script in job_scripts_to_submit:
+                        job_submission(dict(job_script=job_script))
+            print("submitted job script = \n{}".format(
+                pformat(job_scripts_to_submit)
+            )
+            )
+
+        _job_progress.print_summary()
+        _job_progress = None
+
+        if profiling_enabled():
+            report = write_profile_report(
+                os.path.join(
+                    env.local_results, template(env.job_name_template)
+                )
+            )
+            print("profiling report = {}".format(report))
+            template_cache_stats()
+    finally:
+        # the profiling is also reset if the job failed
+        if profiling_enabled():
+            rmtree(
+                os.path.join(os.path.dirname(env.tmp_work_path), "profile"),
+                ignore_errors=True,
+            )
+            disable_profiling()
+
+    # POOL.shutdown_threads()
+    return job_scripts_to_submit
+
 
+def submit_job_preparation_tasks(POOL: MultiProcessingPool, args: dict):
+    """
+    Add the job_preparation tasks to the pool, one per sweep item in
+    ensemble mode.
+    """
     print("Submit tasks to multiprocessingPool : start ...")
 
     if "replica_start_number" in args:
@@ -694,229 +1486,65 @@ def job(*job_args):
 
     print("Submit tasks to multiprocessingPool : done ...")
 
-    def progress_indicator():
-        """Display a simple progress bar showing script generation progress."""
-        # Calculate total scripts correctly for ensemble/sweep jobs
-        total_scripts = 0
-
-        replica_counts_check = (
-            hasattr(env, 'replica_counts') and
-            isinstance(env.replica_counts, list) and
-            len(env.replica_counts) > 0
-        )
-        if replica_counts_check:
-            # For ensemble jobs: sum all replica counts across all
-            # upsamples/sweep items
-            total_scripts = sum(env.replica_counts)
-        elif hasattr(env, 'replicas') and env.replicas:
-            # For simple replica jobs: use replicas directly, ensure it's
-            # an integer
-            try:
-                total_scripts = int(env.replicas)
-            except (ValueError, TypeError):
-                total_scripts = 0
-        else:
-            # Try to get from environment as fallback
-            try:
-                total_scripts = int(getattr(env, 'replicas', 0))
-            except (ValueError, TypeError):
-                total_scripts = 0
-
-        if total_scripts <= 0:
-            # Fallback to simple spinner if we don't know the total
-            chars = ["|", "/", "-", "\\"]
-            count = 0
-            while not progress_indicator.done:
-                print(
-                    f"\rGenerating job scripts... {chars[count % 4]} ",
-                    end="",
-                    flush=True
-                )
-                count += 1
-                time.sleep(0.5)
-            print("\rJob preparation complete!                   ")
-            return
-
-        # Progress bar implementation
-        last_count = 0
-        last_check_time = time.time()
-        check_interval = 0.1  # Base check interval
-
-        while not progress_indicator.done:
-            current_time = time.time()
-
-            # Dynamic check interval based on total scripts to reduce overhead
-            if total_scripts > 500:
-                check_interval = 0.5  # Slower updates for large jobs
-            elif total_scripts > 100:
-                check_interval = 0.3
-            else:
-                check_interval = 0.1  # Fast updates for small jobs
 
-            # Only check file count if enough time has passed
-            if current_time - last_check_time >= check_interval:
-                last_check_time = current_time
-                current_scripts = 0
+def total_job_scripts() -> int:
+    """
+    Return the number of job scripts to be generated by job_preparation,
+    or 0 if unknown.
+    """
+    # Calculate total scripts correctly for ensemble/sweep jobs
+    if (
+        hasattr(env, "replica_counts")
+        and isinstance(env.replica_counts, list)
+        and len(env.replica_counts) > 0
+    ):
+        # For ensemble jobs: sum all replica counts across all
+        # upsamples/sweep items
+        return sum(int(x) for x in env.replica_counts)
+    try:
+        return int(getattr(env, "replicas", 0) or 0)
+    except (ValueError, TypeError):
+        return 0
 
-                try:
-                    script_path_exists = (
-                        hasattr(env, 'tmp_scripts_path') and
-                        os.path.exists(env.tmp_scripts_path)
-                    )
-                    if script_path_exists:
-                        # Optimized counting: use glob for better performance
-                        # with large directories
-                        import glob
-                        script_pattern = os.path.join(env.tmp_scripts_path,
-                                                      "*.sh")
-                        current_scripts = len(glob.glob(script_pattern))
-                except Exception:
-                    current_scripts = last_count
-
-                # Only update display if count changed significantly or at
-                # completion
-                count_diff = current_scripts - last_count
-                completion_check = (
-                    current_scripts == total_scripts and
-                    last_count != total_scripts
-                )
 
-                # Smooth progress bar updates based on percentage milestones
-                # and time intervals for a more natural feel
-                current_percentage = (
-                    (current_scripts / max(1, total_scripts)) * 100
-                )
-                last_percentage = (last_count / max(1, total_scripts)) * 100
-
-                # Update on meaningful percentage increases or time
-                percentage_diff = current_percentage - last_percentage
-                min_time_update = 0.5  # Force update every 500ms minimum
-                time_since_last_update = (
-                    current_time - getattr(progress_indicator,
-                                           'last_update_time', 0)
-                )
+# Progress of the current job, reported by the job_preparation workers
+_job_progress = None
 
-                should_update = (
-                    count_diff > 0 and (
-                        percentage_diff >= 1.0 or  # Every 1% smooth progress
-                        time_since_last_update >= min_time_update or  # Time
-                        completion_check or
-                        current_scripts == total_scripts
-                    )
-                )
 
-                if should_update:
-                    progress_indicator.last_update_time = current_time
-                    last_count = current_scripts
-                    percentage = min(100,
-                                     (current_scripts / total_scripts) * 100)
+# Placeholders used by the batch preparation engine for the only env
+# variables that change between the replicas of a single sweep item.
+_JOB_RESULTS_PLACEHOLDER = "@@FABSIM_JOB_RESULTS@@"
+_REPLICA_NUMBER_PLACEHOLDER = "@@FABSIM_REPLICA_NUMBER@@"
 
-                    # Simple progress bar: [####    ] 4/10 (40%)
-                    bar_width = 20
-                    filled = int(bar_width * current_scripts / total_scripts)
-                    bar = '█' * filled + '░' * (bar_width - filled)
 
-                    print(f"\rGenerating scripts: [{bar}] "
-                          f"{current_scripts}/{total_scripts} "
-                          f"({percentage:.0f}%)",
-                          end="", flush=True)
+@profiled_task
+def job_preparation(*job_args):
+    """
+    Prepare all job folders and scripts in a temporary directory:
+        `<tmp_folder>/{results,scripts}`.
+    These files and folders are later transferred in bulk using a
+    single `rsync` command during job_transmission.
+    This reduces the number of SSH connections and improves the reliability of
+    the job submission workflow, especially under high parallelism.
 
-            time.sleep(0.05)  # Sleep to prevent excessive CPU usage
+    If `batch_preparation` is enabled (default), the replica-invariant parts
+    of the job scripts are rendered only once per sweep item, see
+    `job_preparation_batch`.
+    """
+    args = {}
+    for adict in job_args:
+        args = dict(args, **adict)
 
-        # Final update
-        final_bar = '█' * 20
-        print(f"\rScript generation complete: [{final_bar}] "
-              f"{total_scripts}/{total_scripts} (100%)           ")
-        print()  # Add a newline
+    if not hasattr(env, "job_script_info"):
+        env.job_script_info = {}
 
-    progress_indicator.done = False
-    indicator_thread = threading.Thread(target=progress_indicator)
-    indicator_thread.daemon = True
-    indicator_thread.start()
+    if "label" in args:
+        env.label = args["label"]
+    else:
+        env.label = ""
 
-    # Processing nested job scripts
-    try:
-        job_scripts_nested = POOL.wait_for_tasks()
-    finally:
-        # Ensure we always stop the progress indicator
-        progress_indicator.done = True
-        indicator_thread.join()
-
-    job_scripts_to_submit = []
-    job_script_info = {}
-    for sublist in job_scripts_nested:
-        for item in (sublist if isinstance(sublist, list) else [sublist]):
-            if isinstance(item, tuple) and len(item) == 2:
-                script_path, info = item
-                job_scripts_to_submit.append(script_path)
-                job_script_info[script_path] = info
-            else:
-                job_scripts_to_submit.append(item)
-    env.job_scripts_to_submit = job_scripts_to_submit
-    env.job_script_info = job_script_info
-
-    #####################################
-    #       job transmission phase      #
-    #####################################
-    msg = (
-        "Copy all generated files/folder from\n"
-        "tmp_work_path = {}\n"
-        "to\n"
-        "work_path = {}".format(env.tmp_work_path, env.work_path)
-    )
-    rich_print(
-        Panel.fit(
-            msg,
-            title="[orange_red1]job transmission phase[/orange_red1]",
-            border_style="orange_red1",
-        )
-    )
-    job_transmission()
-
-    if not (hasattr(env, "submit_job") and env.submit_job is False):
-        # submit jobs
-        #####################################
-        #       job submission phase      #
-        #####################################
-        msg = "Submit all generated job scripts to target remote machine"
-        rich_print(
-            Panel.fit(
-                msg,
-                title="[orange_red1]job submission phase[/orange_red1]",
-                border_style="orange_red1",
-            )
-        )
-        for job_script in job_scripts_to_submit:
-            job_submission(dict(job_script=job_script))
-        print("submitted job script = \n{}".format(
-            pformat(job_scripts_to_submit)
-        )
-        )
-
-    # POOL.shutdown_threads()
-    return job_scripts_to_submit
-
-
-def job_preparation(*job_args):
-    """
-    Prepare all job folders and scripts in a temporary directory:
-        `<tmp_folder>/{results,scripts}`.
-    These files and folders are later transferred in bulk using a
-    single `rsync` command during job_transmission.
-    This reduces the number of SSH connections and improves the reliability of
-    the job submission workflow, especially under high parallelism.
-    """
-    args = {}
-    for adict in job_args:
-        args = dict(args, **adict)
-
-    if not hasattr(env, "job_script_info"):
-        env.job_script_info = {}
-
-    if "label" in args:
-        env.label = args["label"]
-    else:
-        env.label = ""
+    if use_batch_preparation() and int(args["replicas"]) > 1:
+        return job_preparation_batch(args)
 
     return_job_scripts = []
 
@@ -930,11 +1558,7 @@ def job_preparation(*job_args):
             ensemble_mode=env.ensemble_mode, label=env.label
         )
 
-        if int(args["replicas"]) > 1:
-            if env.ensemble_mode is False:
-                env.job_results += "_replica_" + str(i)
-            else:
-                env.job_results += "_" + str(i)
+        env.job_results += replica_suffix(i, int(args["replicas"]))
 
         tmp_job_results = env.job_results.replace(
             env.results_path, env.tmp_results_path
@@ -945,137 +1569,832 @@ def job_preparation(*job_args):
 
         env.run_command = template(env.run_command)
 
-        # Store the current run_prefix (module_commands + user_commands)
-        original_run_prefix = env.run_prefix
+        env.run_prefix = job_run_prefix()
 
-        # Start with module commands only (extract from complete_environment)
-        module_commands = generate_module_commands(
-            script=env.get("script", None)
+        script_content = "\n".join(
+            [script_template_content(name) for name in job_script_templates()]
         )
-        env.run_prefix = " \n".join(module_commands) or "true"
 
-        # Add rsync commands BEFORE user commands (Fix for Issue #221)
-        if env.label not in ["PJ_PYheader", "PJ_header"]:
-            env.run_prefix += (
-                "\n\n"
-                "# copy files from config folder\n"
-                "config_dir={}\n"
-                "rsync -pthrvz --inplace --exclude SWEEP "
-                "$config_dir/* .".format(env.job_config_path)
-            )
+        # Separate base from extension
+        base, extension = os.path.splitext(script_template_filename())
+        # Initial new name if we have replicas or ensemble
+        dst_script_name = (
+            base + replica_suffix(i, int(args["replicas"])) + extension
+        )
 
-        if env.ensemble_mode:
-            env.run_prefix += (
-                "\n\n"
-                "# copy files from SWEEP folder\n"
-                "rsync -pthrvz --inplace $config_dir/SWEEP/{}/ .".format(
-                    env.label
-                )
-            )
+        # Add target job script to return list (safe mode)
+        if hasattr(env, "pj_type"):
+            script_path = env.pather.join(env.scripts_path, dst_script_name)
+        else:
+            script_path = env.pather.join(env.job_results, dst_script_name)
+        return_job_scripts.append((script_path, (env.label, str(i))))
+
+        # Store mapping for QCG/RADICAL
+        env.job_script_info[script_path] = (env.label, str(i))
 
-        # Re-add user commands AFTER rsync commands (Fix for Issue #221)
-        user_commands = []
-        if hasattr(env, 'run_prefix_commands') and env.run_prefix_commands:
-            user_commands = [
-                template(template(command))
-                for command in env.run_prefix_commands
+        run_key = staging_run_key(i, int(args["replicas"]))
+        files = staged_run_files(run_key)
+        reused = files is not None
+        if not reused:
+            files = [
+                *write_job_script(
+                    script_content, dst_script_name, tmp_job_results
+                ),
+                write_env_yml(tmp_job_results),
             ]
+        stage_job_files(run_key, files, reused)
 
-        if user_commands:
-            env.run_prefix += (
-                "\n\n# user run_prefix_commands\n" +
-                " \n".join(user_commands)
-            )
+    flush_job_files_stream()
+    flush_staged_runs()
+    return return_job_scripts
 
-        if not (hasattr(env, "venv") and str(env.venv).lower() == "true"):
-            if hasattr(env, "py_pkg") and len(env.py_pkg) > 0:
-                env.run_prefix += (
-                    "\n\n"
-                    "# Install requested python packages\n"
-                    "pip3 install --user --upgrade {}".format(
-                        " ".join(pkg for pkg in env.py_pkg)
-                    )
-                )
-        else:
-            if hasattr(env, "virtual_env_path") and env.virtual_env_path:
-                env.run_prefix += (
-                    "\n\n"
-                    "# Activate Python virtual environment\n"
-                    f"if [ -f \"{env.virtual_env_path}"
-                    "/bin/activate\" ]; then\n"
-                    f"    source {env.virtual_env_path}/bin/activate\n"
-                    "fi\n"
-                )
 
-        # Handle PilotJob vs Traditional job script generation
-        if hasattr(env, "pj_type"):
-            # PilotJob mode: Different logic for headers vs task scripts
-            if hasattr(env, "NoEnvScript") and env.NoEnvScript:
-                # This is a PilotJob header script (qcg-PJ-header)
-                # These DO need SLURM headers since they're the main scripts
-                tmp_job_script = script_templates(env.batch_header)
-            else:
-                # This is a PilotJob task script
-                # These should NOT have SLURM headers
-                tmp_job_script = script_templates("bash_header", env.script)
-        else:
-            # Traditional FabSim3 mode: All scripts get SLURM headers
-            if hasattr(env, "NoEnvScript") and env.NoEnvScript:
-                tmp_job_script = script_templates(env.batch_header)
-            else:
-                tmp_job_script = script_templates(env.batch_header, env.script)
+def job_preparation_batch(args: dict):
+    """
+    Batch version of `job_preparation` for a single sweep item.
+
+    All replicas of a sweep item share the same environment, except for
+    `job_results` and `replica_number`. Here, the environment is completed
+    and the job script is rendered only once, with placeholders for these
+    two variables, and then, for each replica, only the placeholders are
+    substituted. The generated scripts are identical to the ones generated
+    by the per-replica loop in `job_preparation`.
+    """
+    replicas = int(args["replicas"])
+    first_replica = args["replica_start_number"]
+    env.replica_number = first_replica
 
-        # Separate base from extension
-        base, extension = os.path.splitext(env.pather.basename(tmp_job_script))
-        # Initial new name if we have replicas or ensemble
+    job_results, env.job_results_local = with_template_job(
+        ensemble_mode=env.ensemble_mode, label=env.label
+    )
+    env.job_results = job_results + replica_suffix(first_replica, replicas)
+    env["job_name"] = env.name[0: env.max_job_name_chars]
+    complete_environment()
+    env.run_command = template(env.run_command)
+
+    # render the replica-invariant parts with placeholders
+    env.job_results = _JOB_RESULTS_PLACEHOLDER
+    env.replica_number = _REPLICA_NUMBER_PLACEHOLDER
+    run_prefix = job_run_prefix()
+    env.run_prefix = run_prefix
+    script_content = "\n".join(
+        [script_template_content(name) for name in job_script_templates()]
+    )
+    base, extension = os.path.splitext(script_template_filename())
 
-        if int(args["replicas"]) > 1:
-            if env.ensemble_mode is False:
-                dst_script_name = base + "_replica_" + str(i) + extension
-            else:
-                dst_script_name = base + "_" + str(i) + extension
-        else:
-            dst_script_name = base + extension
+    return_job_scripts = []
+    for i in range(first_replica, first_replica + replicas):
+        if i > first_replica:
+            # as with_template_job, called for each replica by the
+            # per-replica loop
+            env.all_job_results.append(job_results)
+            env.all_job_results_local.append(env.job_results_local)
+        env.replica_number = i
+        env.job_results = job_results + replica_suffix(i, replicas)
+        env.run_prefix = run_prefix.replace(
+            _JOB_RESULTS_PLACEHOLDER, env.job_results
+        ).replace(_REPLICA_NUMBER_PLACEHOLDER, str(i))
 
-        dst_job_script = env.pather.join(env.tmp_scripts_path, dst_script_name)
+        tmp_job_results = env.job_results.replace(
+            env.results_path, env.tmp_results_path
+        )
+        dst_script_name = base + replica_suffix(i, replicas) + extension
 
-        # Add target job script to return list (safe mode)
         if hasattr(env, "pj_type"):
             script_path = env.pather.join(env.scripts_path, dst_script_name)
         else:
             script_path = env.pather.join(env.job_results, dst_script_name)
         return_job_scripts.append((script_path, (env.label, str(i))))
-
-        # Store mapping for QCG/RADICAL
         env.job_script_info[script_path] = (env.label, str(i))
 
-        copy(tmp_job_script, dst_job_script)
-        # chmod +x dst_job_script
-        # 755 means read and execute access for everyone and also
-        # write access for the owner of the file
-        os.chmod(dst_job_script, 0o755)
+        run_key = staging_run_key(i, replicas)
+        files = staged_run_files(run_key)
+        reused = files is not None
+        if not reused:
+            files = [
+                *write_job_script(
+                    script_content.replace(
+                        _JOB_RESULTS_PLACEHOLDER, env.job_results
+                    ).replace(_REPLICA_NUMBER_PLACEHOLDER, str(i)),
+                    dst_script_name,
+                    tmp_job_results,
+                ),
+                write_env_yml(tmp_job_results),
+            ]
+        stage_job_files(run_key, files, reused)
 
-        os.makedirs(tmp_job_results, exist_ok=True)
-        copy(dst_job_script, env.pather.join(tmp_job_results, dst_script_name))
+    flush_job_files_stream()
+    flush_staged_runs()
+    return return_job_scripts
 
-        with open(
-            env.pather.join(tmp_job_results, "env.yml"), "w"
-        ) as env_yml_file:
-            yaml.dump(
-                dict(
-                    env,
-                    **{
-                        "sshpass": None,
-                        "passwords": None,
-                        "password": None,
-                        "sweepdir_items": None,
-                    },
+
+def write_job_script(
+    content: str, dst_script_name: str, tmp_job_results: str
+) -> Tuple[str, str]:
+    """
+    Write a job script once in `tmp_scripts_path`, and link it into the job
+    results directory (see `link_file`).
+
+    Returns:
+        Tuple[str, str]: the paths of the job script in `tmp_scripts_path`
+            and in the job results directory
+    """
+    dst_job_script = env.pather.join(env.tmp_scripts_path, dst_script_name)
+    with open(dst_job_script, "w") as script_file:
+        script_file.write(content)
+    # chmod +x dst_job_script
+    # 755 means read and execute access for everyone and also
+    # write access for the owner of the file
+    os.chmod(dst_job_script, 0o755)
+
+    os.makedirs(tmp_job_results, exist_ok=True)
+    results_job_script = env.pather.join(tmp_job_results, dst_script_name)
+    link_file(dst_job_script, results_job_script)
+    return dst_job_script, results_job_script
+
+
+def use_profiling() -> bool:
+    """
+    Check if the job pipeline should be profiled, enabled by `profile=true`
+    as a task argument or in machines_user.yml.
+    """
+    return str(env.get("profile", False)).lower() in (
+        "true", "1", "yes", "on"
+    )
+
+
+def use_batch_preparation() -> bool:
+    """
+    Check if the batch preparation engine should be used for job scripts.
+    It can be disabled by `batch_preparation: false` in machines_user.yml or
+    passed as a task argument.
+    """
+    return str(env.get("batch_preparation", True)).lower() in (
+        "true", "1", "yes", "on"
+    )
+
+
+def replica_suffix(replica_number: int, replicas: int) -> str:
+    """
+    Return the suffix added to the job results directory and job script
+    name of a replica.
+    """
+    if replicas <= 1:
+        return ""
+    if env.ensemble_mode is False:
+        return "_replica_" + str(replica_number)
+    return "_" + str(replica_number)
+
+
+def job_script_templates() -> Tuple[str, ...]:
+    """
+    Return the names of templates used to generate the job script.
+    """
+    # Handle PilotJob vs Traditional job script generation
+    if hasattr(env, "pj_type"):
+        # PilotJob mode: Different logic for headers vs task scripts
+        if hasattr(env, "NoEnvScript") and env.NoEnvScript:
+            # This is a PilotJob header script (qcg-PJ-header)
+            # These DO need SLURM headers since they're the main scripts
+            return (env.batch_header,)
+        # This is a PilotJob task script
+        # These should NOT have SLURM headers
+        return ("bash_header", env.script)
+    # Traditional FabSim3 mode: All scripts get SLURM headers
+    if hasattr(env, "NoEnvScript") and env.NoEnvScript:
+        return (env.batch_header,)
+    return (env.batch_header, env.script)
+
+
+def job_run_prefix() -> str:
+    """
+    Build the `run_prefix` of a job script from the current env:
+    module commands, rsync of config/SWEEP files, user run_prefix_commands
+    and python packages/VirtualEnv activation.
+    """
+    # Start with module commands only (extract from complete_environment)
+    module_commands = generate_module_commands(
+        script=env.get("script", None)
+    )
+    run_prefix = " \n".join(module_commands) or "true"
+
+    # Add rsync commands BEFORE user commands (Fix for Issue #221)
+    if env.label not in ["PJ_PYheader", "PJ_header"]:
+        run_prefix += (
+            "\n\n"
+            "# copy files from config folder\n"
+            "config_dir={}\n"
+            "rsync -pthrvz --inplace --exclude SWEEP "
+            "$config_dir/* .".format(env.job_config_path)
+        )
+
+    if env.ensemble_mode:
+        run_prefix += (
+            "\n\n"
+            "# copy files from SWEEP folder\n"
+            "rsync -pthrvz --inplace $config_dir/SWEEP/{}/ .".format(
+                env.label
+            )
+        )
+
+    # Re-add user commands AFTER rsync commands (Fix for Issue #221)
+    user_commands = []
+    if hasattr(env, 'run_prefix_commands') and env.run_prefix_commands:
+        user_commands = [
+            template(template(command))
+            for command in env.run_prefix_commands
+        ]
+
+    if user_commands:
+        run_prefix += (
+            "\n\n# user run_prefix_commands\n" +
+            " \n".join(user_commands)
+        )
+
+    if not (hasattr(env, "venv") and str(env.venv).lower() == "true"):
+        if hasattr(env, "py_pkg") and len(env.py_pkg) > 0:
+            run_prefix += (
+                "\n\n"
+                "# Install requested python packages\n"
+                "pip3 install --user --upgrade {}".format(
+                    " ".join(pkg for pkg in env.py_pkg)
+                )
+            )
+    else:
+        if hasattr(env, "virtual_env_path") and env.virtual_env_path:
+            run_prefix += (
+                "\n\n"
+                "# Activate Python virtual environment\n"
+                f"if [ -f \"{env.virtual_env_path}"
+                "/bin/activate\" ]; then\n"
+                f"    source {env.virtual_env_path}/bin/activate\n"
+                "fi\n"
+            )
+    return run_prefix
+
+
+# env variables not written in env.yml files
+_ENV_YML_EXCLUDED_VARS = {
+    "sshpass": None,
+    "passwords": None,
+    "password": None,
+    "sweepdir_items": None,
+}
+
+# The env written in env_base.yml, only set if compact_env_yml is enabled
+_env_base = None
+_env_base_yml = None
+
+
+def use_compact_env_yml() -> bool:
+    """
+    Check if the env of each run should be written as a small delta file
+    against a single `env_base.yml` per job, instead of a full `env.yml`.
+
+    Only the runs of an ensemble share a parent directory, the job results
+    directory, which is fetched with them (`fetch_results:<job_name>`). The
+    other jobs, e.g., the replicas of a single job, have one results
+    directory per run, hence always a full `env.yml`.
+    """
+    if not env.get("ensemble_mode", False):
+        return False
+    return str(env.get("compact_env_yml", False)).lower() in (
+        "true", "1", "yes", "on"
+    )
+
+
+def write_env_base_yml() -> str:
+    """
+    Dump the current env into `env_base.yml` in the job results directory
+    under `tmp_results_path`, i.e., the parent of the `RUNS` folder of an
+    ensemble. The env of each run is then written by write_env_yml as a
+    delta against this file.
+
+    !!! note
+        This function should be called before forking the job_preparation
+        workers.
+
+    Returns:
+        str: the path of the generated `env_base.yml` file
+    """
+    global _env_base, _env_base_yml
+    _env_base = my_deepcopy(dict(env, **_ENV_YML_EXCLUDED_VARS))
+    _env_base_yml = env.pather.join(
+        env.tmp_results_path, template(env.job_name_template), "env_base.yml"
+    )
+    os.makedirs(env.pather.dirname(_env_base_yml), exist_ok=True)
+    with open(_env_base_yml, "w") as env_yml_file:
+        yaml_dump(
+            _env_base, env_yml_file, safe=False, default_flow_style=False
+        )
+    return _env_base_yml
+
+
+def write_env_yml(tmp_job_results: str) -> str:
+    """
+    Dump the current env into `env.yml` in the job results directory,
+    without the variables listed in `_ENV_YML_EXCLUDED_VARS`.
+
+    If `compact_env_yml` is enabled, only the variables which differ from
+    `env_base.yml` are written in `env_delta.yml`, together with the
+    relative path of `env_base.yml`. Use `load_env_yml` to reconstruct the
+    full env of a run.
+
+    Returns:
+        str: the path of the generated `env.yml` or `env_delta.yml` file
+    """
+    env_dict = dict(env, **_ENV_YML_EXCLUDED_VARS)
+    if _env_base is not None and use_compact_env_yml():
+        env_dict = dict(
+            {
+                "__env_base__": os.path.relpath(
+                    _env_base_yml, tmp_job_results
                 ),
-                env_yml_file,
-                default_flow_style=False,
+                "__env_removed__": [
+                    key for key in _env_base if key not in env_dict
+                ],
+            },
+            **{
+                key: value
+                for key, value in env_dict.items()
+                if key not in _env_base or _env_base[key] != value
+            },
+        )
+        env_yml = env.pather.join(tmp_job_results, "env_delta.yml")
+    else:
+        env_yml = env.pather.join(tmp_job_results, "env.yml")
+
+    with open(env_yml, "w") as env_yml_file, profile_step("yaml.dump"):
+        yaml_dump(
+            env_dict, env_yml_file, safe=False, default_flow_style=False
+        )
+    return env_yml
+
+
+@beartype
+def load_env_yml(job_results: str) -> dict:
+    """
+    Load the env of a run from its (local) results directory, written
+    either as a full `env.yml` or as a compact `env_delta.yml` on top of a
+    job-wide `env_base.yml`.
+
+    Args:
+        job_results (str): the results directory of the run
+
+    Returns:
+        dict: the env variables of the run
+    """
+    env_yml = os.path.join(job_results, "env.yml")
+    if os.path.isfile(env_yml):
+        with open(env_yml) as env_yml_file:
+            return yaml_load_env(env_yml_file)
+
+    with open(os.path.join(job_results, "env_delta.yml")) as env_yml_file:
+        env_delta = yaml_load_env(env_yml_file)
+    env_base_yml = os.path.join(job_results, env_delta.pop("__env_base__"))
+    with open(env_base_yml) as env_yml_file:
+        env_dict = yaml_load_env(env_yml_file)
+    for key in env_delta.pop("__env_removed__", []):
+        env_dict.pop(key, None)
+    env_dict.update(env_delta)
+    return env_dict
+
+
+# The manifest of the persistent staging folder written by the previous
+# invocation, and the input hash of the job, only set if
+# incremental_preparation is enabled
+_staging_manifest = None
+_staging_job_hash = None
+# The results directories of the runs reused from a previous invocation
+# which was never submitted, hence not cleaned by prevent_results_overwrite
+_staging_unchanged_results_dirs = set()
+# The input hashes and files of the runs staged by the current process
+_staged_runs = {}
+
+# env variables which change between two invocations of the same job, or
+# which are part of the input hash of each run, hence not of the job
+_STAGING_VOLATILE_VARS = {
+    "local_system_time",
+    "tmp_work_path",
+    "tmp_results_path",
+    "tmp_scripts_path",
+    "job_script_info",
+    "all_job_results",
+    "all_job_results_local",
+    "sweepdir_items",
+    "replica_counts",
+    "replica_start_number",
+    "replicas",
+    "sshpass",
+    "passwords",
+    "password",
+}
+
+
+def use_incremental_preparation() -> bool:
+    """
+    Check if the job should be prepared in a persistent staging folder,
+    where only the runs whose inputs changed since the previous invocation
+    are generated and transferred again.
+    """
+    return str(env.get("incremental_preparation", False)).lower() in (
+        "true", "1", "yes", "on"
+    )
+
+
+def staging_work_path() -> str:
+    """
+    Return the persistent staging folder of the current job, under the
+    FabSim3 user cache folder. A job is identified by the target machine,
+    the remote `work_path` and the job name.
+    """
+    staging_id = hashlib.sha1(
+        "\n".join(
+            [
+                env.host,
+                str(env.get("remote", "")),
+                env.work_path,
+                template(env.job_name_template),
+            ]
+        ).encode()
+    ).hexdigest()[:16]
+    return os.path.join(fabsim_cache_dir(), "staging", staging_id, "FabSim3")
+
+
+def staging_manifest_path() -> str:
+    """
+    Return the path of the manifest of the staging folder, which is kept
+    next to, and not inside, the transferred folder.
+    """
+    return os.path.join(os.path.dirname(env.tmp_work_path), "manifest.json")
+
+
+def load_staging_manifest() -> None:
+    """
+    Load the manifest of the persistent staging folder, and compute the
+    input hash of the job from the current env.
+
+    !!! note
+        This function should be called before forking the job_preparation
+        workers.
+    """
+    global _staging_manifest, _staging_job_hash
+    global _staging_unchanged_results_dirs
+    try:
+        with open(staging_manifest_path()) as manifest_file:
+            _staging_manifest = json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+        _staging_manifest = {"transmitted": False, "runs": {}}
+    _staging_manifest.setdefault("submitted", False)
+    _staging_unchanged_results_dirs = set()
+
+    _staging_job_hash = hashlib.sha1(
+        json.dumps(
+            {
+                key: value
+                for key, value in env.items()
+                if key not in _STAGING_VOLATILE_VARS
+            },
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()
+
+
+def save_staging_manifest(
+    transmitted: Optional[bool] = False, submitted: Optional[bool] = False
+) -> None:
+    """
+    Update the manifest of the persistent staging folder with the runs
+    staged by the job_preparation workers, and remove the files of the runs
+    which are not part of the job anymore.
+
+    Args:
+        transmitted (bool, optional): `True` once all staged files are
+            transferred to the remote machine
+        submitted (bool, optional): `True` once the job scripts are
+            submitted, i.e., the remote results directories may contain
+            the outputs of the runs
+    """
+    global _staging_manifest, _staging_unchanged_results_dirs
+    manifest_dir = os.path.join(os.path.dirname(env.tmp_work_path), "runs")
+    if os.path.isdir(manifest_dir):
+        runs = {}
+        for filename in os.listdir(manifest_dir):
+            with open(os.path.join(manifest_dir, filename)) as manifest_file:
+                runs.update(json.load(manifest_file))
+        rmtree(manifest_dir)
+
+        staged_files = {
+            filename for run in runs.values() for filename in run["files"]
+        }
+        for run in _staging_manifest["runs"].values():
+            for filename in run["files"]:
+                path = os.path.join(env.tmp_work_path, filename)
+                if filename not in staged_files and os.path.isfile(path):
+                    os.remove(path)
+                    try:
+                        os.rmdir(os.path.dirname(path))
+                    except OSError:
+                        # not empty
+                        pass
+
+        reused_runs = {
+            run_key
+            for run_key, run in runs.items()
+            if _staging_manifest["runs"].get(run_key) == run
+        }
+        print(
+            "incremental preparation: {} runs reused, {} runs generated, "
+            "{} runs removed".format(
+                len(reused_runs),
+                len(runs) - len(reused_runs),
+                len(set(_staging_manifest["runs"]) - set(runs)),
             )
+        )
+        _staging_unchanged_results_dirs = set()
+        if not _staging_manifest["submitted"]:
+            # a results directory is only kept if all of its runs are
+            # reused
+            changed_results_dirs = set()
+            for run_key, run in runs.items():
+                results_dirs = {
+                    filename.split(os.sep)[1]
+                    for filename in run["files"]
+                    if filename.startswith("results" + os.sep)
+                }
+                if run_key in reused_runs:
+                    _staging_unchanged_results_dirs |= results_dirs
+                else:
+                    changed_results_dirs |= results_dirs
+            _staging_unchanged_results_dirs -= changed_results_dirs
+        _staging_manifest = {
+            "transmitted": False,
+            "submitted": False,
+            "runs": runs,
+        }
 
-    return return_job_scripts
+    _staging_manifest["transmitted"] = transmitted
+    _staging_manifest["submitted"] = submitted
+    with open(staging_manifest_path(), "w") as manifest_file:
+        json.dump(_staging_manifest, manifest_file)
+
+
+def staging_run_key(replica_number: int, replicas: int) -> Optional[str]:
+    """
+    Compute the input hash of a run, from the job input hash, the raw job
+    script templates, the contents of the SWEEP folder of the run and its
+    replica number, and return the run key if incremental preparation is
+    enabled.
+    """
+    if _staging_manifest is None:
+        return None
+
+    run_key = "{}/{}".format(env.label, replica_number)
+    run_hash = hashlib.sha1(_staging_job_hash.encode())
+    for template_name in job_script_templates():
+        run_hash.update(script_template_source(template_name).encode())
+    run_hash.update(sweep_dir_hash(env.label).encode())
+    run_hash.update("{}/{}".format(run_key, replicas).encode())
+    _staged_runs[run_key] = {"hash": run_hash.hexdigest(), "files": []}
+    return run_key
+
+
+def sweep_dir_hash(label: str) -> str:
+    """
+    Return the content hash of the local `$sweep_dir/<label>` folder, or an
+    empty string if there is no such folder.
+    """
+    sweep_dir = env.get("sweep_dir", None)
+    if not label or not sweep_dir:
+        return ""
+    sweep_dir = os.path.join(sweep_dir, label)
+    if not os.path.isdir(sweep_dir):
+        return ""
+
+    sweep_hash = hashlib.sha1()
+    for root, dirs, files in os.walk(sweep_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            sweep_hash.update(os.path.relpath(path, sweep_dir).encode())
+            with open(path, "rb") as sweep_file:
+                for chunk in iter(lambda: sweep_file.read(1 << 20), b""):
+                    sweep_hash.update(chunk)
+    return sweep_hash.hexdigest()
+
+
+def staged_run_files(run_key: Optional[str]) -> Optional[List[str]]:
+    """
+    Return the files of a run staged by a previous invocation, if its input
+    hash did not change and all of its files are still in the staging
+    folder, otherwise `None`.
+    """
+    if run_key is None:
+        return None
+    previous_run = _staging_manifest["runs"].get(run_key)
+    if previous_run is None:
+        return None
+    if previous_run["hash"] != _staged_runs[run_key]["hash"]:
+        return None
+
+    files = [
+        os.path.join(env.tmp_work_path, filename)
+        for filename in previous_run["files"]
+    ]
+    if not all(os.path.isfile(path) for path in files):
+        return None
+    return files
+
+
+def stage_job_files(
+    run_key: Optional[str], files: List[str], reused: bool
+) -> None:
+    """
+    Record the files of a run in the staging manifest, and stream them to
+    the remote machine unless they were reused from a previous invocation
+    which already transferred them, and was never submitted (otherwise the
+    remote results directory is emptied and transferred again).
+    """
+    if run_key is not None:
+        _staged_runs[run_key]["files"] = [
+            os.path.relpath(path, env.tmp_work_path) for path in files
+        ]
+    if not (
+        reused
+        and _staging_manifest["transmitted"]
+        and not _staging_manifest["submitted"]
+    ):
+        stream_job_files(*files)
+    if _job_progress is not None:
+        _job_progress.increment()
+
+
+def flush_staged_runs() -> None:
+    """
+    Write the runs staged by the current job_preparation task, to be merged
+    in the staging manifest by `save_staging_manifest`.
+    """
+    if not _staged_runs:
+        return
+    manifest_dir = os.path.join(os.path.dirname(env.tmp_work_path), "runs")
+    os.makedirs(manifest_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=manifest_dir, suffix=".json", delete=False
+    ) as manifest_file:
+        json.dump(_staged_runs, manifest_file)
+    _staged_runs.clear()
+
+
+# Queue used by the job_preparation workers to stream the generated files to
+# job_transmission_stream, only set if stream_transmission is enabled
+_job_stream_queue = None
+_job_stream_buffer = []
+
+
+def use_stream_transmission() -> bool:
+    """
+    Check if the generated job files should be transferred while the job
+    preparation is still running. Streaming is only supported by the
+    default `rsync_project` transmission.
+    """
+    if str(env.get("stream_transmission", False)).lower() not in (
+        "true", "1", "yes", "on"
+    ):
+        return False
+    return not (
+        env.ssh_monsoon_mode or env.manual_sshpass or env.manual_gsissh
+    )
+
+
+def stream_job_files(*paths: str) -> None:
+    """
+    Add the generated job files to the stream of files to be transferred.
+    The files are sent to job_transmission_stream in batches of
+    `stream_chunk_size` files.
+
+    Args:
+        paths (str): the path of the generated files under `tmp_work_path`
+    """
+    if _job_stream_queue is None:
+        return
+    _job_stream_buffer.extend(
+        os.path.relpath(path, env.tmp_work_path) for path in paths
+    )
+    if len(_job_stream_buffer) >= int(env.get("stream_chunk_size", 1000)):
+        flush_job_files_stream()
+
+
+def flush_job_files_stream() -> None:
+    """
+    Send the remaining buffered job files to job_transmission_stream.
+    """
+    if _job_stream_queue is None or len(_job_stream_buffer) == 0:
+        return
+    _job_stream_queue.put(_job_stream_buffer[:])
+    del _job_stream_buffer[:]
+
+
+def job_transmission_stream(stream_queue, errors: list) -> None:
+    """
+    Transfer the generated job files, streamed by the job_preparation
+    workers, while the job preparation is still running.
+    Files are transferred in chunks of (at least) `stream_chunk_size` files
+    using `rsync --files-from`, until `None` is received.
+
+    Args:
+        stream_queue (Queue): the queue of lists of generated files,
+            relative to `tmp_work_path`
+        errors (list): any exception raised during the transmission is
+            added to this list
+    """
+    chunk_size = int(env.get("stream_chunk_size", 1000))
+    empty_folder = "/tmp/{}".format(next(tempfile._get_candidate_names()))
+    cleaned_results_dirs = set()
+    pending_files = []
+    done = False
+    while not done:
+        files = stream_queue.get()
+        if files is None:
+            done = True
+        else:
+            pending_files.extend(files)
+
+        if len(pending_files) == 0 or (
+            not done and len(pending_files) < chunk_size
+        ):
+            continue
+
+        # keep consuming the queue after a failure, so the workers are
+        # never blocked, but do not try to transfer anything else
+        if len(errors) == 0:
+            try:
+                with profile_step("transmission"):
+                    transmit_job_files(
+                        pending_files, cleaned_results_dirs, empty_folder
+                    )
+            except Exception as e:
+                errors.append(e)
+        pending_files = []
+
+
+def transmit_job_files(
+    files: list, cleaned_results_dirs: set, empty_folder: str
+) -> None:
+    """
+    Transfer the input list of generated job files, relative to
+    `tmp_work_path`, to `scripts_path` and `results_path` on the remote
+    machine.
+
+    Args:
+        files (list): the files to be transferred
+        cleaned_results_dirs (set): the results directories already emptied
+            when `prevent_results_overwrite` is set to `delete`
+        empty_folder (str): an empty folder on the remote machine, used by
+            clean_remote_results_dir
+    """
+    sync_files = {"scripts": [], "results": []}
+    for path in files:
+        sub_dir, rel_path = path.split(os.sep, 1)
+        sync_files[sub_dir].append(rel_path)
+
+    if (
+        hasattr(env, "prevent_results_overwrite")
+        and env.prevent_results_overwrite == "delete"
+    ):
+        results_dir_items = []
+        for rel_path in sync_files["results"]:
+            results_dir_item = rel_path.split(os.sep, 1)[0]
+            if results_dir_item not in cleaned_results_dirs:
+                results_dir_items.append(results_dir_item)
+                cleaned_results_dirs.add(results_dir_item)
+        clean_remote_results_dirs(results_dir_items, empty_folder)
+
+    if use_single_pass_transmission():
+        # the files are already relative to tmp_work_path
+        rsync_src_dst_files = [(env.tmp_work_path, env.work_path, files)]
+    else:
+        rsync_src_dst_files = [
+            (env.tmp_scripts_path, env.scripts_path, sync_files["scripts"]),
+            (env.tmp_results_path, env.results_path, sync_files["results"]),
+        ]
+
+    for sync_src, sync_dst, sync_list in rsync_src_dst_files:
+        if len(sync_list) == 0:
+            continue
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=env.tmp_work_path, suffix=".files", delete=False
+        ) as files_from:
+            files_from.write("\n".join(sync_list) + "\n")
+        try:
+            rsync_project(
+                local_dir=sync_src + "/",
+                remote_dir=sync_dst,
+                files_from=files_from.name,
+                default_opts="-pthrz",
+            )
+        finally:
+            os.remove(files_from.name)
 
 
 def job_transmission(*job_args):
@@ -1104,103 +2423,347 @@ def job_transmission(*job_args):
         #       rsync -a --delete, but I am not sure if we can use it on
         #       all HPC resources
         empty_folder = "/tmp/{}".format(next(tempfile._get_candidate_names()))
-        results_dir_items = os.listdir(env.tmp_results_path)
-        for results_dir_item in results_dir_items:
-            print("empty folder: ", empty_folder)
-            print("results_dir_item: ", results_dir_item)
+        # the results directories of the unchanged runs of a previous
+        # invocation which was never submitted only contain the same input
+        # files, which are updated incrementally
+        results_dir_items = [
+            results_dir_item
+            for results_dir_item in os.listdir(env.tmp_results_path)
+            if results_dir_item not in _staging_unchanged_results_dirs
+        ]
+        clean_remote_results_dirs(results_dir_items, empty_folder)
+
+    start_time = time.time()
+    if use_single_pass_transmission():
+        transmit_job_trees()
+    else:
+        rsyc_src_dst_folders = []
+        rsyc_src_dst_folders.append((env.tmp_scripts_path, env.scripts_path))
+        rsyc_src_dst_folders.append((env.tmp_results_path, env.results_path))
+
+        for sync_src, sync_dst in rsyc_src_dst_folders:
             if env.ssh_monsoon_mode:
-                task_string = template(
-                    "mkdir -p {} && "
-                    "mkdir -p {}/results/{} && "
-                    "rm -rf {}/results/{}/*".format(
-                        empty_folder,
-                        env.work_path,
-                        results_dir_item,
-                        env.work_path,
-                        results_dir_item,
+                # local(
+                #    template(
+                #        "scp -r "
+                #        "{}/* $username@$remote:{}/ ".format(
+                #            sync_src, sync_dst
+                #        )
+                #    )
+                # )
+                # scp a monsoonfab:~/ ; ssh monsoonfab -C “scp ~/a xcscfab:~/”
+                local(
+                    template(
+                        "ssh {0} $remote -C "
+                        "'mkdir -p {1}' && "
+                        "scp -r {0} {2} "
+                        "$username@$remote:{1}/../ && "
+                        "ssh {0} $remote -C "
+                        "'scp -r {1} "
+                        "$remote_compute:{1}/../'".format(
+                            ssh_control_opts(),
+                            sync_dst,
+                            sync_src,
+                        )
                     )
                 )
-
-                run(
+            elif env.manual_sshpass:
+                sshpass_args = "-e" if env.env_sshpass else "-f $sshpass"
+                # TODO: maybe the better option here is to overwrite the
+                #       rsync_project
+                local(
                     template(
-                        "{} ; ssh $remote_compute -C"
-                        "'{}'".format(
-                            task_string,
-                            task_string,
-                        )
+                        "rsync -pthrvz "
+                        f"--rsh='sshpass {sshpass_args} ssh -p 22 "
+                        f"{ssh_control_opts()}' "
+                        "{}/ $username@$remote:{}/ ".format(sync_src, sync_dst)
                     )
                 )
-
-            else:
-                run(
+            elif env.manual_gsissh:
+                # TODO: implement prevent_results_overwrite for this option
+                local(
                     template(
-                        "mkdir -p {} && "
-                        "mkdir -p {}/results &&"
-                        "rsync -a --delete --inplace {}/ "
-                        "{}/results/{}/".format(
-                            empty_folder,
-                            env.work_path,
-                            empty_folder,
-                            env.work_path,
-                            results_dir_item,
-                        )
+                        "globus-url-copy -p 10 -cd -r -sync "
+                        "file://{}/ "
+                        "gsiftp://$remote/{}/".format(sync_src, sync_dst)
                     )
                 )
+            else:
+                rsync_project(local_dir=sync_src + "/", remote_dir=sync_dst)
+    report_transmission_throughput(time.time() - start_time)
+
+
+def use_single_pass_transmission() -> bool:
+    """
+    Check if the `scripts` and `results` trees can be transferred by one
+    `rsync` of `tmp_work_path` to `work_path`, instead of one `rsync` per
+    tree. This requires the default layout of the remote folders, and is not
+    supported by `ssh_monsoon_mode` and `manual_gsissh`.
+    """
+    return (
+        not (env.ssh_monsoon_mode or env.manual_gsissh)
+        and env.scripts_path == env.pather.join(env.work_path, "scripts")
+        and env.results_path == env.pather.join(env.work_path, "results")
+        and env.tmp_scripts_path
+        == env.pather.join(env.tmp_work_path, "scripts")
+        and env.tmp_results_path
+        == env.pather.join(env.tmp_work_path, "results")
+    )
+
+
+def transmit_job_trees() -> None:
+    """
+    Transfer the `scripts` and `results` trees of `tmp_work_path` to
+    `work_path` in one pass, i.e., one ssh connection and one file list
+    exchange, with rsync filters selecting the two trees, or as one tar
+    stream with `transfer_mode: tarstream`.
+    """
+    include = ["/scripts/***", "/results/***"]
+    exclude = ["*"]
+    if use_tarstream():
+        tarstream_put(
+            local_dir=env.tmp_work_path,
+            remote_dir=env.work_path,
+            members=["scripts", "results"],
+        )
+    elif env.manual_sshpass:
+        sshpass_args = "-e" if env.env_sshpass else "-f $sshpass"
+        local(
+            template(
+                "rsync -pthrvz "
+                f"--rsh='sshpass {sshpass_args} ssh -p 22 "
+                f"{ssh_control_opts()}' "
+                "{} {} {}/ $username@$remote:{}/ ".format(
+                    " ".join("--include={}".format(item) for item in include),
+                    " ".join("--exclude={}".format(item) for item in exclude),
+                    env.tmp_work_path,
+                    env.work_path,
+                )
+            )
+        )
+    else:
+        rsync_project(
+            local_dir=env.tmp_work_path + "/",
+            remote_dir=env.work_path,
+            include=include,
+            exclude=exclude,
+        )
+
+
+def report_transmission_throughput(elapsed: float) -> None:
+    """
+    Print the number of files and bytes of the transferred `scripts` and
+    `results` trees, and the transfer throughput.
+
+    Args:
+        elapsed (float): the transmission time in seconds
+    """
+    nb_files = 0
+    nb_bytes = 0
+    for tree in (env.tmp_scripts_path, env.tmp_results_path):
+        for root, _, filenames in os.walk(tree):
+            for filename in filenames:
+                nb_files += 1
+                nb_bytes += os.lstat(os.path.join(root, filename)).st_size
+    elapsed = max(elapsed, 1e-9)
+    print(
+        "transmitted {} files ({:.2f} MB) in {:.2f} s: "
+        "{:.2f} MB/s, {:.1f} files/s".format(
+            nb_files,
+            nb_bytes / 1e6,
+            elapsed,
+            nb_bytes / 1e6 / elapsed,
+            nb_files / elapsed,
+        )
+    )
+
+
+def run_remote_script(script: str) -> None:
+    """
+    Execute a bash script on the remote machine, in two round-trips
+    whatever its size: the script is uploaded to `/tmp` with `put`, and
+    executed (and removed) by one `run` command. In `ssh_monsoon_mode`, the
+    script is also executed on `remote_compute`.
+
+    Args:
+        script (str): the content of the bash script
+    """
+    remote_script = "/tmp/fabsim_{}.sh".format(
+        next(tempfile._get_candidate_names())
+    )
+    with tempfile.NamedTemporaryFile(
+        mode="w", suffix=".sh", delete=False
+    ) as local_script:
+        local_script.write(script)
+    try:
+        put(local_script.name, remote_script)
+    finally:
+        os.remove(local_script.name)
+
+    # the script is left in /tmp if it fails, for debugging
+    if env.ssh_monsoon_mode:
+        run(
+            template(
+                "bash {0} && ssh $remote_compute -C bash -s < {0} && "
+                "rm -f {0}".format(remote_script)
+            )
+        )
+    else:
+        run("bash {0} && rm -f {0}".format(remote_script))
+
+
+def clean_remote_results_dirs_script(
+    results_dir_items: List[str],
+    empty_folder: str,
+    results_path: Optional[str] = None,
+) -> str:
+    """
+    Return the bash script emptying the remote results directories, see
+    `clean_remote_results_dir`.
+
+    Args:
+        results_dir_items (List[str]): the names of the results directories
+        empty_folder (str): an empty folder on the remote machine, used as
+            `rsync --delete` source
+        results_path (str, optional): the folder of the results
+            directories, `$work_path/results` by default
+    """
+    if results_path is None:
+        results_path = "{}/results".format(env.work_path)
+    if env.ssh_monsoon_mode:
+        clean_cmd = 'rm -rf "$results_dir_item"/*'
+    else:
+        clean_cmd = (
+            'rsync -a --delete --inplace "$empty_folder/" "$results_dir_item/"'
+        )
+    return "\n".join(
+        [
+            "set -e",
+            "empty_folder={}".format(shlex.quote(empty_folder)),
+            'mkdir -p "$empty_folder"',
+            "mkdir -p {0} && cd {0}".format(shlex.quote(results_path)),
+            "while IFS= read -r results_dir_item; do",
+            '    mkdir -p "$results_dir_item"',
+            "    {}".format(clean_cmd),
+            "done <<'FABSIM_RESULTS_DIRS'",
+            *results_dir_items,
+            "FABSIM_RESULTS_DIRS",
+            'rmdir "$empty_folder"',
+            "",
+        ]
+    )
+
+
+def clean_remote_results_dirs(
+    results_dir_items: List[str],
+    empty_folder: str,
+    results_path: Optional[str] = None,
+) -> None:
+    """
+    Empty the remote results directories `results_dir_items`, used when
+    `prevent_results_overwrite` is set to `delete`.
+
+    All directories are emptied by one remote script (see
+    `run_remote_script`), i.e., two round-trips instead of one per results
+    directory. With `manual_sshpass` and `manual_gsissh`, where `put` is not
+    supported, the directories are emptied by one `run` command each.
+
+    Args:
+        results_dir_items (List[str]): the names of the results directories
+        empty_folder (str): an empty folder on the remote machine, used as
+            `rsync --delete` source
+        results_path (str, optional): the folder of the results
+            directories, `$work_path/results` by default
+    """
+    if len(results_dir_items) == 0:
+        return
+
+    if env.manual_sshpass or env.manual_gsissh:
+        gather(
+            *[
+                call_async(
+                    clean_remote_results_dir,
+                    results_dir_item,
+                    empty_folder,
+                    results_path,
+                )
+                for results_dir_item in results_dir_items
+            ]
+        )
+        return
+
+    print(
+        "empty {} results directories, empty folder: {}".format(
+            len(results_dir_items), empty_folder
+        )
+    )
+    run_remote_script(
+        clean_remote_results_dirs_script(
+            results_dir_items, empty_folder, results_path
+        )
+    )
 
-    rsyc_src_dst_folders = []
-    rsyc_src_dst_folders.append((env.tmp_scripts_path, env.scripts_path))
-    rsyc_src_dst_folders.append((env.tmp_results_path, env.results_path))
-
-    for sync_src, sync_dst in rsyc_src_dst_folders:
-        if env.ssh_monsoon_mode:
-            # local(
-            #    template(
-            #        "scp -r "
-            #        "{}/* $username@$remote:{}/ ".format(sync_src, sync_dst)
-            #    )
-            # )
-            # scp a monsoonfab:~/ ; ssh monsoonfab -C “scp ~/a xcscfab:~/”
-            local(
-                template(
-                    "ssh $remote -C "
-                    "'mkdir -p {}' && "
-                    "scp -r {} "
-                    "$username@$remote:{}/../ && "
-                    "ssh $remote -C "
-                    "'scp -r {} "
-                    "$remote_compute:{}/../'".format(
-                        sync_dst,
-                        sync_src,
-                        sync_dst,
-                        sync_dst,
-                        sync_dst,
-                    )
-                )
+
+def clean_remote_results_dir(
+    results_dir_item: str,
+    empty_folder: str,
+    results_path: Optional[str] = None,
+):
+    """
+    Empty the remote results directory `results_dir_item`, used when
+    `prevent_results_overwrite` is set to `delete`.
+
+    Args:
+        results_dir_item (str): the name of the results directory under
+            `$work_path/results`
+        empty_folder (str): an empty folder on the remote machine, used as
+            `rsync --delete` source
+        results_path (str, optional): the folder of the results
+            directories, `$work_path/results` by default
+    """
+    if results_path is None:
+        results_path = "{}/results".format(env.work_path)
+    if env.ssh_monsoon_mode:
+        task_string = template(
+            "mkdir -p {} && "
+            "mkdir -p {}/{} && "
+            "rm -rf {}/{}/*".format(
+                empty_folder,
+                results_path,
+                results_dir_item,
+                results_path,
+                results_dir_item,
             )
-        elif env.manual_sshpass:
-            sshpass_args = "-e" if env.env_sshpass else "-f $sshpass"
-            # TODO: maybe the better option here is to overwrite the
-            #       rsync_project
-            local(
-                template(
-                    "rsync -pthrvz "
-                    f"--rsh='sshpass {sshpass_args} ssh -p 22  ' "
-                    "{}/ $username@$remote:{}/ ".format(sync_src, sync_dst)
+        )
+
+        run(
+            template(
+                "{} ; ssh $remote_compute -C"
+                "'{}'".format(
+                    task_string,
+                    task_string,
                 )
             )
-        elif env.manual_gsissh:
-            # TODO: implement prevent_results_overwrite for this option
-            local(
-                template(
-                    "globus-url-copy -p 10 -cd -r -sync "
-                    "file://{}/ "
-                    "gsiftp://$remote/{}/".format(sync_src, sync_dst)
+        )
+
+    else:
+        run(
+            template(
+                "mkdir -p {} && "
+                "mkdir -p {} &&"
+                "rsync -a --delete --inplace {}/ "
+                "{}/{}/".format(
+                    empty_folder,
+                    results_path,
+                    empty_folder,
+                    results_path,
+                    results_dir_item,
                 )
             )
-        else:
-            rsync_project(local_dir=sync_src + "/", remote_dir=sync_dst)
+        )
 
 
+@profiled("job_submission")
 def job_submission(*job_args):
     """
     here, all prepared job scrips will be submitted to the
@@ -1278,6 +2841,903 @@ def job_submission(*job_args):
     return [job_script]
 
 
+# Patterns of the job ID in the output of the job_dispatch commands
+_JOB_ID_PATTERNS = [
+    re.compile(r"^Submitted batch job (\d+)", re.MULTILINE),  # sbatch
+    re.compile(r"^Job <(\d+)> is submitted", re.MULTILINE),  # bsub
+    re.compile(r'The job "(\S+)" has been submitted'),  # llsubmit
+    # qsub (PBS Pro, Torque): <sequence number>[[]].<server name>
+    re.compile(
+        r"^(\d+(?:\[\d*\])?\.[A-Za-z][\w.-]*)$", re.MULTILINE
+    ),
+    # qsub (Grid Engine)
+    re.compile(r"^Your job(?:-array)? (\d+)", re.MULTILINE),
+]
+
+
+def use_batch_submission() -> bool:
+    """
+    Check if the job scripts should be submitted in batches, by a few
+    remote commands, instead of one remote command per job script. Batch
+    submission is only supported by the default remote submission, i.e.,
+    not for `dispatch_jobs_on_localhost`, `dry_run`, `ssh_monsoon_mode` or
+    `remote: localhost` machines.
+    """
+    if str(env.get("batch_submission", False)).lower() not in (
+        "true", "1", "yes", "on"
+    ):
+        return False
+    return not (
+        env.get("dispatch_jobs_on_localhost", False) is True
+        or env.get("noexec", False)
+        or env.get("dry_run", False)
+        or env.get("ssh_monsoon_mode", False)
+        or env.remote == "localhost"
+    )
+
+
+def write_submit_manifests(job_scripts: List[str]) -> List[str]:
+    """
+    Write the submit manifests of the input job scripts in
+    `tmp_scripts_path`, to be transferred with the job scripts: a
+    `<prefix>.sh` script which submits all job scripts listed in the file
+    given as argument, and one `<prefix>_<n>.manifest` per chunk of
+    `batch_submission_chunk_size` job scripts.
+
+    Returns:
+        List[str]: the paths of the written files
+    """
+    # the name of the temporary (or staging) folder identifies the job
+    prefix = env.pather.join(
+        env.tmp_scripts_path,
+        "fabsim_submit_{}".format(
+            os.path.basename(os.path.dirname(env.tmp_work_path))
+        ),
+    )
+    files = [prefix + ".sh"]
+    with open(files[0], "w") as submit_script:
+        submit_script.write(
+            "#!/bin/bash\n"
+            "# submit all job scripts listed in the manifest file $1\n"
+            "while IFS= read -r job_script; do\n"
+            '    [ -n "$job_script" ] || continue\n'
+            '    echo "FABSIM_SUBMIT_BEGIN $job_script"\n'
+            '    ( cd "$(dirname "$job_script")" && {} "$job_script" ) 2>&1\n'
+            '    echo "FABSIM_SUBMIT_END $? $job_script"\n'
+            'done < "$1"\n'.format(
+                template("$job_dispatch", number_of_iterations=2)
+            )
+        )
+
+    chunk_size = int(env.get("batch_submission_chunk_size", 1000))
+    for index in range(0, len(job_scripts), chunk_size):
+        files.append("{}_{}.manifest".format(prefix, index // chunk_size))
+        with open(files[-1], "w") as manifest:
+            manifest.write(
+                "\n".join(job_scripts[index: index + chunk_size]) + "\n"
+            )
+    return files
+
+
+def parse_submit_output(output: str) -> Dict[str, Tuple[int, str]]:
+    """
+    Parse the output of the submit script written by
+    `write_submit_manifests`.
+
+    Returns:
+        Dict[str, Tuple[int, str]]: the return code and job ID (or the
+            command output, if no job ID is found) of each job script
+    """
+    submitted = {}
+    job_script = None
+    job_output = []
+    for line in output.replace("\r", "").splitlines():
+        if line.startswith("FABSIM_SUBMIT_BEGIN "):
+            job_script = line[len("FABSIM_SUBMIT_BEGIN "):]
+            job_output = []
+        elif line.startswith("FABSIM_SUBMIT_END ") and job_script:
+            return_code = int(line.split(" ", 2)[1])
+            job_output = "\n".join(job_output).strip()
+            job_id = job_output
+            for pattern in _JOB_ID_PATTERNS:
+                match = pattern.search(job_output)
+                if match:
+                    job_id = match.group(1)
+                    break
+            submitted[job_script] = (return_code, job_id)
+            job_script = None
+        elif job_script:
+            job_output.append(line)
+    return submitted
+
+
+def job_submission_batch(job_scripts: List[str], submit_files: List[str]):
+    """
+    Submit all job scripts with one remote command per submit manifest
+    written by `write_submit_manifests`, and parse the scheduler job IDs.
+
+    The job IDs are stored in `env.submitted_job_ids`, a dict from the job
+    script path to its job ID.
+    """
+    submit_script = env.pather.join(
+        env.scripts_path, os.path.basename(submit_files[0])
+    )
+    submitted = {}
+    for manifest in submit_files[1:]:
+        output = run(
+            "bash {} {}".format(
+                submit_script,
+                env.pather.join(env.scripts_path, os.path.basename(manifest)),
+            ),
+            cd=env.scripts_path,
+            capture=True,
+        )
+        if isinstance(output, tuple):
+            # local() returns (stdout, stderr)
+            output = output[0]
+        submitted.update(parse_submit_output(output))
+
+    env.submitted_job_ids = {
+        job_script: job_id
+        for job_script, (return_code, job_id) in submitted.items()
+        if return_code == 0
+    }
+    failed = [
+        job_script
+        for job_script in job_scripts
+        if submitted.get(job_script, (1,))[0] != 0
+    ]
+    print(
+        "submitted {} job scripts with {} remote commands".format(
+            len(env.submitted_job_ids), len(submit_files) - 1
+        )
+    )
+    print(
+        "Use \33[31mfabsim {} fetch_results\33[0m to copy the results "
+        "back to local machine!".format(env.machine_name)
+    )
+    if len(failed) > 0:
+        raise RuntimeError(
+            "{} job scripts could not be submitted:\n{}".format(
+                len(failed),
+                "\n".join(
+                    "{}: {}".format(
+                        job_script, submitted.get(job_script, (1, ""))[1]
+                    )
+                    for job_script in failed
+                ),
+            )
+        )
+    return env.submitted_job_ids
+
+
+@task
+@beartype
+def benchmark_job_preparation(
+    config: str,
+    replicas: Optional[str] = "1000;10000;100000",
+    modes: Optional[str] = "legacy;batch",
+    **args,
+) -> None:
+    """
+    Benchmark the job preparation phase (job scripts and env.yml
+    generation) in the local temporary folder, without any transmission or
+    submission, and report the number of generated scripts per second.
+
+    Example Usage:
+
+    ```sh
+    fabsim localhost benchmark_job_preparation:dummy_test,script=dummy
+    fabsim localhost benchmark_job_preparation:dummy_test,replicas="1000"
+    ```
+
+    Args:
+        config (str): the name of config directory
+        replicas (str, optional): `;` separated list of number of replicas
+        modes (str, optional): `;` separated list of preparation engines to
+            be compared, `legacy` (per-replica env completion) and/or
+            `batch` (see `job_preparation_batch`)
+    """
+    update_environment(args)
+    with_config(config)
+    calc_nodes()
+    calc_total_mem()
+    env.ensemble_mode = False
+
+    table = Table(
+        title="\n\nJob preparation benchmark",
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("replicas", style="blue")
+    table.add_column("mode", style="blue")
+    table.add_column("time (s)", style="magenta")
+    table.add_column("scripts/second", style="magenta")
+
+    batch_preparation = env.get("batch_preparation", True)
+    for nb_replicas in [int(x) for x in replicas.split(";")]:
+        for mode in modes.split(";"):
+            env.batch_preparation = mode == "batch"
+            set_tmp_work_path(tempfile.mkdtemp(prefix="FabSim3_bench_"))
+            env.job_script_info = {}
+            try:
+                start_time = time.time()
+                job_preparation(
+                    dict(replica_start_number=1, replicas=nb_replicas)
+                )
+                elapsed = time.time() - start_time
+            finally:
+                rmtree(env.tmp_work_path)
+            table.add_row(
+                str(nb_replicas),
+                mode,
+                "{:.3f}".format(elapsed),
+                "{:.1f}".format(nb_replicas / max(elapsed, 1e-9)),
+            )
+    env.batch_preparation = batch_preparation
+
+    console = Console()
+    console.print(table)
+
+
+@task
+@beartype
+def benchmark_env_yml(
+    config: str,
+    runs: Optional[str] = "10000",
+    modes: Optional[str] = "full;compact",
+    **args,
+) -> None:
+    """
+    Benchmark the size of the env files generated for an ensemble, written
+    either as one full `env.yml` per run or as `env_base.yml` plus one small
+    `env_delta.yml` per run (see `compact_env_yml`). Reports the number of
+    bytes written, the preparation time and the time of a local
+    `rsync -a` of the generated results folder, as a stand-in for the
+    job transmission.
+
+    Example Usage:
+
+    ```sh
+    fabsim localhost benchmark_env_yml:dummy_test,script=dummy
+    fabsim localhost benchmark_env_yml:dummy_test,runs="1000;10000"
+    ```
+
+    Args:
+        config (str): the name of config directory
+        runs (str, optional): `;` separated list of number of runs
+        modes (str, optional): `;` separated list of `full` and/or `compact`
+    """
+    global _env_base
+    update_environment(args)
+    with_config(config)
+    calc_nodes()
+    calc_total_mem()
+    # the runs of one sweep item, as compact_env_yml only applies to
+    # ensembles
+    env.ensemble_mode = True
+
+    table = Table(
+        title="\n\nenv.yml benchmark",
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("runs", style="blue")
+    table.add_column("mode", style="blue")
+    table.add_column("env files (bytes)", style="magenta")
+    table.add_column("bytes/run", style="magenta")
+    table.add_column("preparation (s)", style="magenta")
+    table.add_column("rsync (s)", style="magenta")
+
+    compact_env_yml = env.get("compact_env_yml", False)
+    for nb_runs in [int(x) for x in runs.split(";")]:
+        for mode in modes.split(";"):
+            env.compact_env_yml = mode == "compact"
+            set_tmp_work_path(tempfile.mkdtemp(prefix="FabSim3_bench_"))
+            env.job_script_info = {}
+            try:
+                start_time = time.time()
+                _env_base = None
+                if use_compact_env_yml():
+                    write_env_base_yml()
+                job_preparation(
+                    dict(
+                        label="benchmark",
+                        replica_start_number=1,
+                        replicas=nb_runs,
+                    )
+                )
+                prep_time = "{:.3f}".format(time.time() - start_time)
+
+                env_bytes = 0
+                for root, _, files in os.walk(env.tmp_results_path):
+                    for filename in files:
+                        if filename.startswith("env") and filename.endswith(
+                            ".yml"
+                        ):
+                            env_bytes += os.path.getsize(
+                                os.path.join(root, filename)
+                            )
+
+                rsync_time = "n/a"
+                if which("rsync") is not None:
+                    start_time = time.time()
+                    subprocess.run(
+                        [
+                            "rsync", "-a", env.tmp_results_path + "/",
+                            env.pather.join(env.tmp_work_path, "rsync_dst"),
+                        ],
+                        check=True,
+                    )
+                    rsync_time = "{:.3f}".format(time.time() - start_time)
+            finally:
+                _env_base = None
+                rmtree(env.tmp_work_path)
+            table.add_row(
+                str(nb_runs),
+                mode,
+                str(env_bytes),
+                str(env_bytes // nb_runs),
+                prep_time,
+                rsync_time,
+            )
+    env.compact_env_yml = compact_env_yml
+
+    console = Console()
+    console.print(table)
+
+
+@task
+@beartype
+def benchmark_yaml(repeat: Optional[str] = "20", **args) -> None:
+    """
+    Compare the pure Python and the libyaml based YAML loader/dumper for
+    loading `machines.yml` and dumping the env of a job (as in `env.yml`).
+
+    Example Usage:
+
+    ```sh
+    fabsim localhost benchmark_yaml
+    fabsim archer2 benchmark_yaml:repeat=100
+    ```
+
+    Args:
+        repeat (str, optional): the number of repetitions of each case
+    """
+    update_environment(args)
+    repeat = int(repeat)
+
+    with open(
+        os.path.join(env.fabsim_root, "deploy", "machines.yml"),
+        encoding="utf-8",
+    ) as machines_yml:
+        machines_yml = machines_yml.read()
+    env_dict = dict(env, **_ENV_YML_EXCLUDED_VARS)
+
+    cases = [
+        (
+            "load machines.yml",
+            lambda loader: yaml.load(machines_yml, Loader=loader),
+            yaml.SafeLoader,
+            SafeLoader,
+        ),
+        (
+            "dump env.yml",
+            lambda dumper: yaml.dump(
+                env_dict, Dumper=dumper, default_flow_style=False
+            ),
+            yaml.Dumper,
+            Dumper,
+        ),
+    ]
+
+    table = Table(
+        title="\n\nYAML benchmark (libyaml available: {})".format(LIBYAML),
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("case", style="blue")
+    table.add_column("python (ms)", style="magenta")
+    table.add_column("libyaml (ms)", style="magenta")
+    table.add_column("speedup", style="magenta")
+    table.add_column("same content", style="magenta")
+
+    for name, func, py_class, c_class in cases:
+        timings = []
+        results = []
+        for yaml_class in (py_class, c_class):
+            start_time = time.time()
+            for _ in range(repeat):
+                result = func(yaml_class)
+            timings.append((time.time() - start_time) * 1000 / repeat)
+            # dumped documents are compared after loading, since emitters
+            # may differ in formatting, e.g., `''` for empty scalars
+            if isinstance(result, str):
+                result = yaml_load_env(result)
+            results.append(result)
+        table.add_row(
+            name,
+            "{:.3f}".format(timings[0]),
+            "{:.3f}".format(timings[1]),
+            "{:.1f}x".format(timings[0] / max(timings[1], 1e-9)),
+            str(results[0] == results[1]),
+        )
+
+    console = Console()
+    console.print(table)
+
+
+@task
+@beartype
+def benchmark_results_cleanup(
+    dirs: Optional[str] = "10;100;1000",
+    methods: Optional[str] = "per_directory;single_script",
+    **args,
+) -> None:
+    """
+    Benchmark the cleanup of the remote results directories done by the
+    job transmission with `prevent_results_overwrite=delete`, i.e., one
+    remote command per results directory (`per_directory`) or one remote
+    script for all of them (`single_script`), against the number of
+    directories. The directories are created, with one file each, in
+    `$work_path/fabsim_benchmark_cleanup` on the remote machine, which is
+    removed at the end.
+
+    Example Usage:
+
+    ```sh
+    fabsim localhost benchmark_results_cleanup
+    fabsim archer2 benchmark_results_cleanup:dirs="100;1000;10000"
+    ```
+
+    Args:
+        dirs (str, optional): `;` separated list of number of directories
+        methods (str, optional): `;` separated list of `per_directory`
+            and/or `single_script`
+    """
+    update_environment(args)
+    results_path = "{}/fabsim_benchmark_cleanup".format(env.work_path)
+    empty_folder = "/tmp/{}".format(next(tempfile._get_candidate_names()))
+
+    table = Table(
+        title="\n\nresults cleanup benchmark on {}".format(env.host),
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("directories", style="blue")
+    table.add_column("method", style="blue")
+    table.add_column("remote commands", style="magenta")
+    table.add_column("time (s)", style="magenta")
+    table.add_column("directories/second", style="magenta")
+
+    try:
+        for nb_dirs in [int(nb_dirs) for nb_dirs in dirs.split(";")]:
+            results_dir_items = [
+                "benchmark_{}".format(i) for i in range(nb_dirs)
+            ]
+            for method in methods.split(";"):
+                # the setup is not included in the timing
+                run_remote_script(
+                    "\n".join(
+                        [
+                            "set -e",
+                            "mkdir -p {0} && cd {0}".format(
+                                shlex.quote(results_path)
+                            ),
+                            "while IFS= read -r results_dir_item; do",
+                            '    mkdir -p "$results_dir_item"',
+                            '    touch "$results_dir_item/out.txt"',
+                            "done <<'FABSIM_RESULTS_DIRS'",
+                            *results_dir_items,
+                            "FABSIM_RESULTS_DIRS",
+                            "",
+                        ]
+                    )
+                )
+                start_time = time.time()
+                if method == "per_directory":
+                    remote_commands = nb_dirs
+                    for results_dir_item in results_dir_items:
+                        clean_remote_results_dir(
+                            results_dir_item, empty_folder, results_path
+                        )
+                elif method == "single_script":
+                    remote_commands = 2
+                    run_remote_script(
+                        clean_remote_results_dirs_script(
+                            results_dir_items, empty_folder, results_path
+                        )
+                    )
+                else:
+                    raise ValueError(
+                        "Unknown cleanup method {}".format(method)
+                    )
+                elapsed = time.time() - start_time
+                table.add_row(
+                    str(nb_dirs),
+                    method,
+                    str(remote_commands),
+                    "{:.3f}".format(elapsed),
+                    "{:.1f}".format(nb_dirs / max(elapsed, 1e-9)),
+                )
+    finally:
+        run("rm -rf {} {}".format(results_path, empty_folder))
+
+    console = Console()
+    console.print(table)
+
+
+@task
+@beartype
+def benchmark_transfer(
+    files: Optional[str] = "1000;10000;100000",
+    modes: Optional[str] = "rsync;tarstream",
+    file_size: Optional[str] = "512",
+    **args,
+) -> None:
+    """
+    Compare the upload of many small files, as generated for an ensemble,
+    by `rsync` and by a compressed tar stream (`transfer_mode=tarstream`).
+    The files are written in a local temporary folder, in sub-folders of
+    100 files, and uploaded to `$work_path/fabsim_benchmark_transfer` on
+    the remote machine, which is removed at the end. To benchmark against a
+    local sshd, use the `localhost` machine.
+
+    Example Usage:
+
+    ```sh
+    fabsim localhost benchmark_transfer
+    fabsim archer2 benchmark_transfer:files="1000;10000",file_size=4096
+    fabsim archer2 benchmark_transfer:tarstream_compression=zstd
+    ```
+
+    Args:
+        files (str, optional): `;` separated list of number of files
+        modes (str, optional): `;` separated list of `rsync` and/or
+            `tarstream`
+        file_size (str, optional): the size of each file in bytes
+    """
+    update_environment(args)
+    file_size = int(file_size)
+    remote_root = "{}/fabsim_benchmark_transfer".format(env.work_path)
+    transfer_mode = env.get("transfer_mode", "rsync")
+    # text content, compressible as env.yml files and job scripts
+    content = "".join(
+        "key_{}: value\n".format(i) for i in range(file_size)
+    )[:file_size]
+
+    table = Table(
+        title="\n\ntransfer benchmark to {} (tarstream compression: "
+        "{})".format(env.host, env.get("tarstream_compression", "gzip")),
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("files", style="blue")
+    table.add_column("mode", style="blue")
+    table.add_column("time (s)", style="magenta")
+    table.add_column("files/second", style="magenta")
+    table.add_column("MB/s", style="magenta")
+
+    try:
+        for nb_files in [int(nb_files) for nb_files in files.split(";")]:
+            local_dir = tempfile.mkdtemp(prefix="FabSim3_bench_")
+            for i in range(nb_files):
+                sub_dir = os.path.join(local_dir, "run_{}".format(i // 100))
+                os.makedirs(sub_dir, exist_ok=True)
+                with open(
+                    os.path.join(sub_dir, "file_{}.txt".format(i)), "w"
+                ) as bench_file:
+                    bench_file.write(content)
+            try:
+                for mode in modes.split(";"):
+                    env.transfer_mode = mode
+                    start_time = time.time()
+                    rsync_project(
+                        local_dir=local_dir + "/",
+                        remote_dir="{}/{}_{}".format(
+                            remote_root, mode, nb_files
+                        ),
+                        default_opts="-pthrz",
+                        capture=True,
+                    )
+                    elapsed = max(time.time() - start_time, 1e-9)
+                    table.add_row(
+                        str(nb_files),
+                        mode,
+                        "{:.3f}".format(elapsed),
+                        "{:.1f}".format(nb_files / elapsed),
+                        "{:.2f}".format(nb_files * file_size / 1e6 / elapsed),
+                    )
+            finally:
+                rmtree(local_dir)
+    finally:
+        env.transfer_mode = transfer_mode
+        run("rm -rf {}".format(remote_root))
+
+    console = Console()
+    console.print(table)
+
+
+def template_names(patterns: str) -> List[str]:
+    """
+    Return the names of the templates of `local_templates_path` matching
+    one of the `;` separated name `patterns`.
+    """
+    return sorted(
+        {
+            name
+            for path in env.local_templates_path
+            if os.path.isdir(path)
+            for name in os.listdir(path)
+            if any(
+                fnmatch.fnmatch(name, pattern)
+                for pattern in patterns.split(";")
+            )
+        }
+    )
+
+
+@task
+@beartype
+def benchmark_templates(
+    templates: Optional[str] = "slurm-*;qcg-PJ-*",
+    repeat: Optional[str] = "1000",
+    iterations: Optional[str] = "1",
+    **args,
+) -> None:
+    """
+    Compare the rendering of the bundled job script templates by
+    `string.Template` (parsed at each rendering) and by the compiled
+    templates of `template()`, in the env of the selected machine.
+
+    Example Usage:
+
+    ```sh
+    fabsim archer2 benchmark_templates
+    fabsim localhost benchmark_templates:templates="slurm-*",iterations=2
+    ```
+
+    Args:
+        templates (str, optional): `;` separated list of template name
+            patterns
+        repeat (str, optional): the number of renderings of each template
+        iterations (str, optional): the number of substitution iterations
+    """
+    update_environment(args)
+    repeat = int(repeat)
+    iterations = int(iterations)
+    names = template_names(templates)
+
+    def string_template(pattern):
+        for _ in range(iterations):
+            pattern = Template(pattern).safe_substitute(env)
+        return pattern
+
+    table = Table(
+        title="\n\ntemplate rendering benchmark ({} iterations)".format(
+            iterations
+        ),
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("template", style="blue")
+    table.add_column("string.Template (us)", style="magenta")
+    table.add_column("compiled (us)", style="magenta")
+    table.add_column("speedup", style="magenta")
+    table.add_column("same content", style="magenta")
+
+    total = [0.0, 0.0]
+    for name in names:
+        pattern = script_template_source(name)
+        timings = []
+        results = []
+        for render in (
+            string_template,
+            lambda pattern: template(pattern, iterations),
+        ):
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                result = render(pattern)
+            timings.append((time.perf_counter() - start_time) * 1e6 / repeat)
+            results.append(result)
+        total[0] += timings[0]
+        total[1] += timings[1]
+        table.add_row(
+            name,
+            "{:.1f}".format(timings[0]),
+            "{:.1f}".format(timings[1]),
+            "{:.1f}x".format(timings[0] / max(timings[1], 1e-9)),
+            str(results[0] == results[1]),
+        )
+    table.add_row(
+        "all ({} templates)".format(len(names)),
+        "{:.1f}".format(total[0]),
+        "{:.1f}".format(total[1]),
+        "{:.1f}x".format(total[0] / max(total[1], 1e-9)),
+        "",
+    )
+
+    console = Console()
+    console.print(table)
+
+
+@task
+@beartype
+def template_cache_stats(**args) -> None:
+    """
+    Print the statistics of the cache of the processed job script templates:
+    the hits, misses and evictions (counted since the start of FabSim3, and
+    including the job_preparation pool workers), its current content, and
+    the statistics of the persistent cache, if enabled
+    (`template_disk_cache`). It is also printed at the end of `job()` when
+    `profile=true`.
+
+    Example Usage:
+
+    ```sh
+    fabsim localhost template_cache_stats
+    ```
+    """
+    update_environment(args)
+    stats = get_template_cache_stats()
+
+    table = Table(
+        title="\n\ntemplate cache",
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("statistic", style="blue")
+    table.add_column("value", style="magenta")
+    for name, value in (
+        ("caching enabled", stats["caching_enabled"]),
+        ("configuration", stats["config_source"]),
+        ("shared cache running", stats["shared_cache"]),
+        ("hits", stats["cache_hits"]),
+        ("shared cache hits", stats["cache_shared_hits"]),
+        ("misses", stats["cache_misses"]),
+        ("evictions", stats["cache_evictions"]),
+        ("hit ratio", stats["cache_hit_ratio"]),
+        (
+            "cached templates (this process)",
+            stats["processed_templates_cached"],
+        ),
+        ("max cached templates", stats["max_cache_size"]),
+        ("cached characters (this process)", stats["memory_usage_estimate"]),
+        ("max cached characters", stats["max_cache_chars"]),
+    ):
+        table.add_row(name, str(value))
+    disk_stats = stats["disk_cache"]
+    if disk_stats is not None:
+        for name in ("path", "hits", "misses", "writes", "evictions"):
+            table.add_row("disk cache {}".format(name), str(disk_stats[name]))
+
+    console = Console()
+    console.print(table)
+
+
+def _render_job_templates(
+    names: List[str], job_ids: List[int], variants: int
+) -> int:
+    # job_preparation of benchmark_template_cache, run by the pool workers
+    for job_id in job_ids:
+        env.job_name = "job_{}".format(job_id % variants)
+        env.replica_number = job_id % variants
+        for name in names:
+            script_template_content(name)
+    return len(job_ids) * len(names)
+
+
+@task
+@beartype
+def benchmark_template_cache(
+    nb_process: Optional[str] = "1;2;4;8;16;32",
+    jobs: Optional[str] = "2000",
+    variants: Optional[str] = "20",
+    templates: Optional[str] = "slurm-*;qcg-PJ-*",
+    modes: Optional[str] = "private;shared",
+    **args,
+) -> None:
+    """
+    Benchmark the hit rate and throughput of the processed template cache
+    of pool workers, as in the job preparation phase: the templates are
+    rendered for `jobs` jobs distributed over `nb_process` forked workers,
+    after being warmed by the main process. The jobs have `variants`
+    distinct `job_name` and `replica_number`, so the renderings of the same
+    variant can be cached by the workers.
+
+    - `private`: each worker has its own cache
+    - `shared`: the workers also share the processed templates, through a
+        `multiprocessing.Manager` (`template_cache_shared=true`)
+
+    Example Usage:
+
+    ```sh
+    fabsim archer2 benchmark_template_cache
+    fabsim localhost benchmark_template_cache:nb_process="4;16",variants=500
+    ```
+
+    Args:
+        nb_process (str, optional): `;` separated list of number of workers
+        jobs (str, optional): the number of jobs
+        variants (str, optional): the number of distinct jobs
+        templates (str, optional): `;` separated list of template name
+            patterns
+        modes (str, optional): `;` separated list of `private` and/or
+            `shared`
+    """
+    update_environment(args)
+    jobs = int(jobs)
+    variants = int(variants)
+    names = template_names(templates)
+    saved_env = {
+        key: env.get(key)
+        for key in ("job_name", "replica_number", "enable_template_cache")
+    }
+    env.enable_template_cache = True
+
+    table = Table(
+        title="\n\ntemplate cache benchmark ({} jobs, {} variants, {} "
+        "templates)".format(jobs, variants, len(names)),
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("nb_process", style="blue")
+    table.add_column("mode", style="blue")
+    table.add_column("time (s)", style="magenta")
+    table.add_column("templates/second", style="magenta")
+    table.add_column("hit ratio", style="magenta")
+    table.add_column("hits", style="magenta")
+    table.add_column("shared hits", style="magenta")
+    table.add_column("misses", style="magenta")
+
+    try:
+        for workers in [int(n) for n in nb_process.split(";")]:
+            for mode in modes.split(";"):
+                clear_template_cache()
+                if mode == "shared":
+                    start_shared_template_cache()
+                _render_job_templates(names, [0], variants)
+                chunks = [
+                    (names, list(range(i, jobs, workers)), variants)
+                    for i in range(workers)
+                ]
+                with multiprocessing.get_context("fork").Pool(
+                    workers
+                ) as pool:
+                    start_time = time.time()
+                    rendered = sum(
+                        pool.starmap(_render_job_templates, chunks)
+                    )
+                    elapsed = max(time.time() - start_time, 1e-9)
+                stop_shared_template_cache()
+                stats = get_template_cache_stats()
+                table.add_row(
+                    str(workers),
+                    mode,
+                    "{:.3f}".format(elapsed),
+                    "{:.1f}".format(rendered / elapsed),
+                    stats["cache_hit_ratio"],
+                    str(stats["cache_hits"]),
+                    str(stats["cache_shared_hits"]),
+                    str(stats["cache_misses"]),
+                )
+    finally:
+        stop_shared_template_cache()
+        clear_template_cache()
+        env.update(saved_env)
+
+    console = Console()
+    console.print(table)
+
+
 @task
 @beartype
 def ensemble2campaign(
@@ -2101,9 +4561,7 @@ def install_packages(venv: bool = "False"):
     if not os.path.exists(user_applications_yml_file):
         copyfile(applications_yml_file, user_applications_yml_file)
 
-    config = yaml.load(
-        open(user_applications_yml_file), Loader=yaml.SafeLoader
-    )
+    config = yaml_load_file(user_applications_yml_file)
 
     tmp_app_dir = "{}/tmp_app".format(env.localroot)
     local("mkdir -p {}".format(tmp_app_dir))
@@ -2129,9 +4587,9 @@ def install_packages(venv: bool = "False"):
     for whl in os.listdir(tmp_app_dir):
         local(
             template(
-                "rsync -pthrvz -e 'ssh -p $port'  {}/{} "
+                "rsync -pthrvz -e 'ssh -p $port {}'  {}/{} "
                 "$username@$remote:$app_repository".format(
-                    tmp_app_dir, whl
+                    ssh_control_opts(), tmp_app_dir, whl
                 )
             )
             # "rsync -pthrvz %s/%s eagle:$app_repository"%(tmp_app_dir, whl)
@@ -2231,9 +4689,7 @@ def install_app(name="", external_connexion="no", venv="False"):
     if not os.path.exists(user_applications_yml_file):
         copyfile(applications_yml_file, user_applications_yml_file)
 
-    config = yaml.load(
-        open(user_applications_yml_file), Loader=yaml.SafeLoader
-    )
+    config = yaml_load_file(user_applications_yml_file)
     info = config[name]
 
     # Offline cluster installation - --user install
@@ -2288,9 +4744,9 @@ def install_app(name="", external_connexion="no", venv="False"):
     for whl in os.listdir(tmp_app_dir):
         local(
             template(
-                "rsync -pthrvz -e 'ssh -p $port'  {}/{} "
+                "rsync -pthrvz -e 'ssh -p $port {}'  {}/{} "
                 "$username@$remote:$app_repository".format(
-                    tmp_app_dir, whl
+                    ssh_control_opts(), tmp_app_dir, whl
                 )
             )
         )
@@ -1,40 +1,96 @@
 from __future__ import print_function
 
+import asyncio
+import atexit
 import os
+import re
+import shlex
+import shutil
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
 from contextlib import contextmanager
 
 from beartype import beartype
-from beartype.typing import List, Optional, Tuple
+from beartype.typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 from fabric2 import Config, Connection
+from invoke.exceptions import UnexpectedExit
 
 from fabsim.base.env import env
-from fabsim.base.utils import add_print_prefix
+from fabsim.base.profiling import profiled
+from fabsim.base.utils import Prefixer, add_print_prefix, colored
 from fabsim.deploy.templates import template
 
 
 @beartype
 def local(
-    command: str,
+    command: Union[str, List[str]],
     cwd: Optional[str] = None,
-    capture: Optional[bool] = False
+    capture: Optional[bool] = False,
+    timeout: Optional[float] = None,
+    on_line: Optional[Callable[[str], Any]] = None,
+    max_capture_lines: Optional[int] = None,
 ) -> Tuple[str, str]:
     """
     Run a command on the local system.
 
     Args:
-        command (str): the command to be executed
+        command (Union[str, List[str]]): the command to be executed, by the
+            shell if it is a string, or directly (without spawning a shell)
+            if it is a list of arguments, e.g., `["rsync", "-a", src, dst]`
         cwd (str, optional): the current working directory
         capture (bool, optional): if `False`, the local subprocess will use
             your terminal for stdout and stderr. Otherwise, if `True`, then
             nothing will be printed in the terminal, and any subprocess'
             stdout/stderr will be captured and returned.
-
-        shell (None, optional): Description
+        timeout (float, optional): the maximum execution time in seconds,
+            the command is killed and a `RuntimeError` is raised if it is
+            exceeded
+        on_line (Callable, optional): called with each line of stdout, as
+            soon as it is written, e.g., to report the progress of a long
+            command. stdout is then not printed in the terminal.
+        max_capture_lines (int, optional): only keep the last
+            `max_capture_lines` lines of the captured stdout and stderr, to
+            bound the memory used by commands with a large output
+
+    !!! tip
+        Use `local_lines` to iterate over the lines of stdout.
     """
+    if on_line is not None or max_capture_lines is not None:
+        stdout_lines = deque(maxlen=max_capture_lines)
+        stderr_lines = deque(maxlen=max_capture_lines)
+        for line in local_lines(
+            command,
+            cwd=cwd,
+            capture_stderr=capture,
+            timeout=timeout,
+            stderr_lines=stderr_lines,
+        ):
+            if capture or max_capture_lines is not None:
+                stdout_lines.append(line)
+            if on_line is not None:
+                on_line(line)
+            elif not capture:
+                print(line)
+        return (
+            "\n".join(stdout_lines).strip(),
+            "\n".join(stderr_lines).strip(),
+        )
 
-    with add_print_prefix(prefix="local", color=196):
-        print("{}".format(command))
+    print_command(command)
 
     # set stdout and stderr for subprocess
     if capture:
@@ -48,16 +104,40 @@ def local(
     # execute the command on the local system
     try:
         p = subprocess.Popen(
-            command, cwd=cwd, shell=True, stdout=stdout, stderr=stderr
+            command,
+            cwd=cwd,
+            shell=isinstance(command, str),
+            stdout=stdout,
+            stderr=stderr,
+            # with a timeout, the command is run in its own process group,
+            # so the children of the shell are also killed
+            start_new_session=timeout is not None,
         )
-        # p.wait()
-        # yield f"{command} Rsync process completed."
-        (stdout, stderr) = p.communicate()
-
     except Exception as e:
         raise RuntimeError("Unexpected error: {}".format(e))
         # sys.exit()
 
+    try:
+        # p.wait()
+        # yield f"{command} Rsync process completed."
+        (stdout, stderr) = p.communicate(timeout=timeout)
+
+    except subprocess.TimeoutExpired:
+        kill_process_group(p)
+        p.communicate()
+        raise RuntimeError(
+            "\nlocal() timed out after {} s while executing '{}'".format(
+                timeout, command
+            )
+        )
+    except BaseException as e:
+        # e.g., interrupted by Ctrl-C, the command is not left running
+        kill_process_group(p)
+        p.wait()
+        if isinstance(e, Exception):
+            raise RuntimeError("Unexpected error: {}".format(e))
+        raise
+
     if p.returncode not in env.acceptable_err_subprocesse_ret_codes:
         raise RuntimeError(
             "\nlocal() encountered an error (return code {})"
@@ -71,6 +151,294 @@ def local(
     return (stdout, stderr)
 
 
+def kill_process_group(p: subprocess.Popen) -> None:
+    """
+    Kill a process started with `start_new_session=True`, and its children,
+    or only the process itself if it was not started in its own session.
+    """
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        p.kill()
+
+
+def print_command(command: Union[str, List[str]]) -> None:
+    if not isinstance(command, str):
+        command = shlex.join(command)
+    with add_print_prefix(prefix="local", color=196):
+        print("{}".format(command))
+
+
+def local_lines(
+    command: Union[str, List[str]],
+    cwd: Optional[str] = None,
+    capture_stderr: Optional[bool] = False,
+    timeout: Optional[float] = None,
+    stderr_lines: Optional[deque] = None,
+) -> Iterator[str]:
+    """
+    Run a command on the local system, and iterate over the lines of its
+    stdout (without the trailing newline) as soon as they are written. A
+    `RuntimeError` is raised at the end if the command failed or timed out.
+
+    Example:
+        ```python
+        for line in local_lines(["rsync", "-av", src, dst]):
+            print(line)
+        ```
+
+    Args:
+        command (Union[str, List[str]]): the command, see `local`
+        cwd (str, optional): the current working directory
+        capture_stderr (bool, optional): if `True`, stderr is captured in
+            `stderr_lines` instead of being printed in the terminal
+        timeout (float, optional): the maximum execution time in seconds
+        stderr_lines (deque, optional): the captured lines of stderr
+    """
+    print_command(command)
+    try:
+        p = subprocess.Popen(
+            command,
+            cwd=cwd,
+            shell=isinstance(command, str),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if capture_stderr else None,
+            text=True,
+            errors="replace",
+            # the command is run in its own process group, so the children
+            # of the shell are also killed if the iteration stops early
+            start_new_session=True,
+        )
+    except Exception as e:
+        raise RuntimeError("Unexpected error: {}".format(e))
+
+    # stderr is read in a thread, so the process is never blocked by a
+    # full stderr pipe
+    stderr_thread = None
+    if capture_stderr:
+        if stderr_lines is None:
+            stderr_lines = deque()
+        stderr_thread = threading.Thread(
+            target=lambda: stderr_lines.extend(
+                line.rstrip("\n") for line in p.stderr
+            ),
+            daemon=True,
+        )
+        stderr_thread.start()
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        kill_process_group(p)
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    try:
+        for line in p.stdout:
+            yield line.rstrip("\n")
+        p.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if p.poll() is None:
+            # the iteration was stopped before the end of the command
+            kill_process_group(p)
+            p.wait()
+        p.stdout.close()
+        if stderr_thread is not None:
+            stderr_thread.join()
+            p.stderr.close()
+
+    if timed_out.is_set():
+        raise RuntimeError(
+            "\nlocal() timed out after {} s while executing '{}'".format(
+                timeout, command
+            )
+        )
+    if p.returncode not in env.acceptable_err_subprocesse_ret_codes:
+        raise RuntimeError(
+            "\nlocal() encountered an error (return code {})"
+            "while executing '{}'".format(p.returncode, command)
+        )
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of open fabric ssh connections, keyed by
+    (user, host, port), reused across `run()` calls and tasks.
+
+    A connection is leased to one caller at a time: `get` takes an idle
+    connection out of the pool (or opens a new one), and `release` puts it
+    back, so concurrent callers (e.g., the threads of `call_async`) never
+    share a connection, nor its state (e.g., `Connection.cd`).
+
+    An idle connection is checked before reuse, and replaced if its
+    transport is not active anymore or if it was idle for more than
+    `idle_timeout` seconds. All connections are closed at exit.
+
+    !!! note
+        The connections of a process are never used by its forked children
+        (e.g., pool workers), which open their own connections.
+    """
+
+    def __init__(self, idle_timeout: Optional[float] = 300):
+        self.idle_timeout = idle_timeout
+        # the idle connections, (connection, last used time), of each key
+        self.connections = {}
+        self.leased = set()
+        self.handshakes = 0
+        self.handshakes_saved = 0
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def _reset_after_fork(self) -> None:
+        # the connections of the parent process must not be used, nor
+        # closed, by a forked child
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.connections = {}
+            self.leased = set()
+            self.handshakes = 0
+            self.handshakes_saved = 0
+            self.lock = threading.Lock()
+
+    @staticmethod
+    def is_healthy(conn: Connection) -> bool:
+        """
+        Check if the transport of a connection is still active.
+        """
+        transport = conn.transport
+        if not conn.is_connected or transport is None:
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return transport.is_active()
+
+    def get(self, user: str, host: str, port: int) -> Connection:
+        """
+        Lease an open connection to `user@host:port`, reusing an idle
+        pooled connection if possible. The connection must be returned by
+        `release`, or closed by `discard`.
+        """
+        self._reset_after_fork()
+        key = (user, host, port)
+        with self.lock:
+            self.close_idle()
+            idle = self.connections.get(key, [])
+            while len(idle) > 0:
+                # the most recently used connection first
+                conn, _ = idle.pop()
+                if self.is_healthy(conn):
+                    self.handshakes_saved += 1
+                    self.leased.add(conn)
+                    return conn
+                conn.close()
+
+        conn = Connection(
+            host=host,
+            user=user,
+            port=port,
+            config=None,
+            gateway=None,
+            forward_agent=False,
+            connect_timeout=None,
+            connect_kwargs=None,
+            inline_ssh_env=False,
+        )
+        # the handshake is done without the lock, so other callers are not
+        # blocked by a slow connection
+        conn.open()
+        with self.lock:
+            self.handshakes += 1
+            self.leased.add(conn)
+        return conn
+
+    def release(
+        self, user: str, host: str, port: int, conn: Connection
+    ) -> None:
+        """
+        Return a leased connection to the pool, marked as used now for the
+        idle timeout.
+        """
+        with self.lock:
+            if conn not in self.leased:
+                # e.g., leased before a fork
+                return
+            self.leased.discard(conn)
+            self.connections.setdefault((user, host, port), []).append(
+                (conn, time.time())
+            )
+
+    def discard(self, conn: Connection) -> None:
+        """
+        Close a leased connection instead of returning it to the pool, e.g.,
+        after a network error.
+        """
+        with self.lock:
+            self.leased.discard(conn)
+        conn.close()
+
+    def close_idle(self) -> None:
+        now = time.time()
+        for key, idle in list(self.connections.items()):
+            for conn, last_used in list(idle):
+                if now - last_used > self.idle_timeout:
+                    idle.remove((conn, last_used))
+                    conn.close()
+            if len(idle) == 0:
+                del self.connections[key]
+
+    def close_all(self) -> None:
+        """
+        Close all pooled connections of the current process.
+        """
+        if self.pid != os.getpid():
+            return
+        for idle in self.connections.values():
+            for conn, _ in idle:
+                conn.close()
+        for conn in self.leased:
+            conn.close()
+        self.connections = {}
+        self.leased = set()
+        if self.handshakes_saved > 0:
+            print(
+                "ssh connection pool: {} connections opened, {} ssh "
+                "handshakes saved".format(
+                    self.handshakes, self.handshakes_saved
+                )
+            )
+
+    def stats(self) -> dict:
+        return {
+            "open_connections": len(self.leased)
+            + sum(len(idle) for idle in self.connections.values()),
+            "handshakes": self.handshakes,
+            "handshakes_saved": self.handshakes_saved,
+        }
+
+
+_connection_pool = ConnectionPool()
+atexit.register(_connection_pool.close_all)
+
+
+def use_connection_pool() -> bool:
+    """
+    Check if the ssh connections of `run()` should be pooled, it can be
+    disabled by `ssh_connection_pool: false` in machines_user.yml.
+    """
+    return str(env.get("ssh_connection_pool", True)).lower() in (
+        "true", "1", "yes", "on"
+    )
+
+
 class HostConnection:
     def __init__(self):
         self.host_address = env.remote
@@ -82,8 +450,26 @@ class HostConnection:
     @contextmanager
     def ssh_connection(self):
         """
-        Make and establish a fabric ssh connection
+        Make and establish a fabric ssh connection, or reuse a pooled one
+        (see `ConnectionPool`)
         """
+        if use_connection_pool():
+            _connection_pool.idle_timeout = float(
+                env.get("ssh_connection_pool_idle_timeout", 300)
+            )
+            key = (self.user, self.host_address, self.port)
+            conn = _connection_pool.get(*key)
+            try:
+                yield conn
+            except UnexpectedExit:
+                # the remote command failed, the connection is still fine
+                _connection_pool.release(*key, conn)
+                raise
+            except BaseException:
+                _connection_pool.discard(conn)
+                raise
+            _connection_pool.release(*key, conn)
+            return
 
         conn = Connection(
             host=self.host_address,
@@ -98,15 +484,9 @@ class HostConnection:
         )
 
         try:
-            print("host_address:", self.host_address)
-            print("user:", self.user)
-            print("port:", self.port)
-            # print('password:', self.password)
-            print("\x1b[6;30;42m" + "Opening a connection!" + "\x1b[0m")
             conn.open()
             yield conn
         finally:
-            print("\x1b[6;30;45m" + "Closing a connection!" + "\x1b[0m")
             conn.close()
 
     def run_command(self, command, cd=None, capture=False):
@@ -118,6 +498,10 @@ class HostConnection:
         # this will load the login shell. this required to make sure
         # the module command can be found during job execution
         command = 'bash -l -c "{}"'.format(command)
+        if cd is not None:
+            # as Connection.cd, which would change the state of the shared
+            # connection
+            command = "cd {} && {}".format(cd, command)
 
         # env.remote : localhost
         # env.host_string : user@localhost
@@ -131,18 +515,128 @@ class HostConnection:
         if capture is True:
             # here, I only set to hide the stdout, and capture any stderr
             hide = "out"
-        with add_print_prefix(prefix=env.host_string):
-            with self.ssh_connection() as conn:
-                run = conn.sudo if self.use_sudo else conn.run
-                if cd is None:
-                    result = run(command, pty=self.pty, hide=hide)
-
-                else:
-                    with conn.cd(cd):
-                        result = run(command, pty=self.pty, hide=hide)
+        # the output is written by the threads of fabric, hence the prefix
+        # is added by the output stream rather than by add_print_prefix
+        out_stream = Prefixer(
+            prefix=colored(24, "[{}]".format(env.host_string)),
+            orig=sys.stdout,
+        )
+        with self.ssh_connection() as conn:
+            run = conn.sudo if self.use_sudo else conn.run
+            result = run(
+                command, pty=self.pty, hide=hide, out_stream=out_stream
+            )
         return result.stdout
 
 
+# The folder of the OpenSSH ControlMaster sockets of this FabSim3 process,
+# with one socket per (user, host, port), see `ssh_control_opts`
+_ssh_control_dir = None
+_ssh_control_pid = None
+_ssh_control_tmp = False
+
+
+def use_ssh_control_master() -> bool:
+    """
+    Check if the ssh, scp and rsync commands should share an OpenSSH
+    ControlMaster connection, enabled by `ssh_control_master: true` in
+    machines_user.yml.
+    """
+    if os.name == "nt":
+        # ControlMaster is not supported by the Windows OpenSSH client
+        return False
+    return str(env.get("ssh_control_master", False)).lower() in (
+        "true", "1", "yes", "on"
+    )
+
+
+def ssh_control_dir() -> str:
+    """
+    Return the folder of the ControlMaster sockets of this FabSim3
+    process, created on the first call: `ssh_control_dir` if set, else a
+    private folder in the temporary directory.
+
+    !!! note
+        This function should be called before forking the pool workers,
+        so they share the folder, and the master connections they open are
+        closed with the ones of the main process.
+    """
+    global _ssh_control_dir, _ssh_control_pid, _ssh_control_tmp
+    if _ssh_control_dir is None:
+        # the socket path is limited to ~100 characters, hence the folder
+        # is created in the temporary directory instead of the FabSim3
+        # folders, and `%C` (a hash of the local host, remote host, port
+        # and user) is used as socket name
+        control_dir = env.get("ssh_control_dir")
+        if control_dir:
+            os.makedirs(control_dir, mode=0o700, exist_ok=True)
+            _ssh_control_dir = control_dir
+            _ssh_control_tmp = False
+        else:
+            _ssh_control_dir = tempfile.mkdtemp(
+                prefix="fabsim-ssh-", dir=tempfile.gettempdir()
+            )
+            _ssh_control_tmp = True
+        _ssh_control_pid = os.getpid()
+    return _ssh_control_dir
+
+
+def ssh_control_opts() -> str:
+    """
+    Return the OpenSSH options to multiplex the ssh, scp and rsync commands
+    over one ControlMaster connection per remote machine, e.g.,
+    `-o ControlPath=/tmp/fabsim-ssh-abc/%C -o ControlMaster=auto
+    -o ControlPersist=60`, or an empty string if disabled.
+
+    The first command to a machine opens the master connection, the next
+    ones only do a round-trip on the local socket instead of a full ssh
+    handshake. The master connections are closed when FabSim3 exits,
+    `ControlPersist` only limits the lifetime of the leftover connections
+    if FabSim3 is killed.
+    """
+    if not use_ssh_control_master():
+        return ""
+
+    return (
+        "-o ControlPath={}/%C -o ControlMaster=auto "
+        "-o ControlPersist={}".format(
+            ssh_control_dir(), env.get("ssh_control_persist", 60)
+        )
+    )
+
+
+@atexit.register
+def close_ssh_control_masters() -> None:
+    """
+    Close the ControlMaster connections opened by this FabSim3 process, or
+    by its pool workers forked after the creation of `ssh_control_dir`.
+    """
+    global _ssh_control_dir, _ssh_control_pid
+    if _ssh_control_dir is None or _ssh_control_pid != os.getpid():
+        return
+    if os.path.isdir(_ssh_control_dir):
+        for socket_name in os.listdir(_ssh_control_dir):
+            # the host is not used by `-O exit` with an explicit ControlPath
+            subprocess.run(
+                [
+                    "ssh",
+                    "-o",
+                    "ControlPath={}".format(
+                        os.path.join(_ssh_control_dir, socket_name)
+                    ),
+                    "-O",
+                    "exit",
+                    "fabsim-control-master",
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        if _ssh_control_tmp:
+            shutil.rmtree(_ssh_control_dir, ignore_errors=True)
+    _ssh_control_dir = None
+    _ssh_control_pid = None
+
+
 @beartype
 def run(cmd: str, cd: Optional[str] = None, capture: Optional[bool] = False):
     if env.manual_sshpass:
@@ -173,7 +667,9 @@ def manual_sshpass(
         raise ValueError("Neither SSHPASS set in environment" +
                          " nor sshpass value set for this remote machine")
     sshpass_args = "-e" if env.env_sshpass else "-f '%(sshpass)s'" % env
-    pre_cmd = f"sshpass {sshpass_args}" + " ssh %(username)s@%(remote)s " % env
+    pre_cmd = "sshpass {} ssh {} {}@{} ".format(
+        sshpass_args, ssh_control_opts(), env.username, env.remote
+    )
     return local(pre_cmd + "'" + manual_command + "'", capture=capture)
 
 
@@ -211,7 +707,9 @@ def manual(
 
     commands.append(cmd)
     manual_command = " && ".join(commands)
-    pre_cmd = "ssh -Y -p %(port)s %(username)s@%(remote)s " % env
+    pre_cmd = "ssh -Y -p {} {} {}@{} ".format(
+        env.port, ssh_control_opts(), env.username, env.remote
+    )
 
     return local(pre_cmd + "'" + manual_command + "'", capture=capture)
     # return local(pre_cmd + "'" + manual_command + "'", capture=capture)
@@ -228,6 +726,304 @@ def _run(cmd: str, cd: str = None, capture: bool = False):
     return conn.run_command(command=cmd, cd=cd, capture=capture)
 
 
+def remote_concurrency() -> int:
+    """
+    Return the maximum number of concurrent remote operations per machine
+    of `run_async`, `local_async` and `call_async`, set by
+    `remote_concurrency` in machines_user.yml. The default value `1` keeps
+    the remote operations sequential.
+    """
+    return max(1, int(env.get("remote_concurrency", 1)))
+
+
+# The semaphores limiting the concurrent remote operations per machine, they
+# are bound to the event loop of `gather`
+_machine_semaphores = {}
+
+
+def _machine_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    key = (env.get("username"), env.get("remote"), env.get("port"))
+    bound_loop, semaphore = _machine_semaphores.get(key, (None, None))
+    if bound_loop is not loop:
+        semaphore = asyncio.Semaphore(remote_concurrency())
+        _machine_semaphores[key] = (loop, semaphore)
+    return semaphore
+
+
+async def call_async(func: Callable, *args, **kwargs) -> Any:
+    """
+    Call a blocking function doing a remote operation (e.g., `run`,
+    `rsync_project`, `job_submission`) in a thread, limited by the number
+    of concurrent remote operations of the current machine.
+
+    !!! note
+        `env` is shared by all threads: `func` should not modify it, e.g.,
+        `run`, `local`, `rsync_project`, `put` and `job_submission` only
+        read it. The lines printed by each thread are prefixed by its own
+        `add_print_prefix` prefixes.
+    """
+    async with _machine_semaphore():
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def run_async(
+    cmd: str, cd: Optional[str] = None, capture: Optional[bool] = False
+):
+    """
+    Asynchronous version of `run`, see `call_async`.
+    """
+    return await call_async(run, cmd, cd=cd, capture=capture)
+
+
+async def local_async(
+    command: str,
+    cwd: Optional[str] = None,
+    capture: Optional[bool] = False
+) -> Tuple[str, str]:
+    """
+    Asynchronous version of `local`. Since the local commands are mostly
+    ssh, scp or rsync commands to the current machine, they are limited by
+    the same number of concurrent remote operations as `run_async`.
+    """
+    async with _machine_semaphore():
+        with add_print_prefix(prefix="local", color=196):
+            print("{}".format(command))
+
+        stdout = asyncio.subprocess.PIPE if capture else None
+        stderr = asyncio.subprocess.PIPE if capture else None
+        try:
+            p = await asyncio.create_subprocess_shell(
+                command, cwd=cwd, stdout=stdout, stderr=stderr
+            )
+            (stdout, stderr) = await p.communicate()
+        except Exception as e:
+            raise RuntimeError("Unexpected error: {}".format(e))
+
+    if p.returncode not in env.acceptable_err_subprocesse_ret_codes:
+        raise RuntimeError(
+            "\nlocal() encountered an error (return code {})"
+            "while executing '{}'".format(p.returncode, command)
+        )
+
+    stdout = stdout.decode("utf-8").strip() if stdout else ""
+    stderr = stderr.decode("utf-8").strip() if stderr else ""
+
+    return (stdout, stderr)
+
+
+def gather(*aws: Awaitable) -> List[Any]:
+    """
+    Run the asynchronous remote operations `aws` (e.g., `run_async` calls)
+    concurrently from synchronous code, and return their results in order.
+    The first raised exception is propagated once all the operations are
+    done.
+
+    Example:
+        ```python
+        gather(*[run_async("mkdir -p {}".format(d)) for d in dirs])
+        ```
+    """
+
+    async def _gather():
+        results = await asyncio.gather(*aws, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    return asyncio.run(_gather())
+
+
+def use_tarstream() -> bool:
+    """
+    Check if the file transfers should use a compressed tar stream over one
+    ssh channel instead of rsync, set by `transfer_mode: tarstream` in
+    machines_user.yml. Not supported by `manual_gsissh` and
+    `ssh_monsoon_mode`.
+    """
+    return (
+        str(env.get("transfer_mode", "rsync")).lower() == "tarstream"
+        and not env.get("manual_gsissh")
+        and not env.get("ssh_monsoon_mode")
+    )
+
+
+def ssh_command() -> str:
+    """
+    Return the local ssh command to the remote machine (without the
+    destination), e.g., `ssh -p 22 -o ControlPath=...`.
+    """
+    cmd = "ssh -p {} {}".format(env.port, ssh_control_opts())
+    if env.get("manual_sshpass"):
+        sshpass_args = "-e" if env.env_sshpass else "-f '%(sshpass)s'" % env
+        cmd = "sshpass {} {}".format(sshpass_args, cmd)
+    return cmd
+
+
+def tarstream_compression() -> Tuple[str, str]:
+    """
+    Return the compression and decompression commands of the tar stream,
+    set by `tarstream_compression` (`zstd`, `gzip` or `none`). zstd should
+    be installed on both machines.
+    """
+    compression = str(env.get("tarstream_compression", "gzip")).lower()
+    if compression == "zstd":
+        return "zstd -q -c -T0", "zstd -q -d -c"
+    elif compression == "gzip":
+        return "gzip -c -1", "gzip -d -c"
+    elif compression == "none":
+        return "cat", "cat"
+    raise ValueError(
+        "Unknown tarstream_compression {}, it should be zstd, gzip or "
+        "none".format(compression)
+    )
+
+
+def pipefail_command(command: str) -> str:
+    """
+    Wrap a shell pipeline, e.g., the remote side of a tar stream, to be run
+    by `bash -o pipefail`, so it fails if any of its commands fails, and not
+    only the last one.
+    """
+    return "bash -o pipefail -c {}".format(shlex.quote(command))
+
+
+def pipefail_argv(command: str) -> List[str]:
+    """
+    Return the argv of `local()` to run a local shell pipeline with
+    `bash -o pipefail` (see `pipefail_command`).
+    """
+    return ["bash", "-o", "pipefail", "-c", command]
+
+
+@profiled("tarstream_put")
+@beartype
+def tarstream_put(
+    local_dir: str,
+    remote_dir: str,
+    members: List[str] = ["."],
+    exclude: List[str] = [],
+    files_from: Optional[str] = None,
+    capture: Optional[bool] = False,
+    ssh_opts: Optional[str] = "",
+    verbose: Optional[bool] = False,
+    max_capture_lines: Optional[int] = None,
+) -> Tuple[str, str]:
+    """
+    Upload files to the remote machine as a compressed tar stream over one
+    ssh channel, unpacked in `remote_dir`. Used instead of `rsync` with
+    `transfer_mode: tarstream`, which is much faster for many small files.
+
+    !!! note
+        Unlike `rsync`, all files are transferred, even if they are already
+        on the remote machine, and remote files are never deleted.
+
+    Args:
+        local_dir (str): the local folder, the paths in the tar stream are
+            relative to this folder
+        remote_dir (str): the remote folder, created if needed
+        members (List[str], optional): the files/folders to be transferred,
+            relative to `local_dir`
+        exclude (List[str], optional): the patterns of excluded files,
+            passed to `--exclude` option of `tar`
+        files_from (str, optional): the path of a local file with the list
+            of files, relative to `local_dir`, to be transferred instead of
+            `members`
+        ssh_opts (str, optional): the extra options of the `ssh` command
+        verbose (bool, optional): if `True`, the transferred files are
+            listed by `tar -v`
+        max_capture_lines (int, optional): only keep the last lines of the
+            captured output, see `local`
+    """
+    compress, decompress = tarstream_compression()
+    exclude_opts = " ".join(
+        "--exclude={}".format(shlex.quote(item)) for item in exclude
+    )
+    if files_from is not None:
+        members_opts = "--files-from={}".format(shlex.quote(files_from))
+    else:
+        members_opts = " ".join(shlex.quote(member) for member in members)
+    remote_cmd = "mkdir -p {0} && {1} | tar -C {0} -xpf -".format(
+        shlex.quote(remote_dir), decompress
+    )
+    tar_cmd = "tar -C {} {} -c{}f - {} | {} | {} {} {} {}".format(
+        shlex.quote(local_dir),
+        exclude_opts,
+        "v" if verbose else "",
+        members_opts,
+        compress,
+        ssh_command(),
+        ssh_opts,
+        env.host_string,
+        shlex.quote(pipefail_command(remote_cmd)),
+    )
+
+    return local(
+        command=pipefail_argv(tar_cmd),
+        capture=capture,
+        max_capture_lines=max_capture_lines,
+    )
+
+
+@profiled("tarstream_get")
+@beartype
+def tarstream_get(
+    remote_dir: str,
+    local_dir: str,
+    members: List[str] = ["."],
+    name_patterns: List[str] = [],
+    exclude: List[str] = [],
+    capture: Optional[bool] = False,
+) -> Tuple[str, str]:
+    """
+    Download files from the remote machine as a compressed tar stream over
+    one ssh channel, unpacked in `local_dir`.
+
+    Args:
+        remote_dir (str): the remote folder, the paths in the tar stream are
+            relative to this folder
+        local_dir (str): the local folder, created if needed
+        members (List[str], optional): the files/folders to be transferred,
+            relative to `remote_dir`, shell patterns are expanded remotely
+        name_patterns (List[str], optional): if not empty, only the files
+            matching one of these name patterns (as `find -name`) are
+            transferred
+        exclude (List[str], optional): the patterns of excluded files,
+            passed to `--exclude` option of `tar`
+    """
+    compress, decompress = tarstream_compression()
+    exclude_opts = " ".join(
+        "--exclude={}".format(shlex.quote(item)) for item in exclude
+    )
+    # members are not quoted, to allow remote patterns, e.g., `*_archer2*`
+    members_opts = " ".join(members)
+    if len(name_patterns) > 0:
+        find_cmd = "find {} -type f \\( {} \\)".format(
+            members_opts,
+            " -o ".join(
+                "-name {}".format(shlex.quote(pattern))
+                for pattern in name_patterns
+            ),
+        )
+        tar_cmd = "{} | tar {} -cf - -T -".format(find_cmd, exclude_opts)
+    else:
+        tar_cmd = "tar {} -cf - {}".format(exclude_opts, members_opts)
+    remote_cmd = "cd {} && {} | {}".format(
+        shlex.quote(remote_dir), tar_cmd, compress
+    )
+    os.makedirs(local_dir, exist_ok=True)
+    get_cmd = "{} {} {} | {} | tar -C {} -xpf -".format(
+        ssh_command(),
+        env.host_string,
+        shlex.quote(pipefail_command(remote_cmd)),
+        decompress,
+        shlex.quote(local_dir),
+    )
+    return local(command=pipefail_argv(get_cmd), capture=capture)
+
+
+@profiled("rsync_project")
 @beartype
 def rsync_project(
     remote_dir: str,
@@ -238,6 +1034,9 @@ def rsync_project(
     default_opts: Optional[str] = "-pthrvz",
     capture: Optional[bool] = False,
     quiet: Optional[bool] = False,
+    files_from: Optional[str] = None,
+    include: List[str] = [],
+    max_capture_lines: Optional[int] = None,
 ) -> Tuple[str, str]:
     """
     Synchronize a remote directory with the current project directory via
@@ -259,11 +1058,48 @@ def rsync_project(
             string, such as `--rsh` flag.
         default_opts (str, optional): the default rsync options `-pthrvz`,
             override if desired to remove verbosity
+        files_from (str, optional): the path of a local file with the list
+            of files, relative to `local_dir`, to be transferred. It will be
+            passed to `--files-from` option via `rsync` command.
+        include (list, optional): the list of files/folders to be included,
+            passed to `--include` option via `rsync` command, before the
+            `--exclude` options. For example, `include=['/scripts/***']`
+            and `exclude=['*']` only transfer the `scripts` folder.
+        max_capture_lines (int, optional): only keep the last lines of the
+            captured output, e.g., for the verbose output of `rsync` on huge
+            trees, see `local`
 
     !!! note
         Please make sure both input arguments `remote_dir` and `local_dir`
         ended with a trailing slash.
+
+    !!! note
+        With `transfer_mode: tarstream`, the files are transferred by
+        `tarstream_put`: `ssh_opts` are passed to its `ssh` command, and
+        the files are listed by `tar -v` if `default_opts` contains `-v`
+        and `quiet` is not set. The other `default_opts` are ignored:
+        `-z` is replaced by `tarstream_compression`, `-p`, `-t` and `-r`
+        are the default behaviour of tar, and `-h` only changes the
+        output of `rsync`. With `delete`, `include`, or any other option
+        in `default_opts`, which are not supported by tar, `rsync` is
+        used.
     """
+    if (
+        use_tarstream()
+        and not delete
+        and len(include) == 0
+        and re.fullmatch(r"-[pthrvz]*", default_opts.strip()) is not None
+    ):
+        return tarstream_put(
+            local_dir=local_dir,
+            remote_dir=remote_dir,
+            exclude=exclude,
+            files_from=files_from,
+            capture=capture,
+            ssh_opts=ssh_opts,
+            verbose="v" in default_opts and not quiet,
+            max_capture_lines=max_capture_lines,
+        )
 
     # check if input args remote_dir and local_dir end by a trailing slash
     # or not
@@ -272,6 +1108,11 @@ def rsync_project(
     if not local_dir.endswith("/"):
         local_dir = local_dir + "/"
 
+    # create --include options from include list
+    include_opts = " ".join(
+        ["--include={}".format(item) for item in include]
+    )
+
     # create --exclude options from exclude list
     if len(exclude) > 0:
         exclude_opts = " ".join(
@@ -286,16 +1127,25 @@ def rsync_project(
     # add --quiet option if needed
     quiet_opt = "--quiet" if quiet is True else ""
 
+    # add --files-from option if needed
+    files_from_opt = (
+        "--files-from={}".format(files_from) if files_from is not None else ""
+    )
+
     # set port arg
     port_opt = "-p {}".format(env.port)
 
     # set RSH arg
-    rsh_opts = "--rsh='ssh {}'".format(" ".join([port_opt, ssh_opts]))
+    rsh_opts = "--rsh='ssh {}'".format(
+        " ".join([port_opt, ssh_control_opts(), ssh_opts])
+    )
 
-    rync_cmd = "rsync {} {} {} {} {} {} {}:{}".format(
+    rync_cmd = "rsync {} {} {} {} {} {} {} {} {}:{}".format(
         delete_opt,
+        include_opts,
         exclude_opts,
         quiet_opt,
+        files_from_opt,
         default_opts,
         rsh_opts,
         local_dir,
@@ -312,7 +1162,11 @@ def rsync_project(
     # conn = HostConnection()
     # return conn.run_command(command=rync_cmd, capture=capture)
 
-    return local(command=rync_cmd, capture=capture)
+    return local(
+        command=rync_cmd,
+        capture=capture,
+        max_capture_lines=max_capture_lines,
+    )
     # return rync_cmd, capture
     # return _run(cmd=rync_cmd, capture=capture)
 
@@ -354,27 +1208,39 @@ def put(
     if os.path.isdir(src) and os.path.isdir(dst) and dst.endswith("/"):
         src = src + "/*"
 
+    if use_tarstream() and os.path.isdir(src.rstrip("*").rstrip("/")):
+        # directories are sent as tar stream, single files are still sent
+        # by rsync
+        if src.endswith("/*"):
+            return tarstream_put(
+                local_dir=src[: -len("/*")], remote_dir=dst, capture=capture
+            )
+        return tarstream_put(
+            local_dir=os.path.dirname(src),
+            remote_dir=dst,
+            members=[os.path.basename(src)],
+            capture=capture,
+        )
+
     pu_cmd = ""
     if env.manual_gsissh:
         # TODO : I did not test globus-url-copy, and used the initialize code
-        if os.path.isdir(src):
-            # if src[-1] != "/":
-            if not src.endswith("/"):
-                env.manual_src = src + "/"
-                env.manual_dest = dst + "/"
-        else:
-            env.manual_src = src
-            env.manual_dest = dst
-        put_cmd = template(
-            "globus-url-copy -sync -r -cd -p 10 "
-            "file://$manual_src gsiftp://$host/$manual_dest"
-        )
+        # the paths are not stored in env, which may be shared by the
+        # threads of call_async
+        manual_src, manual_dest = src, dst
+        if os.path.isdir(src) and not src.endswith("/"):
+            manual_src, manual_dest = src + "/", dst + "/"
+        put_cmd = (
+            "globus-url-copy -sync -r -cd -p 10 file://{} gsiftp://{}/{}"
+        ).format(manual_src, env.host, manual_dest)
     elif env.manual_ssh:
         scp_opt = ""
         if os.path.isdir(src.rstrip("*")):
             scp_opt = "-rp"
 
-        put_cmd = "scp {} {} {}:{}".format(scp_opt, src, env.host_string, dst)
+        put_cmd = "scp {} {} {} {}:{}".format(
+            scp_opt, ssh_control_opts(), src, env.host_string, dst
+        )
     else:
         # here, instead of sftp program used by Fabric, I decided to use rsync
         # which is much faster in case of having folder as input src arg
@@ -384,7 +1250,7 @@ def put(
         port_opt = "-p {}".format(env.port)
 
         # set RSH arg
-        rsh_opts = "--rsh='ssh {}'".format(port_opt)
+        rsh_opts = "--rsh='ssh {} {}'".format(port_opt, ssh_control_opts())
 
         put_cmd = "rsync {} {} {} {}:{}".format(
             default_opts, rsh_opts, src, env.host_string, dst
@@ -0,0 +1,258 @@
+import cProfile
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from beartype.typing import Callable, Dict, List, Optional, Tuple
+from rich.console import Console
+from rich.table import Table, box
+
+# Profiling of the job() pipeline, enabled by `profile=true`.
+#
+# The wall and CPU times of the instrumented steps are aggregated per call
+# path, e.g., ("preparation", "job_preparation", "complete_environment"),
+# in each process. The pool workers write their statistics into
+# `_profile_dir` after each task, and they are merged by the main process
+# in `write_profile_report`. Each thread, e.g., of the streamed
+# transmission, has its own stack of steps.
+_enabled = False
+_cprofile = False
+_profile_dir = None
+_stacks: Dict[int, List[str]] = {}
+_stats: Dict[Tuple[str, ...], List[float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _reset_forked_process() -> None:
+    # the steps and statistics of the parent process are not the ones of a
+    # forked pool worker
+    global _stats_lock
+    _stacks.clear()
+    _stats.clear()
+    _stats_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_forked_process)
+
+
+def enable_profiling(profile_dir: str, cprofile: Optional[bool] = False):
+    """
+    Enable the profiling of the job pipeline.
+
+    !!! note
+        This function should be called before forking the pool workers.
+
+    Args:
+        profile_dir (str): the folder used to exchange the statistics of the
+            pool workers
+        cprofile (bool, optional): if `True`, also run cProfile in the pool
+            workers tasks
+    """
+    global _enabled, _cprofile, _profile_dir
+    _enabled = True
+    _cprofile = cprofile
+    _profile_dir = profile_dir
+    os.makedirs(_profile_dir, exist_ok=True)
+    _stacks.clear()
+    _stats.clear()
+
+
+def disable_profiling() -> None:
+    """
+    Disable the profiling, and discard the recorded statistics.
+    """
+    global _enabled
+    _enabled = False
+    _stacks.clear()
+    _stats.clear()
+
+
+def profiling_enabled() -> bool:
+    return _enabled
+
+
+@contextmanager
+def profile_step(name: str):
+    """
+    Record the wall and CPU time of a step, nested in the current step.
+    """
+    if not _enabled:
+        yield
+        return
+
+    stack = _stacks.setdefault(threading.get_ident(), [])
+    stack.append(name)
+    path = tuple(stack)
+    wall_time = time.perf_counter()
+    cpu_time = time.thread_time()
+    try:
+        yield
+    finally:
+        with _stats_lock:
+            stats = _stats.setdefault(path, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += time.perf_counter() - wall_time
+            stats[2] += time.thread_time() - cpu_time
+        stack.pop()
+
+
+def profiled(name: str) -> Callable:
+    """
+    Decorator recording the wall and CPU time of each call of a function as
+    a profiling step.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with profile_step(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def profiled_task(func: Callable) -> Callable:
+    """
+    Decorator for the functions executed by the pool workers: the task is
+    recorded as a profiling step, optionally run under cProfile, and the
+    statistics of the worker are saved in the profiling folder.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+
+        profiler = cProfile.Profile() if _cprofile else None
+        try:
+            with profile_step(func.__name__):
+                if profiler is None:
+                    return func(*args, **kwargs)
+                return profiler.runcall(func, *args, **kwargs)
+        finally:
+            _save_worker_stats(profiler)
+
+    return wrapper
+
+
+def _save_worker_stats(profiler: Optional[cProfile.Profile]) -> None:
+    prefix = os.path.join(_profile_dir, "worker_{}_".format(os.getpid()))
+    with tempfile.NamedTemporaryFile(
+        "w", prefix=prefix, suffix=".json", delete=False
+    ) as stats_file:
+        json.dump(
+            [[list(path)] + stats for path, stats in _stats.items()],
+            stats_file,
+        )
+    _stats.clear()
+    if profiler is not None:
+        profiler.dump_stats(stats_file.name[: -len(".json")] + ".prof")
+
+
+def write_profile_report(
+    report_dir: str, worker_phase: Optional[str] = "preparation"
+) -> str:
+    """
+    Merge the statistics of the main process and of the pool workers, and
+    write the profiling report in `report_dir`:
+
+    - `fabsim_profile.json`: calls, wall and CPU time of each step
+    - `fabsim_profile.folded`: self wall time of each step in microseconds,
+        in the folded stacks format of flamegraph.pl and speedscope
+    - `fabsim_profile.prof`: the merged cProfile statistics of the pool
+        workers, if enabled, to be read with `pstats` or snakeviz
+
+    Args:
+        report_dir (str): the folder of the report
+        worker_phase (str, optional): the phase under which the steps of
+            the pool workers are reported
+
+    Returns:
+        str: the path of the JSON report
+    """
+    stats = {path: list(values) for path, values in _stats.items()}
+    prof_files = []
+    for filename in sorted(os.listdir(_profile_dir)):
+        path = os.path.join(_profile_dir, filename)
+        if filename.endswith(".prof"):
+            prof_files.append(path)
+            continue
+        with open(path) as stats_file:
+            for step_path, calls, wall, cpu in json.load(stats_file):
+                key = (worker_phase,) + tuple(step_path)
+                values = stats.setdefault(key, [0, 0.0, 0.0])
+                values[0] += calls
+                values[1] += wall
+                values[2] += cpu
+
+    os.makedirs(report_dir, exist_ok=True)
+    report = os.path.join(report_dir, "fabsim_profile.json")
+    with open(report, "w") as report_file:
+        json.dump(
+            {
+                "steps": [
+                    {
+                        "path": list(path),
+                        "calls": values[0],
+                        "wall_time": values[1],
+                        "cpu_time": values[2],
+                    }
+                    for path, values in sorted(stats.items())
+                ]
+            },
+            report_file,
+            indent=2,
+        )
+
+    with open(
+        os.path.join(report_dir, "fabsim_profile.folded"), "w"
+    ) as folded_file:
+        for path, values in sorted(stats.items()):
+            children_time = sum(
+                child[1]
+                for child_path, child in stats.items()
+                if len(child_path) == len(path) + 1
+                and child_path[: len(path)] == path
+            )
+            self_time = max(values[1] - children_time, 0.0)
+            folded_file.write(
+                "{} {}\n".format(";".join(path), int(self_time * 1e6))
+            )
+
+    if prof_files:
+        pstats.Stats(*prof_files).dump_stats(
+            os.path.join(report_dir, "fabsim_profile.prof")
+        )
+
+    print_profile_summary(stats)
+    return report
+
+
+def print_profile_summary(stats: Dict[Tuple[str, ...], List[float]]):
+    table = Table(
+        title="\nprofile (worker times are summed over all workers)",
+        show_header=True,
+        box=box.ROUNDED,
+        header_style="dark_cyan",
+    )
+    table.add_column("step", style="blue")
+    table.add_column("calls", style="magenta")
+    table.add_column("wall time (s)", style="magenta")
+    table.add_column("CPU time (s)", style="magenta")
+    for path, values in sorted(stats.items()):
+        table.add_row(
+            "  " * (len(path) - 1) + path[-1],
+            str(values[0]),
+            "{:.3f}".format(values[1]),
+            "{:.3f}".format(values[2]),
+        )
+    Console().print(table)
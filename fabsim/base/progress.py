@@ -0,0 +1,137 @@
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+
+from beartype.typing import Dict, Optional
+from rich.console import Console
+from rich.table import Table, box
+
+
+class JobProgress:
+    """
+    Progress reporting of the `job()` pipeline.
+
+    The job_preparation workers report each prepared job script by
+    incrementing a counter in shared memory, which is read by a display
+    thread in the main process. Reporting a script is O(1), and no
+    filesystem access is needed to display the progress.
+
+    The wall time of each phase (preparation, transmission, submission) is
+    recorded with `phase()`, and reported by `print_summary()`.
+
+    !!! note
+        The object should be created before forking the pool workers.
+    """
+
+    def __init__(self, total: int, refresh_interval: float = 0.2):
+        self.total = total
+        self.refresh_interval = refresh_interval
+        self.counter = multiprocessing.Value("L", 0)
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self._done = threading.Event()
+        self._thread = None
+        self._start_time = None
+
+    def increment(self, count: int = 1) -> None:
+        """
+        Report `count` prepared job scripts, called by the pool workers.
+        """
+        with self.counter.get_lock():
+            self.counter.value += count
+
+    @property
+    def count(self) -> int:
+        return self.counter.value
+
+    def start(self) -> None:
+        """
+        Start the display thread.
+        """
+        self._start_time = time.time()
+        self._done.clear()
+        self._thread = threading.Thread(target=self._display)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the display thread, and print the final progress.
+        """
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _display(self) -> None:
+        last_count = -1
+        while True:
+            done = self._done.wait(self.refresh_interval)
+            count = self.count
+            if count != last_count or done:
+                last_count = count
+                print("\r" + self._progress_line(count), end="", flush=True)
+            if done:
+                print()
+                return
+
+    def _progress_line(self, count: int) -> str:
+        elapsed = max(time.time() - self._start_time, 1e-9)
+        throughput = "{:.1f} scripts/s".format(count / elapsed)
+        if self.total <= 0:
+            return "Generating scripts: {} ({})   ".format(count, throughput)
+
+        # Simple progress bar: [####    ] 4/10 (40%)
+        bar_width = 20
+        filled = min(bar_width, int(bar_width * count / self.total))
+        bar = "█" * filled + "░" * (bar_width - filled)
+        return "Generating scripts: [{}] {}/{} ({:.0f}%, {})   ".format(
+            bar,
+            count,
+            self.total,
+            min(100, count / self.total * 100),
+            throughput,
+        )
+
+    @contextmanager
+    def phase(self, name: str, items: Optional[int] = None):
+        """
+        Record the wall time of a phase of the job pipeline.
+
+        Args:
+            name (str): the name of phase
+            items (int, optional): the number of processed items (e.g., job
+                scripts), used to report the throughput. If `None`, the
+                number of reported scripts is used.
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = {
+                "time": time.time() - start_time,
+                "items": self.count if items is None else items,
+            }
+
+    def print_summary(self) -> None:
+        """
+        Print the wall time and throughput of each recorded phase.
+        """
+        table = Table(
+            title="\njob phases",
+            show_header=True,
+            box=box.ROUNDED,
+            header_style="dark_cyan",
+        )
+        table.add_column("phase", style="blue")
+        table.add_column("time (s)", style="magenta")
+        table.add_column("job scripts", style="magenta")
+        table.add_column("scripts/second", style="magenta")
+        for name, phase in self.phases.items():
+            table.add_row(
+                name,
+                "{:.3f}".format(phase["time"]),
+                str(phase["items"]),
+                "{:.1f}".format(phase["items"] / max(phase["time"], 1e-9)),
+            )
+        Console().print(table)
@@ -4,7 +4,6 @@ import random
 import string
 from os import path, rename
 
-import yaml
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
@@ -12,6 +11,7 @@ from rich.table import Table
 from fabsim.base.decorators import task
 from fabsim.base.env import env
 from fabsim.base.networks import local, run
+from fabsim.base.yaml_io import yaml_load_file
 from fabsim.deploy.templates import template
 
 
@@ -56,8 +56,7 @@ def install_plugin(plugin_name, branch=None):
         )
 
     fname = path.join(env.fabsim_root, "deploy", "plugins.yml")
-    with open(fname, encoding="utf-8") as file:
-        config = yaml.load(file, Loader=yaml.SafeLoader)
+    config = yaml_load_file(fname)
     info = config[plugin_name]
 
     plugin_dir = path.join(env.localroot, "plugins")
@@ -99,8 +98,7 @@ def avail_plugin():
     """
 
     fname = path.join(env.fabsim_root, "deploy", "plugins.yml")
-    with open(fname, encoding="utf-8") as file:
-        config = yaml.load(file, Loader=yaml.SafeLoader)
+    config = yaml_load_file(fname)
 
     table = Table(
         title="\nList of available plugins",
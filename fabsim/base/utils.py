@@ -1,8 +1,10 @@
 import inspect
 import os
 import platform
+import shutil
 import subprocess
 import sys
+import threading
 import time
 from contextlib import contextmanager
 from os import system
@@ -100,13 +102,12 @@ def show_avail_plugins() -> None:
     """
     Print the available plugins with their installation status
     """
-    import yaml
+    from fabsim.base.yaml_io import yaml_load_file
 
     # Read plugins configuration
     plugins_file = Path(env.fabsim_root) / "deploy" / "plugins.yml"
     try:
-        with open(plugins_file, encoding="utf-8") as file:
-            config = yaml.load(file, Loader=yaml.SafeLoader)
+        config = yaml_load_file(str(plugins_file))
     except FileNotFoundError:
         print("Error: plugins.yml file not found")
         return
@@ -158,18 +159,61 @@ def colored(color_code, text):
     return "\033[38;5;{}m{}\033[0;0m ".format(color_code, text)
 
 
+class ThreadPrefixer(object):
+    """
+    `sys.stdout` while `add_print_prefix` is used: the lines written by a
+    thread are prefixed by the prefixes added by this thread, so the
+    threads of `call_async` can print concurrently.
+    """
+
+    def __init__(self, orig):
+        self.orig = orig
+
+    def write(self, text):
+        prefixes = getattr(_print_prefixes, "stack", [])
+        if not prefixes:
+            return self.orig.write(text)
+        # the innermost prefix is written last
+        for prefix in reversed(prefixes):
+            text = "".join(
+                prefix + t + "\n" for t in text.rstrip().splitlines()
+            )
+        self.orig.write(text)
+
+    def __getattr__(self, attr):
+        return getattr(self.orig, attr)
+
+
+# The prefixes of each thread, and the number of active `add_print_prefix`
+# of all threads, `sys.stdout` is restored when it drops to 0
+_print_prefixes = threading.local()
+_print_prefix_lock = threading.Lock()
+_print_prefix_users = 0
+_print_prefix_stdout = None
+
+
 @contextmanager
 def add_print_prefix(prefix, color=24):
     # source : https://stackabuse.com/how-to-print-colored-text-in-python
-
-    current_out = sys.stdout
+    global _print_prefix_users, _print_prefix_stdout
+
+    with _print_prefix_lock:
+        if _print_prefix_users == 0:
+            _print_prefix_stdout = sys.stdout
+            sys.stdout = ThreadPrefixer(orig=sys.stdout)
+        _print_prefix_users += 1
+    if not hasattr(_print_prefixes, "stack"):
+        _print_prefixes.stack = []
+    _print_prefixes.stack.append(colored(color, "[{}]".format(prefix)))
     try:
-        sys.stdout = Prefixer(
-            prefix=colored(color, "[{}]".format(prefix)), orig=current_out
-        )
         yield
     finally:
-        sys.stdout = current_out
+        _print_prefixes.stack.pop()
+        with _print_prefix_lock:
+            _print_prefix_users -= 1
+            if _print_prefix_users == 0:
+                sys.stdout = _print_prefix_stdout
+                _print_prefix_stdout = None
 
 
 class OpenVPNContext(object):
@@ -332,3 +376,55 @@ def show_fabsim_version():
         # Simple fallback
         rich_print(f"[bold cyan]FabSim3[/bold cyan] version: "
                    f"[bold green]{version}[/bold green]")
+
+
+# ioctl request to clone a file (reflink) on Linux filesystems supporting it,
+# e.g., Btrfs and XFS
+_FICLONE = 0x40049409
+
+
+def link_file(src: str, dst: str) -> str:
+    """
+    Make `dst` a copy of `src` at the lowest cost supported by the
+    filesystem: a hard link, else a reflink (copy-on-write clone), else a
+    regular copy. An existing `dst` is replaced.
+
+    !!! note
+        With a hard link, both paths share the same inode, hence the same
+        content and permissions.
+
+    Returns:
+        str: the method used, `link`, `reflink` or `copy`
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+
+    try:
+        import fcntl
+
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        shutil.copymode(src, dst)
+        return "reflink"
+    except (ImportError, OSError):
+        pass
+
+    shutil.copy(src, dst)
+    return "copy"
+
+
+def fabsim_cache_dir() -> str:
+    """
+    Return the FabSim3 folder in the user cache directory, i.e.,
+    `$XDG_CACHE_HOME/FabSim3`, by default `~/.cache/FabSim3`.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "FabSim3")
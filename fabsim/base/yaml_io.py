@@ -0,0 +1,104 @@
+"""
+YAML input/output functions used by FabSim3.
+
+The libyaml based C loader and dumpers are used when PyYAML was built with
+libyaml, otherwise the pure Python classes are used. Both produce the same
+results, the C versions are only faster.
+"""
+from io import IOBase
+
+import yaml
+from beartype import beartype
+from beartype.typing import Any, Optional, Union
+
+LIBYAML = bool(getattr(yaml, "__with_libyaml__", False))
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+# The env is dumped with the full Dumper, since it contains python objects,
+# e.g., the `pather` module
+Dumper = getattr(yaml, "CDumper", yaml.Dumper)
+
+
+class EnvLoader(SafeLoader):
+    """
+    Safe loader for env.yml files, python objects (e.g., `pather` module)
+    are loaded as their names.
+    """
+
+
+EnvLoader.add_multi_constructor(
+    "tag:yaml.org,2002:python/",
+    lambda loader, suffix, node: suffix.split(":", 1)[-1],
+)
+
+
+@beartype
+def yaml_load(stream: Union[str, bytes, IOBase]) -> Any:
+    """
+    Load a YAML document with the safe loader.
+
+    Args:
+        stream (Union[str, bytes, IOBase]): the YAML document or an opened file
+
+    Returns:
+        Any: the loaded python object
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+@beartype
+def yaml_load_file(path: str) -> Any:
+    """
+    Load a YAML file with the safe loader.
+
+    Args:
+        path (str): the path of YAML file
+
+    Returns:
+        Any: the loaded python object
+    """
+    with open(path, encoding="utf-8") as yaml_file:
+        return yaml.load(yaml_file, Loader=SafeLoader)
+
+
+@beartype
+def yaml_load_env(stream: Union[str, bytes, IOBase]) -> Any:
+    """
+    Load an env.yml document written by `yaml_dump(..., safe=False)`.
+
+    Args:
+        stream (Union[str, bytes, IOBase]): the YAML document or an opened file
+
+    Returns:
+        Any: the loaded python object
+    """
+    return yaml.load(stream, Loader=EnvLoader)
+
+
+@beartype
+def yaml_dump(
+    data: Any,
+    stream: Optional[IOBase] = None,
+    safe: Optional[bool] = True,
+    **kwargs,
+) -> Optional[str]:
+    """
+    Dump a python object as YAML.
+
+    Args:
+        data (Any): the python object to be dumped
+        stream (IOBase, optional): the opened file, if `None`, the YAML
+            document is returned as a string
+        safe (bool, optional): if `False`, python objects which are not
+            supported by the safe dumper (e.g., modules) are dumped with
+            python specific tags
+        **kwargs: extra arguments passed to `yaml.dump`, e.g.,
+            `default_flow_style`
+
+    Returns:
+        Optional[str]: the YAML document if `stream` is `None`
+    """
+    return yaml.dump(
+        data, stream, Dumper=SafeDumper if safe else Dumper, **kwargs
+    )
@@ -5,47 +5,42 @@ import sys
 import time
 from pprint import pformat, pprint
 
-import yaml
 from beartype import beartype
-from beartype.typing import Dict, List, Optional
+from beartype.typing import Any, Callable, Dict, List, Optional, Tuple
 from rich.console import Console
 from rich.panel import Panel
 
 from fabsim.base.decorators import task
 from fabsim.base.env import env
+from fabsim.base.profiling import profiled
 from fabsim.base.utils import add_print_prefix
-from fabsim.deploy.templates import template
+from fabsim.base.yaml_io import yaml_load_file
+from fabsim.deploy.templates import template, template_variables
 
-config = yaml.safe_load(
-    open(os.path.join(env.fabsim_root, "deploy", "machines.yml"))
+config = yaml_load_file(
+    os.path.join(env.fabsim_root, "deploy", "machines.yml")
 )
 # Include private machines
 config_file_private = os.path.join(
     env.fabsim_root, "deploy", "machines_private.yml"
 )
 if os.path.isfile(config_file_private):
-    config_private = yaml.safe_load(
-        open(config_file_private)
-    )
+    config_private = yaml_load_file(config_file_private)
     config |= config_private
 
 env.update(config["default"])
 
 try:
-    user_config = yaml.safe_load(
-        open(os.path.join(env.fabsim_root, "deploy", "machines_user.yml"))
+    user_config = yaml_load_file(
+        os.path.join(env.fabsim_root, "deploy", "machines_user.yml")
     )
 except FileNotFoundError:
     # raise FileNotFoundError(
     #     "There is NO machines_user.yml under fabsim/deploy directory!!!\n"
     # )
     print("There is not machines_user.yml under fabsim/deploy folder!!!\n")
-    user_config = yaml.safe_load(
-        open(
-            os.path.join(
-                env.fabsim_root, "deploy", "machines_user_example.yml"
-            )
-        )
+    user_config = yaml_load_file(
+        os.path.join(env.fabsim_root, "deploy", "machines_user_example.yml")
     )
 env.update(user_config["default"])
 
@@ -157,68 +152,111 @@ def load_machine(machine_name: str) -> None:
     if machine_name in user_config:
         env.modules.update(user_config[machine_name].get("modules", {}))
 
+    # the keys of the previous machine are all derived again
+    clear_derived_env()
     complete_environment()
 
 
-def complete_environment() -> None:
+# Memoized derived env keys of `complete_environment`: for each key, the
+# `(name, value, snapshot)` of its inputs at the last computation, and the
+# computed value.
+_derived_env: Dict[str, Tuple[List[Tuple[str, Any, Any]], Any]] = {}
+_MISSING = object()
+# the values of these types (and the `_MISSING` object) are not modified in
+# place, an input is unchanged if its value is the same object
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None), object)
+
+
+def _frozen(value: Any) -> Any:
+    # comparable snapshot of an env value, the type is kept since, e.g.,
+    # `1 == True` but they are not rendered the same in a template
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return (type(value),) + tuple(map(_frozen, value))
+    if isinstance(value, dict):
+        return (dict,) + tuple(
+            (key, _frozen(item)) for key, item in value.items()
+        )
+    return (type(value), value)
+
+
+def _snapshot(names: List[str]) -> List[Tuple[str, Any, Any]]:
+    snapshot = []
+    for name in names:
+        value = env.get(name, _MISSING)
+        snapshot.append((name, value, _frozen(value)))
+    return snapshot
+
+
+def derived_env(
+    key: str, compute: Callable[[List[str]], Any], *depends_on: str
+) -> Any:
     """
-    Add paths to the environment based on information in the yaml configs
-    files.
+    Return the value of the derived env key `key`, memoized until one of its
+    inputs changes.
 
-    Environment vars created can be used in job-script templates:
+    Args:
+        key (str): the name of the derived key
+        compute (Callable): computes the value, from the env keys
+            `depends_on` and the env keys it appends to the list passed as
+            argument, e.g., the variables of the rendered templates (see
+            `tracked_template`)
+        *depends_on (str): the env keys used by `compute`
+
+    Returns:
+        Any: the value of the derived key, which is not assigned to `env`
+    """
+    memo = _derived_env.get(key)
+    if memo is not None:
+        for name, old_value, snapshot in memo[0]:
+            value = env.get(name, _MISSING)
+            if value is old_value and type(value) in _IMMUTABLE_TYPES:
+                continue
+            if _frozen(value) != snapshot:
+                break
+        else:
+            return memo[1]
 
-    - `results_path`: Path to store results
-    - `remote_path` : Root of area for checkout and build on remote
-    - `config_path` : Path to store config files
-    - `scripts_path` : Path where job-queue-submission scripts generated by
-        Fabric are sent.
-    - `run_prefix` : Command string to invoke before any job is run.
+    inputs = list(depends_on)
+    # snapshot of the inputs before the computation, since derived keys may
+    # be computed in place, e.g., `env.stat = template(env.stat)`
+    snapshot = _snapshot(inputs)
+    value = compute(inputs)
+    snapshot += _snapshot(inputs[len(snapshot):])
+    _derived_env[key] = (snapshot, value)
+    return value
+
+
+def tracked_template(pattern: str, inputs: List[str]) -> str:
     """
-    env.host_string = "{}@{}".format(env.username, env.remote)
-    env.home_path = template(env.home_path_template)
-    env.runtime_path = template(env.runtime_path_template)
-    env.work_path = template(env.work_path_template)
-    env.remote_path = template(env.remote_path_template)
-    env.stat = template(env.stat)
-    env.results_path = os.path.join(env.work_path, "results")
-    env.config_path = os.path.join(env.work_path, "config_files")
-    env.scripts_path = os.path.join(env.work_path, "scripts")
-    env.local_results = os.path.expanduser(template(env.local_results))
-    env.local_system_time = int(time.time())
+    Same as `template(pattern)`, and append the variables of `pattern` to
+    the `inputs` of a derived env key (see `derived_env`).
+    """
+    inputs.extend(template_variables(pattern))
+    return template(pattern)
 
-    if hasattr(env, "flee_location"):
-        env.flee_location = template(env.flee_location)
 
-    for i in range(0, len(env.local_templates_path)):
-        env.local_templates_path[i] = os.path.expanduser(
-            template(env.local_templates_path[i])
-        )
+def clear_derived_env() -> None:
+    """
+    Discard the memoized derived env keys of `complete_environment`.
+    """
+    _derived_env.clear()
 
-    for i in range(0, len(env.local_config_file_path)):
-        env.local_config_file_path[i] = os.path.expanduser(
-            template(env.local_config_file_path[i])
-        )
 
-    # module_commands = generate_module_commands()
+def _compute_run_prefix(inputs: List[str]) -> str:
     module_commands = generate_module_commands(script=env.get("script", None))
-    run_prefix_commands = env.run_prefix_commands[:]
-    env.run_prefix = (
+    run_prefix = (
         " \n".join(
             module_commands
-            + list(map(template, map(template, run_prefix_commands)))
+            + [
+                tracked_template(tracked_template(command, inputs), inputs)
+                for command in env.run_prefix_commands
+            ]
         )
         or "true"
     )
 
-    if env.temp_path_template:
-        env.temp_path = template(env.temp_path_template)
-
-    if hasattr(env, "virtual_env_path") and env.virtual_env_path:
-        env.virtual_env_path = template(env.virtual_env_path)
-
-    if hasattr(env, "app_repository") and env.app_repository:
-        env.app_repository = template(env.app_repository)
-
     if (
         # not any(
         #     "install_app" in str or "install_packages" in str
@@ -231,11 +269,107 @@ def complete_environment() -> None:
         # since we are going to load python VirtualEnv, so, it would be better
         # to unload any current loaded python modules, in order to avoid
         # conflicts during the execution of python program
-        env.run_prefix += (
+        run_prefix += (
             "\n# load python from VirtualEnv"
             "\nmodule unload python\n"
             "source {}/bin/activate".format(env.virtual_env_path)
         )
+    return run_prefix
+
+
+@profiled("complete_environment")
+def complete_environment() -> None:
+    """
+    Add paths to the environment based on information in the yaml configs
+    files.
+
+    Environment vars created can be used in job-script templates:
+
+    - `results_path`: Path to store results
+    - `remote_path` : Root of area for checkout and build on remote
+    - `config_path` : Path to store config files
+    - `scripts_path` : Path where job-queue-submission scripts generated by
+        Fabric are sent.
+    - `run_prefix` : Command string to invoke before any job is run.
+
+    The derived keys are memoized (see `derived_env`), so only the keys
+    with changed inputs are computed again, e.g., by the per-replica calls
+    of `job_preparation`.
+    """
+    env.host_string = "{}@{}".format(env.username, env.remote)
+    for key in ("home_path", "runtime_path", "work_path", "remote_path"):
+        env[key] = derived_env(
+            key,
+            lambda inputs, key=key: tracked_template(
+                env[key + "_template"], inputs
+            ),
+            key + "_template",
+        )
+    env.stat = derived_env(
+        "stat", lambda inputs: tracked_template(env.stat, inputs), "stat"
+    )
+    for key, folder in (
+        ("results_path", "results"),
+        ("config_path", "config_files"),
+        ("scripts_path", "scripts"),
+    ):
+        env[key] = derived_env(
+            key,
+            lambda inputs, folder=folder: os.path.join(env.work_path, folder),
+            "work_path",
+        )
+    env.local_results = derived_env(
+        "local_results",
+        lambda inputs: os.path.expanduser(
+            tracked_template(env.local_results, inputs)
+        ),
+        "local_results",
+    )
+    env.local_system_time = int(time.time())
+
+    if hasattr(env, "flee_location"):
+        env.flee_location = derived_env(
+            "flee_location",
+            lambda inputs: tracked_template(env.flee_location, inputs),
+            "flee_location",
+        )
+
+    for key in ("local_templates_path", "local_config_file_path"):
+        # the lists are updated in place
+        env[key][:] = derived_env(
+            key,
+            lambda inputs, key=key: tuple(
+                os.path.expanduser(tracked_template(path, inputs))
+                for path in env[key]
+            ),
+            key,
+        )
+
+    env.run_prefix = derived_env(
+        "run_prefix",
+        _compute_run_prefix,
+        "modules",
+        "script",
+        "run_prefix_commands",
+        "task",
+        "venv",
+        "virtual_env_path",
+    )
+
+    if env.temp_path_template:
+        env.temp_path = derived_env(
+            "temp_path",
+            lambda inputs: tracked_template(env.temp_path_template, inputs),
+            "temp_path_template",
+        )
+
+    for key in ("virtual_env_path", "app_repository"):
+        if hasattr(env, key) and env[key]:
+            env[key] = derived_env(
+                key,
+                lambda inputs, key=key: tracked_template(env[key], inputs),
+                key,
+            )
 
 
 def update_environment(*dicts):
@@ -251,8 +385,8 @@ def load_plugins() -> None:
     # here, if we use the globals(), new changes will no be permanent for other
     # files, so, we need to write them into global namespace seen by this frame
     caller_globals = inspect.stack()[1][0].f_globals
-    plugins = yaml.safe_load(
-        open(os.path.join(env.fabsim_root, "deploy", "plugins.yml"))
+    plugins = yaml_load_file(
+        os.path.join(env.fabsim_root, "deploy", "plugins.yml")
     )
 
     for key in plugins.keys():
@@ -362,9 +496,7 @@ def add_plugin_environment_variable(plugin_name: str) -> None:
         print("\nNO machines_{}_user.yml FOUND\n".format(plugin_name))
         return
 
-    plugin_config = yaml.load(
-        open(plugin_machines_user), Loader=yaml.SafeLoader
-    )
+    plugin_config = yaml_load_file(plugin_machines_user)
 
     if plugin_config is None:
         print("\nmachines_{}_user.yml is empty\n".format(plugin_name))
@@ -1,22 +1,259 @@
-import errno
+import atexit
+import hashlib
+import multiprocessing
 import os
-import re
 import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from shutil import rmtree
 from string import Template
-from typing import Any, Dict, FrozenSet, Set, Tuple
+from typing import Any, Callable, Dict, Hashable, MutableMapping, Tuple
 
 from beartype import beartype
 from beartype.typing import Optional
 
 from fabsim.base.env import env
+from fabsim.base.profiling import profiled
+from fabsim.base.utils import fabsim_cache_dir
+
+
+class TemplateCache:
+    """
+    LRU cache of the processed templates, bounded by the number of entries
+    and by their total size (in characters).
+
+    The hits, misses and evictions are counted in shared memory, so the
+    counters include the lookups of the pool workers forked after the
+    creation of the cache.
+
+    If `shared` is set (see `start_shared_template_cache`), the templates
+    missing in the cache of the process are looked up in, and the processed
+    templates are published to, this mapping shared by all processes.
+    """
+
+    def __init__(self, max_entries: int, max_size: int):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.shared: Optional[MutableMapping] = None
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        # hits, misses, evictions, hits in the shared cache
+        self._counters = multiprocessing.Array("q", 4)
+
+    def _count(self, index: int, count: int = 1) -> None:
+        with self._counters.get_lock():
+            self._counters[index] += count
+
+    def _shared_call(self, func: Callable, *args) -> Any:
+        try:
+            return func(*args)
+        except (OSError, EOFError):
+            # the shared cache is not available anymore, e.g., its manager
+            # was shut down
+            self.shared = None
+            return None
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """
+        Return the cached value of `key` (and mark it as the most recently
+        used), or `None`.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is not None:
+            self._count(0)
+            return value
+
+        if self.shared is not None:
+            value = self._shared_call(self.shared.get, key)
+            if value is not None:
+                self._count(3)
+                self._insert(key, value)
+                return value
+        self._count(1)
+        return None
+
+    def put(self, key: Hashable, value: str) -> None:
+        """
+        Cache `value`, and evict the least recently used entries beyond the
+        bounds of the cache.
+        """
+        self._insert(key, value)
+        if self.shared is not None:
+            self._shared_call(self.shared.__setitem__, key, value)
+
+    def _insert(self, key: Hashable, value: str) -> None:
+        evictions = 0
+        with self._lock:
+            old_value = self._entries.pop(key, None)
+            if old_value is not None:
+                self.size -= len(old_value)
+            self._entries[key] = value
+            self.size += len(value)
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries
+                or self.size > self.max_size
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                evictions += 1
+        if evictions:
+            self._count(2, evictions)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        if self.shared is not None:
+            self._shared_call(self.shared.clear)
+
+    def reset_stats(self) -> None:
+        with self._counters.get_lock():
+            self._counters[:] = [0, 0, 0, 0]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the hits, misses, evictions and hit ratio of the cache, and
+        its current number of entries and size.
+        """
+        hits, misses, evictions, shared_hits = self._counters[:]
+        return {
+            "hits": hits,
+            "shared_hits": shared_hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_ratio": (hits + shared_hits)
+            / max(1, hits + shared_hits + misses),
+            "entries": len(self._entries),
+            "size": self.size,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TemplateDiskCache:
+    """
+    Persistent cache of the processed templates, shared by the FabSim3
+    invocations (and processes) of a user.
+
+    Each processed template is saved in a file named by the SHA-256 of its
+    key, i.e., the hash of the template content and the values of its
+    variables. The files are written to a temporary file and renamed, so a
+    file is either missing or complete, and they are read without locks.
+    The least recently used files are removed by `prune` beyond `max_size`
+    bytes.
+    """
+
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        # hits, misses, writes, evictions
+        self._counters = multiprocessing.Array("q", 4)
+
+    def _count(self, index: int, count: int = 1) -> None:
+        with self._counters.get_lock():
+            self._counters[index] += count
+
+    def _file(self, key: Tuple) -> str:
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, key: Tuple) -> Optional[str]:
+        """
+        Return the cached value of `key`, or `None`.
+        """
+        path = self._file(key)
+        try:
+            with open(path, encoding="utf-8", newline="") as cached:
+                value = cached.read()
+            # the modification time is the last use, for `prune`
+            os.utime(path)
+        except OSError:
+            # missing, or removed by a concurrent `prune`
+            self._count(1)
+            return None
+        self._count(0)
+        return value
+
+    def put(self, key: Tuple, value: str) -> None:
+        """
+        Save `value` in the cache. The errors are ignored, the cache is
+        only an optimisation.
+        """
+        path = self._file(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(path), prefix=".tmp_"
+            )
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as cached:
+                cached.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._count(2)
+
+    def prune(self) -> int:
+        """
+        Remove the least recently used files beyond `max_size` bytes, and
+        the temporary files left by interrupted writes.
+
+        Returns:
+            int: the number of removed files
+        """
+        files = []
+        removed = 0
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if name.startswith(".tmp_"):
+                        if stat.st_mtime < time.time() - 3600:
+                            os.remove(path)
+                            removed += 1
+                        continue
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= file_size
+            removed += 1
+            self._count(3)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        hits, misses, writes, evictions = self._counters[:]
+        return {
+            "path": self.path,
+            "hits": hits,
+            "misses": misses,
+            "writes": writes,
+            "evictions": evictions,
+        }
+
 
 # Template cache to store loaded raw templates
 _template_cache: Dict[str, str] = {}
-# Cache for processed templates - keys are (template_name, relevant_env_vars)
-_processed_template_cache: Dict[Tuple[str, FrozenSet[Tuple[str, str]]],
-                                str] = {}
-# Cache for template variable patterns (optimization for large-scale jobs)
-_template_vars_cache: Dict[str, Set[str]] = {}
+# SHA-256 of the raw templates, for the keys of the disk cache
+_template_hash_cache: Dict[str, str] = {}
 
 # Configuration for cache management (can be overridden via environment
 # or machines_user.yml)
@@ -24,9 +261,30 @@ MAX_PROCESSED_CACHE_SIZE = int(os.environ.get(
     'template_cache_size',
     '2000'
 ))
+# Bound of the total size of the processed templates, in characters
+MAX_PROCESSED_CACHE_CHARS = int(os.environ.get(
+    'template_cache_max_chars',
+    str(64 * 1024 * 1024)
+))
+# Cache for processed templates - keys are (template_name, fingerprint), the
+# fingerprint being the values of the variables used by the template
+_processed_template_cache = TemplateCache(
+    MAX_PROCESSED_CACHE_SIZE, MAX_PROCESSED_CACHE_CHARS
+)
+# Variables used by each template, which are fingerprinted
+_template_vars_cache: Dict[str, Tuple[str, ...]] = {}
+# Manager process of the shared processed templates, see
+# `start_shared_template_cache`
+_shared_template_manager = None
+# Persistent cache of the processed templates, see `template_disk_cache`
+_template_disk_cache: Optional[TemplateDiskCache] = None
 # Flag to show cache status message only once per session
 _cache_status_shown = False
 
+# Compiled templates, see `compile_template`
+_compiled_template_cache: Dict[str, Tuple] = {}
+MAX_COMPILED_CACHE_SIZE = 4096
+
 
 def _get_cache_setting():
     """Get caching setting from environment, machines config, or default."""
@@ -52,6 +310,7 @@ def _get_cache_setting():
 ENABLE_TEMPLATE_CACHE = _get_cache_setting()
 
 
+@profiled("script_templates")
 def script_templates(*names, **options):
     # Show template cache status once per session (only in main process)
     global _cache_status_shown
@@ -80,6 +339,7 @@ def script_templates(*names, **options):
     )
 
 
+@profiled("script_template_content")
 @beartype
 def script_template_content(template_name: str):
     """
@@ -95,17 +355,121 @@ def script_template_content(template_name: str):
         return _load_and_process_template_uncached(template_name)
 
     # First, try to get the raw template from cache
-    if template_name not in _template_cache:
-        found = False
-        for p in env.local_templates_path:
-            template_file_path = os.path.join(p, template_name)
-            if os.path.exists(template_file_path):
-                with open(template_file_path) as source:
-                    _template_cache[template_name] = source.read()
-                found = True
-                break
+    raw_template = script_template_source(template_name)
+
+    # The variables used by the template are only analysed once
+    template_vars = script_template_variables(template_name, raw_template)
+
+    # The processed template only depends on the values of these variables
+    # (`None` for the variables missing in env, which are kept as is)
+    cache_key = (
+        template_name,
+        tuple(str(env[var]) if var in env else None for var in template_vars),
+    )
 
-        if not found:
+    processed_template = _processed_template_cache.get(cache_key)
+    if processed_template is None:
+        disk_cache = template_disk_cache()
+        if disk_cache is not None:
+            template_hash = _template_hash_cache.get(template_name)
+            if template_hash is None:
+                template_hash = hashlib.sha256(
+                    raw_template.encode("utf-8")
+                ).hexdigest()
+                _template_hash_cache[template_name] = template_hash
+            disk_key = (template_hash, cache_key[1])
+            processed_template = disk_cache.get(disk_key)
+
+        if processed_template is None:
+            processed_template = template(raw_template)
+            if disk_cache is not None:
+                disk_cache.put(disk_key, processed_template)
+        _processed_template_cache.put(cache_key, processed_template)
+
+    return processed_template
+
+
+def template_disk_cache() -> Optional[TemplateDiskCache]:
+    """
+    Return the persistent cache of the processed templates, or `None` if
+    not enabled (`template_disk_cache`). It is saved in
+    `template_disk_cache_dir`, by default in the `templates` folder of the
+    FabSim3 user cache directory, and bounded by
+    `template_disk_cache_max_mb` megabytes.
+    """
+    global _template_disk_cache
+    if str(env.get("template_disk_cache", False)).lower() not in (
+        "true", "1", "yes", "on"
+    ):
+        return None
+
+    path = os.path.expanduser(
+        str(env.get("template_disk_cache_dir", "") or "")
+    ) or os.path.join(fabsim_cache_dir(), "templates")
+    max_size = int(float(env.get("template_disk_cache_max_mb", 100)) * 1e6)
+    if (
+        _template_disk_cache is None
+        or _template_disk_cache.path != path
+        or _template_disk_cache.max_size != max_size
+    ):
+        _template_disk_cache = TemplateDiskCache(path, max_size)
+    return _template_disk_cache
+
+
+def prune_template_disk_cache() -> int:
+    """
+    Evict the least recently used processed templates of the persistent
+    cache beyond its size bound, if enabled.
+
+    Returns:
+        int: the number of removed files
+    """
+    disk_cache = template_disk_cache()
+    if disk_cache is None:
+        return 0
+    return disk_cache.prune()
+
+
+def script_template_variables(
+    template_name: str, raw_template: str
+) -> Tuple[str, ...]:
+    """
+    Return the sorted names of the variables used by a template, analysed
+    once per template name.
+    """
+    template_vars = _template_vars_cache.get(template_name)
+    if template_vars is None:
+        template_vars = tuple(sorted(set(template_variables(raw_template))))
+        _template_vars_cache[template_name] = template_vars
+    return template_vars
+
+
+@beartype
+def find_template(template_name: str) -> Optional[str]:
+    """
+    Return the path of a template in the `local_templates_path`
+    directories, or `None` if it is not found.
+    """
+    for p in env.local_templates_path:
+        template_file_path = os.path.join(p, template_name)
+        if os.path.exists(template_file_path):
+            return template_file_path
+    return None
+
+
+@beartype
+def script_template_source(template_name: str) -> str:
+    """
+    Return the raw (not substituted) text of a template, looked up in the
+    `local_templates_path` directories. The text is kept in the raw
+    template cache.
+    """
+    if template_name not in _template_cache:
+        template_file_path = find_template(template_name)
+        if template_file_path is not None:
+            with open(template_file_path) as source:
+                _template_cache[template_name] = source.read()
+        else:
             raise UnboundLocalError(
                 "FabSim Error: could not find template file {} . \
                 FabSim looked for it in the following directories: {}".format(
@@ -113,67 +477,89 @@ def script_template_content(template_name: str):
                 )
             )
 
-    # Get template from cache
-    raw_template = _template_cache[template_name]
+    return _template_cache[template_name]
 
-    # Optimized: Check if we've already analyzed this template's variables
-    if template_name not in _template_vars_cache:
-        # One-time analysis using regex (more efficient than string search)
-        var_pattern = re.compile(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)\}?')
-        env_vars_in_template = set(var_pattern.findall(raw_template))
-        _template_vars_cache[template_name] = env_vars_in_template
-    else:
-        # Use cached variable analysis
-        env_vars_in_template = _template_vars_cache[template_name]
 
-    # Filter to only variables that exist in current env
-    relevant_vars = {var for var in env_vars_in_template if var in env}
+def script_template_filename() -> str:
+    """
+    Return the job script file name, i.e., `<name>_<label>.sh`, based on
+    the `name` and `label` env variables.
+    """
+    filename = env["name"]
 
-    # Create a cache key from template name and relevant env vars
-    cache_key = (template_name,
-                 frozenset((k, str(env.get(k, ''))) for k in relevant_vars))
+    if hasattr(env, "label") and len(env.label) > 0:
+        filename += "_" + env.label
 
-    # If we have a cached processed template for this exact environment, use it
-    if cache_key in _processed_template_cache:
-        return _processed_template_cache[cache_key]
+    return filename + ".sh"
 
-    # Process the template and cache the result
-    processed_template = template(raw_template)
 
-    # Safe cache size management to prevent unbounded growth
-    if len(_processed_template_cache) >= MAX_PROCESSED_CACHE_SIZE:
-        # Remove oldest 10% of entries (simple FIFO cleanup)
-        cleanup_count = max(1, MAX_PROCESSED_CACHE_SIZE // 10)
-        for _ in range(cleanup_count):
-            if _processed_template_cache:
-                oldest_key = next(iter(_processed_template_cache))
-                _processed_template_cache.pop(oldest_key)
+# The FabSim3 invocation which owns the `deploy/.jobscripts/<pid>` folder,
+# i.e., the process which imported this module, and not its forked pool
+# workers
+_jobscripts_pid = os.getpid()
 
-    _processed_template_cache[cache_key] = processed_template
 
-    return processed_template
+def jobscripts_dir() -> str:
+    """
+    Return the folder of the scripts saved by `script_template_save_temporary`
+    in the current FabSim3 invocation, removed at exit.
+    """
+    return os.path.join(
+        env.fabsim_root, "deploy", ".jobscripts", str(_jobscripts_pid)
+    )
+
+
+def remove_script_templates(children_only: Optional[bool] = False) -> None:
+    """
+    Remove the scripts saved by `script_template_save_temporary` in the
+    current FabSim3 invocation.
+
+    Args:
+        children_only (bool, optional): only remove the scripts of the other
+            processes, e.g., of the finished pool workers
+    """
+    if os.getpid() != _jobscripts_pid or not env.get("fabsim_root"):
+        return
+    if not children_only:
+        rmtree(jobscripts_dir(), ignore_errors=True)
+        return
+    if not os.path.isdir(jobscripts_dir()):
+        return
+    for name in os.listdir(jobscripts_dir()):
+        if not name.startswith("{}_".format(os.getpid())):
+            rmtree(os.path.join(jobscripts_dir(), name), ignore_errors=True)
+
+
+atexit.register(remove_script_templates)
 
 
 @beartype
 def script_template_save_temporary(content: str) -> str:
-    destname = os.path.join(
-        env.fabsim_root, "deploy", ".jobscripts", env["name"]
-    )
+    """
+    Save a generated script in
+    `deploy/.jobscripts/<pid>/<pid>_<thread>/<name>_<label>.sh`.
 
-    if hasattr(env, "label") and len(env.label) > 0:
-        destname += "_" + env.label
+    Each thread of each process (e.g., pool workers) has its own staging
+    folder, and each FabSim3 invocation its own `.jobscripts/<pid>` folder,
+    removed at exit. The file is written to a temporary file first and then
+    atomically renamed, so concurrent writers never race on the same file.
+    The script file name is unchanged.
 
-    destname += ".sh"
+    Returns:
+        str: the path of the saved script
+    """
+    destname = os.path.join(
+        jobscripts_dir(),
+        "{}_{}".format(os.getpid(), threading.get_ident()),
+        script_template_filename(),
+    )
 
     # Support for multi-level directories in the configuration files.
-    if not os.path.exists(os.path.dirname(destname)):
-        try:
-            os.makedirs(os.path.dirname(destname))
-        except OSError as exc:  # Guard against race condition
-            if exc.errno != errno.EEXIST:
-                raise
-    target = open(destname, "w")
-    target.write(content)
+    os.makedirs(os.path.dirname(destname), exist_ok=True)
+    tmp_destname = "{}.tmp".format(destname)
+    with open(tmp_destname, "w") as target:
+        target.write(content)
+    os.replace(tmp_destname, destname)
     return destname
 
 
@@ -189,19 +575,99 @@ def script_template(template_name: str) -> str:
     return script_template_save_temporary(result)
 
 
+def _compile(pattern: str) -> Tuple:
+    # same syntax as string.Template: literal text and (name, slot) pairs
+    # alternate, the escaped `$$` are already replaced by `$` in the literal
+    # text, and the invalid `$` are kept
+    parts = []
+    literal = []
+    position = 0
+    for match in Template.pattern.finditer(pattern):
+        literal.append(pattern[position:match.start()])
+        position = match.end()
+        name = match.group("named") or match.group("braced")
+        if name is not None:
+            parts.append("".join(literal))
+            parts.append((name, match.group()))
+            literal = []
+        elif match.group("escaped") is not None:
+            literal.append(Template.delimiter)
+        else:
+            literal.append(match.group())
+    literal.append(pattern[position:])
+    parts.append("".join(literal))
+    return tuple(parts)
+
+
+def compile_template(pattern: str) -> Tuple:
+    """
+    Parse a template pattern once into a tuple alternating the literal text
+    and the `(name, slot)` of the variables, e.g., `"cd $job_results"` is
+    compiled to `("cd ", ("job_results", "$job_results"), "")`. The
+    compiled templates are cached by pattern.
+    """
+    compiled = _compiled_template_cache.get(pattern)
+    if compiled is None:
+        if len(_compiled_template_cache) >= MAX_COMPILED_CACHE_SIZE:
+            _compiled_template_cache.clear()
+        compiled = _compile(pattern)
+        _compiled_template_cache[pattern] = compiled
+    return compiled
+
+
+def template_variables(pattern: str) -> Tuple[str, ...]:
+    """
+    Return the names of the variables used by a template pattern.
+    """
+    return tuple(slot[0] for slot in compile_template(pattern)[1::2])
+
+
+def render_template(compiled: Tuple, mapping: Dict[str, Any]) -> str:
+    """
+    Render a compiled template with the values of `mapping`, same as
+    `string.Template(pattern).safe_substitute(mapping)`: the variables
+    missing in `mapping` are left unchanged.
+    """
+    output = [compiled[0]]
+    for i in range(1, len(compiled), 2):
+        name, slot = compiled[i]
+        try:
+            output.append(str(mapping[name]))
+        except KeyError:
+            output.append(slot)
+        output.append(compiled[i + 1])
+    return "".join(output)
+
+
 @beartype
 def template(pattern: str, number_of_iterations: Optional[int] = 1) -> str:
     """
     Low-level templating function, insert env variables into any string pattern
         - number_of_iterations can be adjusted to allow recurring
                 templating using a single function call.
+
+    Only the first iteration renders the pattern compiled once (see
+    `compile_template`). With `number_of_iterations > 1`, the nested
+    variables (i.e., in the values of the substituted variables) are
+    substituted by the next iterations, each one a full pass over the
+    result of the previous one, compiled again and not cached, as by
+    repeated calls of `string.Template.safe_substitute`: a `$$` escape or a
+    `$` at the end of a value can start a variable in the next pass, so the
+    nested variables can not be resolved in advance. The iterations stop as
+    soon as one has nothing left to substitute.
     """
     # print(env.flee_location)
     try:
-        for i in range(0, number_of_iterations):
-            # template = Template(pattern).substitute(env)
-            template = Template(pattern).safe_substitute(env)
+        template = render_template(compile_template(pattern), env)
+        for i in range(1, number_of_iterations):
+            if Template.delimiter not in template or template == pattern:
+                # nothing left to substitute, the next iterations would
+                # return the same string
+                break
             pattern = template
+            # the intermediate results are not cached, since they depend
+            # on the env values
+            template = render_template(_compile(pattern), env)
 
         return template
     except KeyError as err:
@@ -247,11 +713,9 @@ def get_template_cache_stats():
         config_source = (f"machines_user.yml "
                          f"(enable_template_cache={cache_val})")
 
-    # Calculate cache hit ratio
+    cache_stats = _processed_template_cache.stats()
     if _get_cache_setting():
-        ratio = (len(_processed_template_cache) /
-                 max(1, len(_template_cache))) * 100
-        hit_ratio = f"{ratio:.1f}%"
+        hit_ratio = f"{cache_stats['hit_ratio'] * 100:.1f}%"
     else:
         hit_ratio = "N/A (caching disabled)"
 
@@ -259,25 +723,93 @@ def get_template_cache_stats():
         "caching_enabled": _get_cache_setting(),
         "config_source": config_source,
         "max_cache_size": MAX_PROCESSED_CACHE_SIZE,
+        "max_cache_chars": MAX_PROCESSED_CACHE_CHARS,
         "raw_templates_cached": len(_template_cache),
         "processed_templates_cached": len(_processed_template_cache),
         "template_vars_analyzed": len(_template_vars_cache),
         "raw_templates": list(_template_cache.keys()),
         "memory_usage_estimate": (
-            sum(len(t) for t in _template_cache.values()) +
-            sum(len(pt) for pt in _processed_template_cache.values())
+            sum(len(t) for t in _template_cache.values())
+            + _processed_template_cache.size
         ),
+        "shared_cache": _processed_template_cache.shared is not None,
+        "cache_hits": cache_stats["hits"],
+        "cache_shared_hits": cache_stats["shared_hits"],
+        "cache_misses": cache_stats["misses"],
+        "cache_evictions": cache_stats["evictions"],
         "cache_hit_ratio": hit_ratio,
+        "disk_cache": (
+            _template_disk_cache.stats()
+            if _template_disk_cache is not None
+            else None
+        ),
     }
 
 
+def use_shared_template_cache() -> bool:
+    """
+    Return `True` if the processed templates should be shared by the
+    job_preparation pool workers (`template_cache_shared`).
+    """
+    return _get_cache_setting() and str(
+        env.get("template_cache_shared", False)
+    ).lower() in ("true", "1", "yes", "on")
+
+
+def start_shared_template_cache() -> None:
+    """
+    Start a `multiprocessing.Manager` process holding the processed
+    templates shared by all processes, keyed by the template name and the
+    values of its variables.
+
+    !!! note
+        This function should be called before forking the pool workers.
+    """
+    global _shared_template_manager
+    stop_shared_template_cache()
+    _shared_template_manager = multiprocessing.Manager()
+    _processed_template_cache.shared = _shared_template_manager.dict()
+
+
+def stop_shared_template_cache() -> None:
+    """
+    Stop the shared cache of the processed templates, if started.
+    """
+    global _shared_template_manager
+    _processed_template_cache.shared = None
+    if _shared_template_manager is not None:
+        _shared_template_manager.shutdown()
+        _shared_template_manager = None
+
+
+def warm_template_cache(template_names) -> None:
+    """
+    Load the templates, and analyse and compile them, e.g., by the main
+    process before forking the pool workers, which inherit the warmed
+    caches. The templates are not processed: the values of their variables
+    (e.g., `label`, `job_results`) are only set by the job preparation of
+    each worker. The templates which are not found are skipped, the error
+    is reported when they are used.
+    """
+    if not _get_cache_setting():
+        return
+    for template_name in template_names:
+        if find_template(template_name) is None:
+            continue
+        script_template_variables(
+            template_name, script_template_source(template_name)
+        )
+
+
 def clear_template_cache():
     """
-    Clear the template cache completely.
+    Clear the template cache completely, including its hit/miss counters.
     Useful for testing or if memory usage becomes a concern.
     """
     _template_cache.clear()
+    _template_hash_cache.clear()
     _processed_template_cache.clear()
+    _processed_template_cache.reset_stats()
     _template_vars_cache.clear()
 
     return {"status": "Template cache cleared"}
@@ -290,18 +822,11 @@ def _load_and_process_template_uncached(template_name: str) -> str:
     Used when ENABLE_TEMPLATE_CACHE is disabled for benchmarking.
     """
     # Find and read template file fresh every time
-    found = False
-    raw_template = ""
-
-    for p in env.local_templates_path:
-        template_file_path = os.path.join(p, template_name)
-        if os.path.exists(template_file_path):
-            with open(template_file_path) as source:
-                raw_template = source.read()
-            found = True
-            break
-
-    if not found:
+    template_file_path = find_template(template_name)
+    if template_file_path is not None:
+        with open(template_file_path) as source:
+            raw_template = source.read()
+    else:
         raise UnboundLocalError(
             "FabSim Error: could not find template file {} . \
             FabSim looked for it in the following directories: {}".format(
@@ -1,7 +1,13 @@
 import os
+import stat
 import pytest
 import subprocess
 
+from fabsim.base import fab
+from fabsim.base.env import env
+from fabsim.deploy import templates
+from fabsim.deploy.machines import load_machine
+
 @pytest.fixture
 def execute_cmd(request):
     raw_cmd = request.param.strip()
@@ -38,3 +44,79 @@ def execute_cmd(request):
 
     yield output
     proc.terminate()
+
+
+# Stand-in for ssh to a local sshd: the remote command is executed locally
+LOCAL_SSH = """#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -p|-o) shift 2 ;;
+        -*) shift ;;
+        *) shift; exec sh -c "$*" ;;
+    esac
+done
+"""
+
+
+@pytest.fixture
+def local_ssh(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    ssh = bin_dir / "ssh"
+    ssh.write_text(LOCAL_SSH)
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", "{}:{}".format(bin_dir, os.environ["PATH"]))
+    for key, value in (
+        ("host_string", "user@remote.host"),
+        ("port", 22),
+        ("manual_sshpass", False),
+        ("manual_gsissh", False),
+        ("ssh_monsoon_mode", False),
+        ("ssh_control_master", False),
+        ("acceptable_err_subprocesse_ret_codes", [0]),
+        ("transfer_mode", "tarstream"),
+    ):
+        monkeypatch.setitem(env, key, value)
+
+
+@pytest.fixture
+def machine_env(tmp_path):
+    """
+    The env of the localhost machine, with a job script template and a
+    config of two sweep items, restored after the test.
+    """
+    saved_env = dict(env)
+    (tmp_path / "templates").mkdir()
+    (tmp_path / "templates" / "job").write_text(
+        "cd $job_results\n$run_prefix\n"
+        'echo "label=$label replica=$replica_number"\n'
+    )
+    for label in ("a", "b"):
+        (tmp_path / "config_files" / "cfg" / "SWEEP" / label).mkdir(
+            parents=True
+        )
+
+    env.host = "localhost"
+    env.task = "job"
+    load_machine("localhost")
+    # new lists, the ones of the saved env are not modified
+    env.local_templates_path = [
+        str(tmp_path / "templates"), *env.local_templates_path
+    ]
+    env.local_config_file_path = [
+        str(tmp_path / "config_files"), *env.local_config_file_path
+    ]
+    env.update(
+        script="job",
+        batch_header="no_batch",
+        run_prefix_commands=["echo $replica_number $job_results"],
+    )
+    fab.with_config("cfg")
+    fab.calc_nodes()
+    fab.calc_total_mem()
+    env.ensemble_mode = True
+    yield tmp_path
+
+    templates.clear_template_cache()
+    env.clear()
+    env.update(saved_env)
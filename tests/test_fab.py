@@ -0,0 +1,768 @@
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from fabsim.base import MultiProcessingPool, fab
+from fabsim.base.env import env
+from fabsim.deploy import templates
+
+
+@pytest.fixture
+def staging(tmp_path, monkeypatch):
+    """
+    A job with two labels of two replicas each, prepared in a persistent
+    staging folder, without any remote machine.
+    """
+    templates_dir = tmp_path / "templates"
+    templates_dir.mkdir()
+    (templates_dir / "header").write_text("#!/bin/bash\n")
+    (templates_dir / "script").write_text("echo $label\n")
+    sweep_dir = tmp_path / "SWEEP"
+    for label in ("a", "b"):
+        (sweep_dir / label).mkdir(parents=True)
+        (sweep_dir / label / "input.txt").write_text(label)
+
+    for key, value in (
+        ("local_templates_path", [str(templates_dir)]),
+        ("batch_header", "header"),
+        ("script", "script"),
+        ("sweep_dir", str(sweep_dir)),
+        ("label", ""),
+        ("prevent_results_overwrite", "delete"),
+        ("work_path", "/remote/FabSim3"),
+        ("scripts_path", "/remote/FabSim3/scripts"),
+        ("results_path", "/remote/FabSim3/results"),
+    ):
+        monkeypatch.setitem(env, key, value)
+    monkeypatch.setattr(templates, "_template_cache", {})
+    monkeypatch.setattr(fab, "_staging_manifest", None)
+    monkeypatch.setattr(fab, "_staged_runs", {})
+    fab.set_tmp_work_path(str(tmp_path / "staging" / "FabSim3"))
+
+    cleaned = []
+    monkeypatch.setattr(
+        fab,
+        "clean_remote_results_dirs",
+        lambda items, empty_folder: cleaned.append(sorted(items)),
+    )
+    monkeypatch.setattr(fab, "transmit_job_trees", lambda: None)
+    return sweep_dir, cleaned
+
+
+def prepare_staged_job(submitted=False):
+    """
+    Run the preparation and transmission of the job as `job()` does, and
+    return the generated runs.
+    """
+    # the job input hash is computed before the label of each sweep item
+    env.label = ""
+    fab.load_staging_manifest()
+    generated = []
+    for label in ("a", "b"):
+        env.label = label
+        for i in (1, 2):
+            run_key = fab.staging_run_key(i, 2)
+            files = fab.staged_run_files(run_key)
+            reused = files is not None
+            if not reused:
+                run_dir = os.path.join(
+                    env.tmp_results_path, "{}_{}".format(label, i)
+                )
+                os.makedirs(run_dir, exist_ok=True)
+                files = [os.path.join(run_dir, "env.yml")]
+                with open(files[0], "w") as env_yml:
+                    env_yml.write(label)
+                generated.append(run_key)
+            fab.stage_job_files(run_key, files, reused)
+    fab.flush_staged_runs()
+    fab.save_staging_manifest(transmitted=False)
+    fab.job_transmission()
+    fab.save_staging_manifest(transmitted=True, submitted=submitted)
+    return generated
+
+
+def test_staging_run_key(staging, monkeypatch):
+    sweep_dir, _ = staging
+    fab.load_staging_manifest()
+    env.label = "a"
+    first_hash = fab.sweep_dir_hash("a")
+    first_run = fab._staged_runs[fab.staging_run_key(1, 2)]["hash"]
+
+    # the same inputs in another invocation
+    fab._staged_runs.clear()
+    env.label = ""
+    fab.load_staging_manifest()
+    env.label = "a"
+    assert fab.sweep_dir_hash("a") == first_hash
+    assert fab._staged_runs[fab.staging_run_key(1, 2)]["hash"] == first_run
+    assert fab.sweep_dir_hash("b") != first_hash
+    assert fab.sweep_dir_hash("missing") == ""
+
+    # the SWEEP folder, the job env and the number of replicas are inputs
+    (sweep_dir / "a" / "input.txt").write_text("changed")
+    assert fab.sweep_dir_hash("a") != first_hash
+    assert fab._staged_runs[fab.staging_run_key(1, 2)]["hash"] != first_run
+    (sweep_dir / "a" / "input.txt").write_text("a")
+    assert fab._staged_runs[fab.staging_run_key(1, 2)]["hash"] == first_run
+    assert fab._staged_runs[fab.staging_run_key(1, 3)]["hash"] != first_run
+    monkeypatch.setitem(env, "cores", 128)
+    env.label = ""
+    fab.load_staging_manifest()
+    env.label = "a"
+    assert fab._staged_runs[fab.staging_run_key(1, 2)]["hash"] != first_run
+
+
+def test_incremental_preparation(staging):
+    sweep_dir, cleaned = staging
+    all_runs = ["a/1", "a/2", "b/1", "b/2"]
+    all_dirs = ["a_1", "a_2", "b_1", "b_2"]
+    assert prepare_staged_job() == all_runs
+    assert cleaned.pop() == all_dirs
+
+    # the resumed runs are skipped, and their results are not cleaned
+    assert prepare_staged_job() == []
+    assert cleaned.pop() == []
+
+    # a changed input is staged again, and its results are cleaned
+    (sweep_dir / "b" / "input.txt").write_text("changed")
+    assert prepare_staged_job(submitted=True) == ["b/1", "b/2"]
+    assert cleaned.pop() == ["b_1", "b_2"]
+
+    # once submitted, all results directories are cleaned, even if the
+    # runs are reused
+    assert prepare_staged_job() == []
+    assert cleaned.pop() == all_dirs
+    assert prepare_staged_job() == []
+    assert cleaned.pop() == []
+
+
+@pytest.mark.parametrize("ensemble_mode", [True, False])
+def test_compact_env_yml_fetch(
+    local_ssh, tmp_path, monkeypatch, ensemble_mode
+):
+    for key, value in (
+        ("ensemble_mode", ensemble_mode),
+        ("compact_env_yml", True),
+        ("job_name_template", "job_$machine_name"),
+        ("machine_name", "remote"),
+        ("results_path", str(tmp_path / "remote" / "results")),
+        ("local_results", str(tmp_path / "local" / "results")),
+        ("all_job_results", []),
+        ("all_job_results_local", []),
+        ("name", ""),
+        ("job_results", ""),
+        ("replica_number", 1),
+    ):
+        monkeypatch.setitem(env, key, value)
+    monkeypatch.setattr(fab, "_env_base", None)
+    fab.set_tmp_work_path(str(tmp_path / "tmp" / "FabSim3"))
+    legacy_dir = tmp_path / "legacy"
+
+    if fab.use_compact_env_yml():
+        fab.write_env_base_yml()
+    runs = []
+    for label in ("a", "b"):
+        for i in (1, 2):
+            env.replica_number = i
+            job_results, job_results_local = fab.with_template_job(
+                ensemble_mode=ensemble_mode, label=label
+            )
+            env.job_results = job_results + fab.replica_suffix(i, 2)
+            tmp_job_results = env.job_results.replace(
+                env.results_path, env.tmp_results_path
+            )
+            os.makedirs(tmp_job_results)
+            fab.write_env_yml(tmp_job_results)
+
+            # the same run, written without compact_env_yml
+            legacy_results = str(
+                legacy_dir / os.path.basename(tmp_job_results)
+            )
+            os.makedirs(legacy_results)
+            with monkeypatch.context() as legacy:
+                legacy.setattr(fab, "_env_base", None)
+                fab.write_env_yml(legacy_results)
+            # an ensemble is fetched as a whole, the other jobs per run
+            if ensemble_mode:
+                name = env.name
+            else:
+                name = os.path.basename(env.job_results)
+            runs.append(
+                (
+                    name,
+                    job_results_local + fab.replica_suffix(i, 2),
+                    legacy_results,
+                )
+            )
+    env_yml = "env_delta.yml" if ensemble_mode else "env.yml"
+    assert os.path.isfile(os.path.join(tmp_job_results, env_yml))
+
+    # job transmission
+    shutil.copytree(env.tmp_results_path, env.results_path)
+
+    for name, job_results_local, legacy_results in runs:
+        # fetch the results directory of this run only
+        fab.fetch_results(name=name)
+        assert fab.load_env_yml(job_results_local) == fab.load_env_yml(
+            legacy_results
+        )
+
+
+def read_job_files(tmp_work_path):
+    files = {}
+    for root, _, filenames in os.walk(tmp_work_path):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            with open(path) as job_file:
+                content = job_file.read().replace(tmp_work_path, "<tmp>")
+            files[os.path.relpath(path, tmp_work_path)] = "\n".join(
+                line
+                for line in content.splitlines()
+                if not line.startswith(
+                    ("batch_preparation:", "local_system_time:")
+                )
+            )
+    return files
+
+
+@pytest.mark.parametrize("ensemble_mode", [True, False])
+def test_batch_preparation(machine_env, ensemble_mode):
+    env.ensemble_mode = ensemble_mode
+    job_files = {}
+    job_scripts = {}
+    for batch_preparation in (True, False):
+        env.batch_preparation = batch_preparation
+        env.all_job_results = []
+        env.all_job_results_local = []
+        env.job_script_info = {}
+        fab.set_tmp_work_path(
+            str(machine_env / str(batch_preparation) / "FabSim3")
+        )
+        job_scripts[batch_preparation] = [
+            fab.job_preparation(
+                dict(label=label, replica_start_number=1, replicas=3)
+            )
+            for label in ("a", "b")
+        ]
+        job_files[batch_preparation] = read_job_files(env.tmp_work_path)
+
+    assert job_scripts[True] == job_scripts[False]
+    assert job_files[True] == job_files[False]
+
+    # 2 job scripts and env.yml per sweep item and replica
+    assert len(job_files[True]) == 2 * 3 * 3
+    for path, content in job_files[True].items():
+        assert fab._JOB_RESULTS_PLACEHOLDER not in content
+        assert fab._REPLICA_NUMBER_PLACEHOLDER not in content
+        if not path.endswith("env.yml"):
+            label, replica = re.search(
+                r"_(\w)_(?:replica_)?(\d)\.sh$", path
+            ).groups()
+            assert 'echo "label={} replica={}"'.format(
+                label, replica
+            ) in content
+            continue
+        run_env = fab.load_env_yml(
+            os.path.dirname(os.path.join(env.tmp_work_path, path))
+        )
+        assert run_env["run_prefix"].endswith(
+            "echo {} {}".format(
+                run_env["replica_number"], run_env["job_results"]
+            )
+        )
+        assert run_env["job_results"].startswith(
+            run_env["all_job_results"][-1]
+        )
+        assert len(run_env["job_script_info"]) > 0
+
+
+def test_job_profiling_reset(machine_env, monkeypatch):
+    monkeypatch.setattr(MultiProcessingPool, "cpu_count", lambda: 4)
+    env.update(profile=True, submit_job=False)
+
+    def submit_job_preparation_tasks(pool, args):
+        assert fab.profiling_enabled()
+        raise ValueError("preparation failed")
+
+    monkeypatch.setattr(
+        fab, "submit_job_preparation_tasks", submit_job_preparation_tasks
+    )
+    with pytest.raises(ValueError, match="preparation failed"):
+        fab.job(dict(label="a"))
+    # the next jobs are not profiled
+    assert not fab.profiling_enabled()
+    assert not os.path.exists(
+        os.path.join(os.path.dirname(env.tmp_work_path), "profile")
+    )
+
+
+def test_job_transmission_stream_errors(tmp_path, monkeypatch):
+    monkeypatch.setitem(env, "stream_chunk_size", 2)
+    monkeypatch.setitem(env, "tmp_work_path", str(tmp_path))
+    stream_queue = queue.Queue()
+    monkeypatch.setattr(fab, "_job_stream_queue", stream_queue)
+    monkeypatch.setattr(fab, "_job_stream_buffer", [])
+    for i in range(5):
+        fab.stream_job_files(
+            str(tmp_path / "results" / "run_{}".format(i) / "env.yml")
+        )
+    fab.flush_job_files_stream()
+    stream_queue.put(None)
+
+    transmitted = []
+
+    def transmit_job_files(files, cleaned_results_dirs, empty_folder):
+        transmitted.append(list(files))
+        if len(transmitted) == 2:
+            raise RuntimeError("rsync failed")
+
+    monkeypatch.setattr(fab, "transmit_job_files", transmit_job_files)
+    errors = []
+    fab.job_transmission_stream(stream_queue, errors)
+
+    assert transmitted == [
+        [os.path.join("results", "run_{}".format(i), "env.yml") for i in run]
+        for run in ((0, 1), (2, 3))
+    ]
+    # the first error is reported, the queue is still consumed, and nothing
+    # else is transferred
+    assert [str(e) for e in errors] == ["rsync failed"]
+    assert stream_queue.empty()
+
+
+def prepare_task(args):
+    if args["task"] == 1:
+        raise ValueError("task failed")
+    return [("script_{}".format(args["task"]), ("", str(args["task"])))]
+
+
+def test_pool_iter_task_results(monkeypatch):
+    monkeypatch.setattr(MultiProcessingPool, "cpu_count", lambda: 4)
+    pool = MultiProcessingPool.MultiProcessingPool(PoolSize=2)
+    for task in (0, 2, 3):
+        pool.add_task(prepare_task, func_args=dict(task=task))
+    assert list(pool.iter_task_results()) == [
+        ("script_{}".format(task), ("", str(task))) for task in (0, 2, 3)
+    ]
+
+    pool = MultiProcessingPool.MultiProcessingPool(PoolSize=2)
+    for task in (0, 1, 2):
+        pool.add_task(prepare_task, func_args=dict(task=task))
+    with pytest.raises(ValueError):
+        list(pool.iter_task_results())
+
+
+# The output of the job_dispatch commands, and the job ID parsed from it
+SUBMIT_OUTPUTS = [
+    ("Submitted batch job 123456", "123456"),
+    # sbatch with a login banner and a warning
+    (
+        "Welcome to the cluster, 2 nodes are down\n"
+        "sbatch: Warning: 42 GB is more than the default\n"
+        "Submitted batch job 123456",
+        "123456",
+    ),
+    ("Job <123456> is submitted to queue <normal>.", "123456"),
+    ('llsubmit: The job "login1.123" has been submitted.', "login1.123"),
+    # qsub of PBS Pro and Torque
+    ("123456.pbs-server", "123456.pbs-server"),
+    ("123456.login1.cluster.org", "123456.login1.cluster.org"),
+    ("123456[].pbs-server", "123456[].pbs-server"),
+    # qsub with a banner containing numbers
+    ("Last login: 2024\n42\n123456.pbs-server", "123456.pbs-server"),
+    (
+        'Your job 123456 ("job_1") has been submitted',
+        "123456",
+    ),
+    ('Your job-array 123456.1-4:1 ("job_1") has been submitted', "123456"),
+    # no job ID: the whole output is kept
+    ("2024\nqsub: submit error", "2024\nqsub: submit error"),
+]
+
+
+@pytest.mark.parametrize("job_output, job_id", SUBMIT_OUTPUTS)
+def test_parse_submit_output(job_output, job_id):
+    output = (
+        "FABSIM_SUBMIT_BEGIN /scripts/job_1.sh\n"
+        "{}\n"
+        "FABSIM_SUBMIT_END 0 /scripts/job_1.sh\n".format(job_output)
+    )
+    assert fab.parse_submit_output(output) == {
+        "/scripts/job_1.sh": (0, job_id)
+    }
+
+
+def test_parse_submit_output_jobs():
+    output = (
+        "Welcome to the cluster\n"
+        "FABSIM_SUBMIT_BEGIN /scripts/job_1.sh\r\n"
+        "Submitted batch job 1\r\n"
+        "FABSIM_SUBMIT_END 0 /scripts/job_1.sh\r\n"
+        "FABSIM_SUBMIT_BEGIN /scripts/job 2.sh\n"
+        "sbatch: error: invalid partition\n"
+        "FABSIM_SUBMIT_END 1 /scripts/job 2.sh\n"
+        "FABSIM_SUBMIT_BEGIN /scripts/job_3.sh\n"
+        "Submitted batch job 3\n"
+        "FABSIM_SUBMIT_END 0 /scripts/job_3.sh\n"
+        # the connection was lost during the last submission
+        "FABSIM_SUBMIT_BEGIN /scripts/job_4.sh\n"
+    )
+    assert fab.parse_submit_output(output) == {
+        "/scripts/job_1.sh": (0, "1"),
+        "/scripts/job 2.sh": (1, "sbatch: error: invalid partition"),
+        "/scripts/job_3.sh": (0, "3"),
+    }
+
+
+# The files selected by the rsync filters of fetch_results, i.e.,
+# --include='*/' --include=<pattern> ... --exclude='*'
+RSYNC_INCLUDES = [
+    (["out.csv"], ["./out.csv", "./RUNS/a/out.csv"]),
+    (["*.png"], ["./RUNS/a/plot.png", "./RUNS/b c/plot 2.png"]),
+    (["RUNS/*/out.csv"], ["./RUNS/a/out.csv"]),
+    (["a/out.csv", "*.dat"], ["./RUNS/a/out.csv", "./RUNS/a/big.dat"]),
+    (["out"], []),
+]
+RESULT_FILES = [
+    "out.csv",
+    "out.csv.bak",
+    "RUNS/a/out.csv",
+    "RUNS/a/big.dat",
+    "RUNS/a/plot.png",
+    "RUNS/b c/plot 2.png",
+    "RUNS/b c/env.yml",
+]
+
+
+@pytest.mark.parametrize("fetch_files, selected", RSYNC_INCLUDES)
+def test_fetch_file_selected(tmp_path, fetch_files, selected):
+    for path in RESULT_FILES:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+
+    assert sorted(
+        "./" + path
+        for path in RESULT_FILES
+        if fab.fetch_file_selected("./" + path, fetch_files)
+    ) == sorted(selected)
+
+    # the same files are selected by the remote find
+    output = subprocess.run(
+        "cd {} && find . -type f {}".format(
+            tmp_path, fab.remote_find_filters(fetch_files)
+        ),
+        shell=True,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert sorted(output.splitlines()) == sorted(selected)
+
+
+def test_remote_find_filters_unsafe():
+    # listed and filtered locally
+    assert fab.remote_find_filters(["out_$label.csv"]) == ""
+    assert fab.remote_find_filters(["it's.txt"]) == ""
+
+
+def test_parse_remote_file_sizes():
+    output = (
+        "Last login: Mon Oct 12 10:00:00 2026 from 10.0.0.1\r\n"
+        "Welcome to the login node: 2 jobs running\n"
+        "12\t./RUNS\n"
+        "4\t./env.yml\n"
+        "15:./RUNS/a/out.csv\r\n"
+        "0:./RUNS/b c/out: 2.csv\n"
+        ":./missing_size\n"
+    )
+    assert fab.parse_remote_file_sizes(output) == (
+        16 * 1024,
+        [(15, "./RUNS/a/out.csv"), (0, "./RUNS/b c/out: 2.csv")],
+    )
+
+
+def test_fetch_run_dirs(local_ssh, tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "stdout", sys.__stdout__)
+    remote = tmp_path / "remote"
+    files = {"env.yml": "job"}
+    for i in range(10):
+        files["RUNS/run_{}/out.csv".format(i)] = str(i)
+    for path, content in files.items():
+        (remote / path).parent.mkdir(parents=True, exist_ok=True)
+        (remote / path).write_text(content)
+    monkeypatch.setitem(env, "job_results", str(remote))
+    monkeypatch.setitem(env, "job_results_local", str(tmp_path / "local"))
+
+    run_dirs = ["RUNS/run_{}".format(i) for i in range(10)]
+    fetched = []
+    fab.fetch_run_dirs(run_dirs, "", [], "", 3, on_fetched=fetched.extend)
+    # the threads of fetch_run_dirs print through add_print_prefix
+    assert sys.stdout is sys.__stdout__
+    assert sorted(fetched) == run_dirs
+    assert {
+        str(path.relative_to(tmp_path / "local")): path.read_text()
+        for path in (tmp_path / "local").rglob("*")
+        if path.is_file()
+    } == files
+
+    # a failed transfer is reported after the other ones
+    fetched = []
+    with pytest.raises(RuntimeError, match="1 of 4 transfers failed"):
+        fab.fetch_run_dirs(
+            ["RUNS/run_0", "RUNS/missing", "RUNS/run_2"],
+            "",
+            [],
+            "",
+            3,
+            on_fetched=fetched.extend,
+        )
+    assert sorted(fetched) == ["RUNS/run_0", "RUNS/run_2"]
+    assert sys.stdout is sys.__stdout__
+
+
+# A BSD stat, e.g., of macOS, which has no -c option
+BSD_STAT = """#!/bin/bash
+[ "$1" = -f ] || exit 1
+format=${2//%z/%s}
+format=${format//%m/%Y}
+format=${format//%N/%n}
+shift 2
+exec /usr/bin/stat -c "$format" "$@"
+"""
+
+
+@pytest.fixture
+def remote_results(tmp_path, monkeypatch):
+    """
+    Run the remote commands of the incremental fetch locally, on the
+    results in `tmp_path/remote`.
+    """
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    monkeypatch.setitem(env, "job_results", str(remote))
+    monkeypatch.setitem(env, "job_results_local", str(tmp_path / "local"))
+    os.makedirs(env.job_results_local)
+    monkeypatch.setitem(env, "fetch_completed_marker", "DONE")
+
+    def run(command, capture=False, **kwargs):
+        return subprocess.run(
+            ["bash", "-c", command],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+    monkeypatch.setattr(fab, "run", run)
+    return remote
+
+
+def write_results(remote, files):
+    for path, content in files.items():
+        (remote / path).parent.mkdir(parents=True, exist_ok=True)
+        (remote / path).write_text(content)
+
+
+@pytest.mark.parametrize("report_saved", [False, True])
+def test_fetch_results_selective(
+    remote_results, monkeypatch, capsys, report_saved
+):
+    write_results(
+        remote_results,
+        {"RUNS/a/out.csv": "1", "RUNS/a/big.dat": "0" * 10000},
+    )
+    monkeypatch.setitem(env, "fetch_report_saved", report_saved)
+    commands = []
+    run = fab.run
+
+    def recording_run(command, **kwargs):
+        commands.append(command)
+        return run(command, **kwargs)
+
+    def local(command, **kwargs):
+        commands.append(command)
+        return ("", "")
+
+    monkeypatch.setattr(fab, "run", recording_run)
+    monkeypatch.setattr(fab, "local", local)
+    fab.fetch_results_selective("", ["out.csv"])
+
+    find_cmd, rsync_cmd = commands
+    # the remote results are only traversed again by du if requested
+    assert ("du -sk" in find_cmd) == report_saved
+    assert rsync_cmd.startswith("rsync ")
+    out = capsys.readouterr().out
+    assert "selected 1 files: 0.00 MB" in out
+    assert ("saved compared with a full fetch" in out) == report_saved
+
+
+@pytest.mark.parametrize("bsd_stat", [False, True])
+def test_list_remote_run_states(
+    remote_results, tmp_path, monkeypatch, bsd_stat
+):
+    if bsd_stat:
+        (tmp_path / "bin").mkdir()
+        (tmp_path / "bin" / "stat").write_text(BSD_STAT)
+        (tmp_path / "bin" / "stat").chmod(0o755)
+        monkeypatch.setenv(
+            "PATH", "{}:{}".format(tmp_path / "bin", os.environ["PATH"])
+        )
+    write_results(
+        remote_results,
+        {
+            "job/env.yml": "job",
+            "job/RUNS/a/out.csv": "123",
+            "job/RUNS/a/DONE": "",
+            "job/RUNS/b c/out.csv": "1",
+            "job/RUNS/b c/sub/out.csv": "12",
+        },
+    )
+    states = fab.list_remote_run_states("job")
+    mtime = max(state[2] for state in states.values())
+    assert mtime == int(os.path.getmtime(remote_results / "job/RUNS/a/DONE"))
+    assert states == {
+        "job/RUNS/a": [2, 3, mtime, True],
+        "job/RUNS/b c": [2, 3, mtime, False],
+    }
+    assert set(fab.list_remote_run_states("")) == {
+        "./job/RUNS/a", "./job/RUNS/b c"
+    }
+
+
+def test_fetch_results_incremental(remote_results, monkeypatch):
+    fetches = []
+
+    def fetch_run_dirs(
+        run_dirs, regex, fetch_files, includes_files, workers, on_fetched
+    ):
+        fetches.append(run_dirs)
+        on_fetched(run_dirs)
+
+    monkeypatch.setattr(fab, "fetch_run_dirs", fetch_run_dirs)
+
+    def fetch(fetch_files=[]):
+        fab.fetch_results_incremental("job", fetch_files, "", 1)
+        return fetches[-1]
+
+    write_results(
+        remote_results,
+        {
+            "job/RUNS/a/out.csv": "1",
+            "job/RUNS/a/DONE": "",
+            "job/RUNS/b/out.csv": "1",
+        },
+    )
+    # b is still running
+    assert fetch() == ["job/RUNS/a"]
+    assert fetch() == []
+
+    # a is changed, b is completed
+    write_results(
+        remote_results, {"job/RUNS/a/out.csv": "12", "job/RUNS/b/DONE": ""}
+    )
+    assert fetch() == ["job/RUNS/a", "job/RUNS/b"]
+    # a new file
+    write_results(remote_results, {"job/RUNS/b/log.txt": ""})
+    assert fetch() == ["job/RUNS/b"]
+    assert fetch() == []
+
+    # the previous fetches were of another file selection
+    assert fetch(["out.csv"]) == ["job/RUNS/a", "job/RUNS/b"]
+    assert fetch(["out.csv"]) == []
+
+    # without marker, the running directories are also fetched
+    write_results(remote_results, {"job/RUNS/c/out.csv": "1"})
+    env.fetch_completed_marker = None
+    assert fetch(["out.csv"]) == ["job/RUNS/c"]
+
+
+def local_rsync_project(local_dir, remote_dir, include=[], exclude=[], **_):
+    """
+    Run the rsync of `rsync_project` between two local folders.
+    """
+    subprocess.run(
+        ["rsync", "-a"]
+        + ["--include={}".format(item) for item in include]
+        + ["--exclude={}".format(item) for item in exclude]
+        + [local_dir, remote_dir + "/"],
+        check=True,
+    )
+
+
+@pytest.mark.parametrize("transfer_mode", ["rsync", "tarstream"])
+def test_transmit_job_trees(local_ssh, tmp_path, monkeypatch, transfer_mode):
+    if transfer_mode == "rsync":
+        if shutil.which("rsync") is None:
+            pytest.skip("rsync is not installed")
+        monkeypatch.setattr(fab, "rsync_project", local_rsync_project)
+    monkeypatch.setitem(env, "transfer_mode", transfer_mode)
+    monkeypatch.setitem(env, "work_path", str(tmp_path / "remote"))
+    monkeypatch.setitem(env, "scripts_path", str(tmp_path / "remote/scripts"))
+    monkeypatch.setitem(env, "results_path", str(tmp_path / "remote/results"))
+    fab.set_tmp_work_path(str(tmp_path / "local"))
+    assert fab.use_single_pass_transmission()
+
+    files = {
+        "scripts/job.sh": "job",
+        "results/job/env.yml": "job",
+        "results/job/RUNS/a b/input.txt": "a b",
+        # not part of the transferred trees
+        "env_base.yml": "base",
+        "config_files/input.txt": "input",
+        "scripts.txt": "",
+        "other/results/input.txt": "input",
+    }
+    for path, content in files.items():
+        (tmp_path / "local" / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / "local" / path).write_text(content)
+    (tmp_path / "remote").mkdir()
+    fab.transmit_job_trees()
+    assert {
+        str(path.relative_to(tmp_path / "remote")): path.read_text()
+        for path in (tmp_path / "remote").rglob("*")
+        if path.is_file()
+    } == {
+        path: content
+        for path, content in files.items()
+        if path.startswith(("scripts/", "results/"))
+    }
+
+
+@pytest.mark.parametrize("ssh_monsoon_mode", [False, True])
+def test_clean_remote_results_dirs_script(
+    tmp_path, monkeypatch, ssh_monsoon_mode
+):
+    if not ssh_monsoon_mode and shutil.which("rsync") is None:
+        pytest.skip("rsync is not installed")
+    monkeypatch.setitem(env, "ssh_monsoon_mode", ssh_monsoon_mode)
+    results = tmp_path / "results"
+    files = [
+        "run a/out.csv",
+        "run a/RUNS/b c/out.csv",
+        "run_$label/out.csv",
+        "other run/out.csv",
+    ]
+    for path in files:
+        (results / path).parent.mkdir(parents=True, exist_ok=True)
+        (results / path).write_text(path)
+
+    script = fab.clean_remote_results_dirs_script(
+        ["run a", "run_$label", "new run 'b'"],
+        str(tmp_path / "empty folder"),
+        results_path=str(results),
+    )
+    subprocess.run(["bash", "-c", script], check=True)
+    assert sorted(
+        str(path.relative_to(results)) for path in results.rglob("*")
+    ) == [
+        "new run 'b'",
+        "other run",
+        "other run/out.csv",
+        "run a",
+        "run_$label",
+    ]
+    assert not (tmp_path / "empty folder").exists()
@@ -0,0 +1,68 @@
+from fabsim.base.env import env
+from fabsim.deploy import machines
+
+
+def test_derived_env(monkeypatch):
+    monkeypatch.setattr(machines, "_derived_env", {})
+    monkeypatch.setitem(env, "path_template", "$root/$name")
+    monkeypatch.setitem(env, "root", "/work")
+    monkeypatch.setitem(env, "name", "job")
+    calls = []
+
+    def compute(inputs):
+        calls.append(1)
+        return machines.tracked_template(env.path_template, inputs)
+
+    def path():
+        return machines.derived_env("path", compute, "path_template")
+
+    for _ in range(3):
+        assert path() == "/work/job"
+    assert len(calls) == 1
+
+    # a variable of the template
+    env.name = "job_2"
+    assert path() == "/work/job_2"
+    # same value, but not the same type
+    env.name = 1
+    assert path() == "/work/1"
+    env.name = True
+    assert path() == "/work/True"
+    # the template itself
+    env.path_template = "$root"
+    assert path() == "/work"
+    assert len(calls) == 5
+
+
+def test_derived_env_in_place(monkeypatch):
+    monkeypatch.setattr(machines, "_derived_env", {})
+    monkeypatch.setitem(env, "paths", ["$root/a", "b"])
+    monkeypatch.setitem(env, "root", "/work")
+    calls = []
+
+    def compute(inputs):
+        calls.append(1)
+        return [machines.tracked_template(path, inputs) for path in env.paths]
+
+    for _ in range(3):
+        env.paths[:] = machines.derived_env("paths", compute, "paths")
+    assert env.paths == ["/work/a", "b"]
+    # computed again once, with the rendered paths as input
+    assert len(calls) == 2
+
+    env.paths.append("$root/c")
+    env.paths[:] = machines.derived_env("paths", compute, "paths")
+    assert env.paths == ["/work/a", "b", "/work/c"]
+    assert len(calls) == 3
+
+
+def test_load_machine_clears_derived_env(monkeypatch):
+    monkeypatch.setattr(machines, "_derived_env", {"stale": ([], "/stale")})
+    saved_env = dict(env)
+    try:
+        machines.load_machine("localhost")
+        assert "stale" not in machines._derived_env
+        assert machines._derived_env["work_path"][1] == env.work_path
+    finally:
+        env.clear()
+        env.update(saved_env)
@@ -0,0 +1,446 @@
+import multiprocessing
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+from fabsim.base import networks
+from fabsim.base.env import env
+from fabsim.base.utils import add_print_prefix
+
+# Stand-in for the OpenSSH client and sshd: it logs each command, and
+# emulates a ControlMaster socket, i.e., the first command opens the master
+# connection (a "handshake"), the next ones reuse the socket ("mux").
+FAKE_SSH = """#!{python}
+import os
+import sys
+
+args = sys.argv[1:]
+opts = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == "-o"]
+control_path = [
+    opt.split("=", 1)[1] for opt in opts if opt.startswith("ControlPath=")
+]
+control_path = control_path[0].replace("%C", "host") if control_path else ""
+with open(os.environ["FAKE_SSH_LOG"], "a") as log:
+    if "-O" in args and args[args.index("-O") + 1] == "exit":
+        os.remove(control_path)
+        log.write("exit\\n")
+    elif control_path and os.path.exists(control_path):
+        log.write("mux\\n")
+    else:
+        if control_path and "ControlMaster=auto" in opts:
+            open(control_path, "w").close()
+        log.write("handshake\\n")
+"""
+
+
+@pytest.fixture
+def fake_ssh(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    ssh = bin_dir / "ssh"
+    ssh.write_text(FAKE_SSH.format(python=sys.executable))
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    log = tmp_path / "ssh.log"
+    log.touch()
+
+    monkeypatch.setenv("PATH", "{}:{}".format(bin_dir, os.environ["PATH"]))
+    monkeypatch.setenv("FAKE_SSH_LOG", str(log))
+    for key, value in (
+        ("username", "user"),
+        ("remote", "remote.host"),
+        ("port", 22),
+        ("command_prefixes", []),
+        ("cwd", ""),
+        ("ssh_control_dir", str(tmp_path / "control")),
+    ):
+        monkeypatch.setitem(env, key, value)
+    monkeypatch.setattr(networks, "_ssh_control_dir", None)
+    monkeypatch.setattr(networks, "_ssh_control_pid", None)
+    return log
+
+
+def test_manual_ssh_control_master(fake_ssh, monkeypatch):
+    monkeypatch.setitem(env, "ssh_control_master", True)
+    for _ in range(3):
+        networks.manual("true", capture=True)
+    assert fake_ssh.read_text().split() == ["handshake", "mux", "mux"]
+
+
+def test_manual_ssh_control_master_disabled(fake_ssh, monkeypatch):
+    monkeypatch.setitem(env, "ssh_control_master", False)
+    assert networks.ssh_control_opts() == ""
+    for _ in range(2):
+        networks.manual("true", capture=True)
+    assert fake_ssh.read_text().split() == ["handshake", "handshake"]
+
+
+def test_close_ssh_control_masters(fake_ssh, monkeypatch):
+    monkeypatch.setitem(env, "ssh_control_master", True)
+    networks.manual("true", capture=True)
+    control_dir = env.ssh_control_dir
+    assert len(os.listdir(control_dir)) == 1
+
+    networks.close_ssh_control_masters()
+    assert os.listdir(control_dir) == []
+    assert fake_ssh.read_text().split() == ["handshake", "exit"]
+    assert networks._ssh_control_dir is None
+
+
+def test_ssh_control_master_default(fake_ssh, monkeypatch):
+    monkeypatch.delitem(env, "ssh_control_master", raising=False)
+    assert networks.ssh_control_opts() == ""
+
+
+def test_ssh_control_dir(fake_ssh, tmp_path, monkeypatch):
+    monkeypatch.setitem(env, "ssh_control_master", True)
+    monkeypatch.setitem(env, "ssh_control_dir", None)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    (tmp_path / "tmp").mkdir()
+    # created before forking the workers, which open the master connection
+    control_dir = networks.ssh_control_dir()
+    assert os.path.dirname(control_dir) == str(tmp_path / "tmp")
+    process = multiprocessing.get_context("fork").Process(
+        target=networks.manual, args=("true",), kwargs=dict(capture=True)
+    )
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert len(os.listdir(control_dir)) == 1
+
+    networks.close_ssh_control_masters()
+    assert not os.path.exists(control_dir)
+    assert fake_ssh.read_text().split() == ["handshake", "exit"]
+
+
+class FakeConnection:
+    """
+    Stand-in for fabric's Connection, with a transport that can be broken.
+    """
+
+    def __init__(self, host, user, port, **kwargs):
+        self.is_connected = False
+        self.transport = None
+
+    def open(self):
+        self.is_connected = True
+        self.transport = self
+        self.active = True
+
+    def close(self):
+        self.is_connected = False
+
+    def send_ignore(self):
+        pass
+
+    def is_active(self):
+        return self.active
+
+
+@pytest.fixture
+def connection_pool(monkeypatch):
+    monkeypatch.setattr(networks, "Connection", FakeConnection)
+    return networks.ConnectionPool(idle_timeout=300)
+
+
+def test_connection_pool_reuse(connection_pool):
+    key = ("user", "remote.host", 22)
+    conn = connection_pool.get(*key)
+    connection_pool.release(*key, conn)
+    assert connection_pool.get(*key) is conn
+    connection_pool.release(*key, conn)
+    # another machine
+    other = connection_pool.get("user", "other.host", 22)
+    assert other is not conn
+    connection_pool.release("user", "other.host", 22, other)
+    assert connection_pool.stats() == {
+        "open_connections": 2,
+        "handshakes": 2,
+        "handshakes_saved": 1,
+    }
+
+    # a broken connection is replaced
+    conn.active = False
+    new_conn = connection_pool.get(*key)
+    assert new_conn is not conn
+    assert not conn.is_connected
+
+    connection_pool.release(*key, new_conn)
+    connection_pool.close_all()
+    assert not new_conn.is_connected and not other.is_connected
+    assert connection_pool.stats()["open_connections"] == 0
+
+
+def test_connection_pool_expiry(connection_pool, monkeypatch):
+    key = ("user", "remote.host", 22)
+    conn = connection_pool.get(*key)
+    connection_pool.release(*key, conn)
+
+    now = time.time()
+    monkeypatch.setattr(networks.time, "time", lambda: now + 301)
+    new_conn = connection_pool.get(*key)
+    assert new_conn is not conn
+    assert not conn.is_connected
+    assert connection_pool.stats()["handshakes"] == 2
+
+
+def test_connection_pool_leasing(connection_pool):
+    key = ("user", "remote.host", 22)
+    # a leased connection is never given to another caller
+    first = connection_pool.get(*key)
+    second = connection_pool.get(*key)
+    assert first is not second
+    connection_pool.release(*key, first)
+    connection_pool.release(*key, second)
+    assert connection_pool.stats()["open_connections"] == 2
+
+    # both idle connections are reused
+    leased = {connection_pool.get(*key), connection_pool.get(*key)}
+    assert leased == {first, second}
+    # a discarded connection is closed, and not returned to the pool
+    connection_pool.discard(first)
+    assert not first.is_connected
+    connection_pool.release(*key, second)
+    assert connection_pool.get(*key) is second
+    assert connection_pool.stats() == {
+        "open_connections": 1,
+        "handshakes": 2,
+        "handshakes_saved": 3,
+    }
+
+
+def test_gather_remote_concurrency(monkeypatch):
+    monkeypatch.setitem(env, "remote_concurrency", 2)
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def remote_operation(i):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return i
+
+    results = networks.gather(
+        *[networks.call_async(remote_operation, i) for i in range(6)]
+    )
+    assert results == list(range(6))
+    assert running[1] == 2
+
+
+def test_local_async(monkeypatch):
+    monkeypatch.setitem(env, "acceptable_err_subprocesse_ret_codes", [0])
+    results = networks.gather(
+        networks.local_async("echo 1", capture=True),
+        networks.local_async("echo 2 >&2", capture=True),
+    )
+    assert results == [("1", ""), ("", "2")]
+
+    with pytest.raises(RuntimeError):
+        networks.gather(networks.local_async("exit 3", capture=True))
+
+
+def make_tree(root, nb_files=20):
+    files = {}
+    for i in range(nb_files):
+        path = "run_{}/{}".format(i % 3, "out_{}.txt".format(i))
+        files[path] = "content {}\n".format(i)
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(files[path])
+    return files
+
+
+def read_tree(root):
+    return {
+        str(path.relative_to(root)): path.read_text()
+        for path in root.rglob("*")
+        if path.is_file()
+    }
+
+
+@pytest.mark.parametrize("compression", ["gzip", "none"])
+def test_tarstream_rsync_project(
+    local_ssh, tmp_path, monkeypatch, compression
+):
+    monkeypatch.setitem(env, "tarstream_compression", compression)
+    files = make_tree(tmp_path / "local")
+    networks.rsync_project(
+        local_dir=str(tmp_path / "local"), remote_dir=str(tmp_path / "remote")
+    )
+    assert read_tree(tmp_path / "remote") == files
+
+
+def test_tarstream_rsync_project_options(
+    local_ssh, tmp_path, monkeypatch, capsys
+):
+    commands = []
+
+    def local(command, **kwargs):
+        commands.append(command)
+        return ("", "")
+
+    monkeypatch.setattr(networks, "local", local)
+    networks.rsync_project(
+        local_dir=str(tmp_path / "local"),
+        remote_dir=str(tmp_path / "remote"),
+        ssh_opts="-i key",
+    )
+    networks.rsync_project(
+        local_dir=str(tmp_path / "local"),
+        remote_dir=str(tmp_path / "remote"),
+        quiet=True,
+    )
+    networks.rsync_project(
+        local_dir=str(tmp_path / "local"),
+        remote_dir=str(tmp_path / "remote"),
+        default_opts="-pthrz --checksum",
+    )
+    tar_cmd, quiet_cmd, rsync_cmd = commands
+    assert " -cvf - " in tar_cmd[-1] and " -i key user@" in tar_cmd[-1]
+    assert " -cf - " in quiet_cmd[-1]
+    assert rsync_cmd.startswith("rsync ") and "--checksum" in rsync_cmd
+    # the tar commands are only printed by local
+    assert "tarstream_put" not in capsys.readouterr().out
+
+
+def test_tarstream_put_dir(local_ssh, tmp_path):
+    files = make_tree(tmp_path / "local" / "config")
+    networks.put(str(tmp_path / "local" / "config"), str(tmp_path / "remote"))
+    assert read_tree(tmp_path / "remote" / "config") == files
+
+
+def test_tarstream_get(local_ssh, tmp_path):
+    files = make_tree(tmp_path / "remote")
+    networks.tarstream_get(
+        remote_dir=str(tmp_path / "remote"),
+        local_dir=str(tmp_path / "local"),
+        name_patterns=["out_1.txt", "out_2*"],
+    )
+    assert read_tree(tmp_path / "local") == {
+        path: content
+        for path, content in files.items()
+        if path.endswith(("out_1.txt", "out_2.txt"))
+    }
+
+
+def test_tarstream_errors(local_ssh, tmp_path):
+    make_tree(tmp_path / "remote")
+    # tar fails on the remote side, before gzip and ssh
+    with pytest.raises(RuntimeError):
+        networks.tarstream_get(
+            remote_dir=str(tmp_path / "remote"),
+            local_dir=str(tmp_path / "local"),
+            members=["run_0", "missing"],
+        )
+    # find fails, before tar
+    with pytest.raises(RuntimeError):
+        networks.tarstream_get(
+            remote_dir=str(tmp_path / "remote"),
+            local_dir=str(tmp_path / "local"),
+            members=["missing"],
+            name_patterns=["*.txt"],
+        )
+    # tar fails on the local side, before gzip and ssh
+    with pytest.raises(RuntimeError):
+        networks.tarstream_put(
+            local_dir=str(tmp_path / "remote"),
+            remote_dir=str(tmp_path / "copy"),
+            members=["run_0", "missing"],
+        )
+
+
+@pytest.fixture
+def local_env(monkeypatch):
+    monkeypatch.setitem(env, "acceptable_err_subprocesse_ret_codes", [0])
+
+
+def test_local_argv(local_env, tmp_path):
+    # no shell: the argument is not split nor expanded
+    stdout, _ = networks.local(["echo", "a  $HOME"], capture=True)
+    assert stdout == "a  $HOME"
+
+
+def test_local_on_line(local_env):
+    lines = []
+    stdout, stderr = networks.local(
+        "for i in 1 2 3; do echo line $i; done; echo err >&2",
+        capture=True,
+        on_line=lines.append,
+    )
+    assert lines == ["line 1", "line 2", "line 3"]
+    assert stdout == "line 1\nline 2\nline 3"
+    assert stderr == "err"
+
+
+def test_local_max_capture_lines(local_env):
+    stdout, _ = networks.local(
+        ["seq", "100000"], capture=True, max_capture_lines=3
+    )
+    assert stdout == "99998\n99999\n100000"
+
+
+@pytest.mark.parametrize("on_line", [None, print])
+def test_local_timeout(local_env, on_line):
+    start_time = time.time()
+    with pytest.raises(RuntimeError, match="timed out"):
+        networks.local(
+            "sleep 10", capture=True, timeout=0.5, on_line=on_line
+        )
+    assert time.time() - start_time < 5
+
+
+def test_local_lines_early_exit(local_env, tmp_path):
+    pid_file = tmp_path / "pid"
+    # the shell starts a child in the background
+    lines = networks.local_lines(
+        "sleep 30 & echo $! > {}; echo x; wait".format(pid_file)
+    )
+    assert next(lines) == "x"
+    lines.close()
+    pid = int(pid_file.read_text())
+    for _ in range(50):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("the child of the shell is still running")
+
+
+def test_local_lines(local_env):
+    assert list(networks.local_lines(["seq", "3"])) == ["1", "2", "3"]
+    with pytest.raises(RuntimeError, match="return code 2"):
+        list(networks.local_lines("echo 1; exit 2"))
+
+
+def test_gather_print_prefix(local_env, monkeypatch, capfd):
+    monkeypatch.setattr(sys, "stdout", sys.__stdout__)
+    monkeypatch.setitem(env, "remote_concurrency", 4)
+
+    def remote_operation(i):
+        # overlapping prefixes: entered and exited in the same order
+        time.sleep(0.01 * i)
+        with add_print_prefix(prefix="thread {}".format(i)):
+            time.sleep(0.05)
+            print("line {}".format(i))
+        networks.local(["true"])
+
+    networks.gather(
+        *[networks.call_async(remote_operation, i) for i in range(4)]
+    )
+    assert sys.stdout is sys.__stdout__
+    lines = capfd.readouterr().out.splitlines()
+    for i in range(4):
+        assert any(
+            "[thread {}]".format(i) in line and line.endswith(
+                "line {}".format(i)
+            )
+            for line in lines
+        )
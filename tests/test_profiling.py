@@ -0,0 +1,107 @@
+import json
+import multiprocessing
+import threading
+
+import pytest
+
+from fabsim.base import profiling
+
+
+@pytest.fixture
+def profile_dir(tmp_path):
+    profiling.enable_profiling(str(tmp_path / "profile"))
+    yield tmp_path / "profile"
+    profiling.disable_profiling()
+
+
+@profiling.profiled("step")
+def step(fail=False):
+    with profiling.profile_step("substep"):
+        if fail:
+            raise ValueError("step failed")
+
+
+@profiling.profiled_task
+def task(args):
+    step()
+    return args
+
+
+def test_profile_step_disabled():
+    assert not profiling.profiling_enabled()
+    step()
+    assert profiling._stats == {}
+
+
+def test_profile_step(profile_dir):
+    with profiling.profile_step("phase"):
+        step()
+        with pytest.raises(ValueError):
+            step(fail=True)
+    step()
+    stats = {path: values[0] for path, values in profiling._stats.items()}
+    assert stats == {
+        ("phase",): 1,
+        ("phase", "step"): 2,
+        ("phase", "step", "substep"): 2,
+        ("step",): 1,
+        ("step", "substep"): 1,
+    }
+    for calls, wall_time, cpu_time in profiling._stats.values():
+        assert wall_time >= 0 and cpu_time >= 0
+
+
+def test_profile_step_threads(profile_dir):
+    # the steps of another thread are not nested in the current step
+    with profiling.profile_step("preparation"):
+        thread = threading.Thread(target=step)
+        thread.start()
+        thread.join()
+    assert set(profiling._stats) == {
+        ("preparation",),
+        ("step",),
+        ("step", "substep"),
+    }
+
+
+@pytest.mark.parametrize("cprofile", [False, True])
+def test_write_profile_report(tmp_path, cprofile):
+    profiling.enable_profiling(str(tmp_path / "profile"), cprofile=cprofile)
+    try:
+        with profiling.profile_step("preparation"):
+            # the workers inherit the enabled profiling
+            with multiprocessing.get_context("fork").Pool(2) as pool:
+                assert pool.map(task, range(3)) == [0, 1, 2]
+        with profiling.profile_step("submission"):
+            step()
+        report = profiling.write_profile_report(str(tmp_path / "report"))
+    finally:
+        profiling.disable_profiling()
+
+    with open(report) as report_file:
+        steps = {
+            tuple(report_step["path"]): report_step
+            for report_step in json.load(report_file)["steps"]
+        }
+    assert {path: values["calls"] for path, values in steps.items()} == {
+        ("preparation",): 1,
+        ("preparation", "task"): 3,
+        ("preparation", "task", "step"): 3,
+        ("preparation", "task", "step", "substep"): 3,
+        ("submission",): 1,
+        ("submission", "step"): 1,
+        ("submission", "step", "substep"): 1,
+    }
+
+    folded = (tmp_path / "report" / "fabsim_profile.folded").read_text()
+    self_times = {}
+    for line in folded.splitlines():
+        path, self_time = line.rsplit(" ", 1)
+        self_times[tuple(path.split(";"))] = int(self_time)
+    assert set(self_times) == set(steps)
+    # the self time excludes the time of the sub-steps
+    assert self_times[("submission",)] <= 1e6 * (
+        steps[("submission",)]["wall_time"]
+        - steps[("submission", "step")]["wall_time"]
+    ) + 1
+    assert (tmp_path / "report" / "fabsim_profile.prof").exists() == cprofile
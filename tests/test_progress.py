@@ -0,0 +1,41 @@
+import multiprocessing
+
+from fabsim.base.progress import JobProgress
+
+_job_progress = None
+
+
+def prepare(count):
+    # a job_preparation worker, reporting its prepared scripts
+    _job_progress.increment(count)
+    return count
+
+
+def test_job_progress():
+    global _job_progress
+    # created before forking the pool workers
+    _job_progress = JobProgress(20, refresh_interval=0.01)
+    _job_progress.start()
+    try:
+        with _job_progress.phase("preparation"):
+            with multiprocessing.get_context("fork").Pool(4) as pool:
+                assert sum(pool.map(prepare, [1] * 10 + [2] * 5)) == 20
+        with _job_progress.phase("submission", items=3):
+            pass
+    finally:
+        _job_progress.stop()
+
+    assert _job_progress.count == 20
+    assert _job_progress.phases["preparation"]["items"] == 20
+    assert _job_progress.phases["submission"]["items"] == 3
+    assert "20/20 (100%" in _job_progress._progress_line(20)
+    assert "5/20 (25%" in _job_progress._progress_line(5)
+    _job_progress.print_summary()
+
+
+def test_job_progress_unknown_total():
+    job_progress = JobProgress(0)
+    job_progress.start()
+    job_progress.increment(3)
+    job_progress.stop()
+    assert job_progress._progress_line(3).startswith("Generating scripts: 3 (")
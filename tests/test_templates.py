@@ -0,0 +1,309 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+
+import pytest
+
+from fabsim.base import MultiProcessingPool, fab
+from fabsim.base.env import env
+from fabsim.deploy.templates import (
+    TemplateCache,
+    TemplateDiskCache,
+    clear_template_cache,
+    get_template_cache_stats,
+    remove_script_templates,
+    script_template_content,
+    script_template_save_temporary,
+    template,
+    warm_template_cache,
+)
+
+NB_WORKERS = 64
+NB_SCRIPTS = 20
+
+
+def save_scripts(worker):
+    """Save the same job script name many times with worker specific content
+    and check that the content read back is never from another writer."""
+    errors = []
+    for i in range(NB_SCRIPTS):
+        content = "#!/bin/bash\necho worker {} script {}\n".format(worker, i)
+        destname = script_template_save_temporary(content)
+        with open(destname) as script:
+            if script.read() != content:
+                errors.append(destname)
+    return destname, errors
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="requires the fork start method",
+)
+def test_script_template_save_temporary_workers(tmp_path, monkeypatch):
+    monkeypatch.setitem(env, "fabsim_root", str(tmp_path))
+    monkeypatch.setitem(env, "name", "dummy_test_localhost_1")
+    monkeypatch.setitem(env, "label", "stress")
+
+    with multiprocessing.get_context("fork").Pool(NB_WORKERS) as pool:
+        results = pool.map(save_scripts, range(NB_WORKERS), chunksize=1)
+
+    assert [errors for _, errors in results] == [[]] * NB_WORKERS
+    for destname, _ in results:
+        assert (
+            os.path.basename(destname) == "dummy_test_localhost_1_stress.sh"
+        )
+
+    jobscripts = tmp_path / "deploy" / ".jobscripts"
+    assert not list(jobscripts.glob("**/*.tmp"))
+
+    # the scripts of the workers are removed, then all scripts
+    main_script = script_template_save_temporary("main")
+    remove_script_templates(children_only=True)
+    assert [path.name for path in jobscripts.glob("*/*")] == [
+        os.path.basename(os.path.dirname(main_script))
+    ]
+    remove_script_templates()
+    assert list(jobscripts.iterdir()) == []
+
+
+def test_script_template_save_temporary_threads(tmp_path, monkeypatch):
+    monkeypatch.setitem(env, "fabsim_root", str(tmp_path))
+    monkeypatch.setitem(env, "name", "dummy_test_localhost_1")
+    monkeypatch.setitem(env, "label", "threads")
+    barrier = threading.Barrier(8)
+
+    def save_script(thread):
+        destname = script_template_save_temporary("thread {}".format(thread))
+        # all threads have saved their script before reading it back
+        barrier.wait()
+        with open(destname) as script:
+            return script.read()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        contents = list(executor.map(save_script, range(8)))
+    assert contents == ["thread {}".format(thread) for thread in range(8)]
+
+
+@pytest.mark.parametrize("number_of_iterations", [1, 2, 3])
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "",
+        "no variable",
+        "$a ${b} $$c $missing ${missing}x",
+        "$$ $ $1 ${ $a$b${a}z",
+        "#!/bin/bash\n#SBATCH --nodes=${nodes}\ncd $job_results\n",
+    ],
+)
+def test_template_compiled(monkeypatch, pattern, number_of_iterations):
+    for key, value in (
+        ("a", "A$b"),
+        ("b", "B$$c"),
+        ("c", "C"),
+        ("nodes", 4),
+        ("job_results", "${results_path}/$a"),
+        ("results_path", "/results"),
+    ):
+        monkeypatch.setitem(env, key, value)
+
+    expected = pattern
+    for _ in range(number_of_iterations):
+        expected = Template(expected).safe_substitute(env)
+    assert template(pattern, number_of_iterations) == expected
+
+
+def test_template_cache_lru():
+    cache = TemplateCache(max_entries=2, max_size=10)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    # "b" is the least recently used
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+    # bounded by the total size
+    cache.put("d", "x" * 10)
+    assert cache.get("c") is None
+    assert len(cache) == 1 and cache.size == 10
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 2, 3)
+    assert stats["hit_ratio"] == 0.5
+
+
+def test_script_template_content_cache(tmp_path, monkeypatch):
+    (tmp_path / "dummy-template").write_text("run $cores ${bin} $missing\n")
+    monkeypatch.setitem(env, "local_templates_path", [str(tmp_path)])
+    monkeypatch.setitem(env, "enable_template_cache", True)
+    monkeypatch.setitem(env, "cores", 4)
+    monkeypatch.setitem(env, "bin", "a.out")
+    clear_template_cache()
+
+    def content():
+        return script_template_content("dummy-template")
+
+    assert content() == "run 4 a.out $missing\n"
+    # a variable not used by the template
+    monkeypatch.setitem(env, "nodes", 2)
+    assert content() == "run 4 a.out $missing\n"
+    monkeypatch.setitem(env, "cores", 8)
+    assert content() == "run 8 a.out $missing\n"
+    monkeypatch.setitem(env, "missing", "x")
+    assert content() == "run 8 a.out x\n"
+
+    stats = get_template_cache_stats()
+    assert (stats["cache_hits"], stats["cache_misses"]) == (1, 3)
+    clear_template_cache()
+
+
+def render_warmed_template(queue):
+    queue.put(script_template_content("dummy-template"))
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="requires the fork start method",
+)
+def test_warm_template_cache(tmp_path, monkeypatch):
+    (tmp_path / "dummy-template").write_text("cd $job_results\n")
+    monkeypatch.setitem(env, "local_templates_path", [str(tmp_path)])
+    monkeypatch.setitem(env, "enable_template_cache", True)
+    monkeypatch.setitem(env, "job_results", "/stale")
+    clear_template_cache()
+
+    # the missing templates are only reported when they are used
+    warm_template_cache(["dummy-template", "missing-template"])
+    stats = get_template_cache_stats()
+    assert stats["raw_templates"] == ["dummy-template"]
+    assert stats["template_vars_analyzed"] == 1
+    # not processed with the env values of the main process
+    assert (stats["processed_templates_cached"], stats["cache_misses"]) == (
+        0,
+        0,
+    )
+
+    # the worker inherits the loaded template
+    os.remove(tmp_path / "dummy-template")
+    monkeypatch.setitem(env, "job_results", "/job")
+    queue = multiprocessing.get_context("fork").Queue()
+    process = multiprocessing.get_context("fork").Process(
+        target=render_warmed_template, args=(queue,)
+    )
+    process.start()
+    assert queue.get(timeout=10) == "cd /job\n"
+    process.join()
+    clear_template_cache()
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="requires the fork start method",
+)
+def test_shared_template_cache():
+    cache = TemplateCache(max_entries=10, max_size=1000)
+    manager = multiprocessing.get_context("fork").Manager()
+    try:
+        cache.shared = manager.dict()
+        cache.put("a", "1")
+        process = multiprocessing.get_context("fork").Process(
+            target=cache.put, args=("b", "2")
+        )
+        process.start()
+        process.join()
+        # published by another process
+        assert cache.get("b") == "2"
+        assert cache.get("b") == "2"
+        assert cache.get("c") is None
+        stats = cache.stats()
+        assert [stats[key] for key in ("hits", "shared_hits", "misses")] == [
+            1,
+            1,
+            1,
+        ]
+    finally:
+        manager.shutdown()
+    # the shared cache is ignored once stopped
+    assert cache.get("d") is None
+    assert cache.shared is None
+
+
+def test_template_disk_cache(machine_env, monkeypatch):
+    def content(i):
+        # 9 bytes, the line endings are kept
+        return "{}\r\n".format(i) * 3
+
+    tmp_path = machine_env / "cache"
+    cache = TemplateDiskCache(str(tmp_path), max_size=25)
+    assert cache.get(("hash", ("a",))) is None
+    for i in range(3):
+        cache.put(("hash", (str(i),)), content(i))
+        # distinct modification times for the LRU order
+        time.sleep(0.01)
+    # shared by the instances using the same folder
+    other_cache = TemplateDiskCache(str(tmp_path), max_size=25)
+    assert other_cache.get(("hash", ("0",))) == content(0)
+    time.sleep(0.01)
+    assert cache.get(("hash", ("2",))) == content(2)
+
+    # "1" is the least recently used
+    assert cache.prune() == 1
+    assert cache.get(("hash", ("1",))) is None
+    assert cache.get(("hash", ("0",))) == content(0)
+    stats = cache.stats()
+    assert [stats[key] for key in ("writes", "evictions")] == [3, 1]
+
+    # a job only writes the templates processed by the pool workers, i.e.,
+    # one entry per template since the replicas are prepared as a batch
+    monkeypatch.setattr(MultiProcessingPool, "cpu_count", lambda: 4)
+    monkeypatch.setattr(fab, "job_transmission", lambda: None)
+    job_cache = machine_env / "job_cache"
+    env.update(
+        enable_template_cache=True,
+        template_disk_cache=True,
+        template_disk_cache_dir=str(job_cache),
+        submit_job=False,
+        replicas=3,
+    )
+    for _ in range(2):
+        clear_template_cache()
+        fab.job(dict(label="a"))
+        cached = sorted(
+            path.read_text() for path in job_cache.rglob("*") if path.is_file()
+        )
+        assert len(cached) == len(fab.job_script_templates())
+    assert cached[1].startswith("cd @@FABSIM_JOB_RESULTS@@\n")
+
+
+def write_disk_cache(path, worker):
+    """Concurrently write the same keys, and check that the content read
+    back is either missing or complete."""
+    cache = TemplateDiskCache(path, max_size=10 ** 9)
+    errors = 0
+    for i in range(NB_SCRIPTS):
+        cache.put(("hash", (str(i),)), "echo {}\n".format(i) * 100)
+        j = (i + worker) % NB_SCRIPTS
+        if cache.get(("hash", (str(j),))) not in (
+            None,
+            "echo {}\n".format(j) * 100,
+        ):
+            errors += 1
+    return errors
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="requires the fork start method",
+)
+def test_template_disk_cache_workers(tmp_path):
+    with multiprocessing.get_context("fork").Pool(8) as pool:
+        errors = pool.starmap(
+            write_disk_cache, [(str(tmp_path), worker) for worker in range(8)]
+        )
+    assert errors == [0] * 8
+    assert not list(tmp_path.glob("**/.tmp_*"))
+    assert len([path for path in tmp_path.rglob("*") if path.is_file()]) == (
+        NB_SCRIPTS
+    )
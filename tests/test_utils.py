@@ -0,0 +1,56 @@
+import errno
+import fcntl
+import os
+
+import pytest
+
+from fabsim.base import utils
+
+
+@pytest.fixture
+def src(tmp_path):
+    src = tmp_path / "src.sh"
+    src.write_text("echo src\n")
+    src.chmod(0o750)
+    return src
+
+
+def fail(*args):
+    raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+
+def clone(dst_fd, request, src_fd):
+    # a copy-on-write clone, as by the FICLONE ioctl
+    assert request == utils._FICLONE
+    os.write(dst_fd, os.read(src_fd, 1 << 20))
+
+
+@pytest.mark.parametrize("existing_dst", [None, "file", "symlink"])
+def test_link_file(tmp_path, src, existing_dst):
+    dst = tmp_path / "dst.sh"
+    if existing_dst == "file":
+        dst.write_text("old")
+    elif existing_dst == "symlink":
+        dst.symlink_to(tmp_path / "missing")
+
+    assert utils.link_file(str(src), str(dst)) == "link"
+    assert os.path.samefile(src, dst)
+
+
+@pytest.mark.parametrize(
+    "ioctl, method", [(clone, "reflink"), (fail, "copy")]
+)
+def test_link_file_fallbacks(tmp_path, src, monkeypatch, ioctl, method):
+    # e.g., dst on another filesystem than src
+    monkeypatch.setattr(os, "link", fail)
+    monkeypatch.setattr(fcntl, "ioctl", ioctl)
+    dst = tmp_path / "dst.sh"
+    dst.write_text("old")
+
+    assert utils.link_file(str(src), str(dst)) == method
+    assert not os.path.samefile(src, dst)
+    assert dst.read_text() == "echo src\n"
+    assert dst.stat().st_mode == src.stat().st_mode
+    # the copy is independent of the source
+    src.write_text("changed")
+    assert dst.read_text() == "echo src\n"
@@ -0,0 +1,35 @@
+import io
+import posixpath
+
+import pytest
+from beartype.roar import BeartypeCallHintParamViolation
+
+from fabsim.base.yaml_io import (
+    yaml_dump,
+    yaml_load,
+    yaml_load_env,
+    yaml_load_file,
+)
+
+
+def test_yaml_io(tmp_path):
+    data = {"label": "a", "cores": 2, "paths": ["/a", "/b"]}
+    yaml_file = tmp_path / "data.yml"
+    with open(yaml_file, "w") as stream:
+        yaml_dump(data, stream)
+    assert yaml_load_file(str(yaml_file)) == data
+    with open(yaml_file, "rb") as stream:
+        assert yaml_load(stream) == data
+    assert yaml_load(yaml_dump(data)) == data
+    assert yaml_load(io.StringIO(yaml_dump(data))) == data
+
+    # python objects are loaded as their names
+    env_yml = yaml_dump({"pather": posixpath}, safe=False)
+    assert yaml_load_env(env_yml) == {"pather": "posixpath"}
+
+
+def test_yaml_io_types(tmp_path):
+    with pytest.raises(BeartypeCallHintParamViolation):
+        yaml_load(["label: a"])
+    with pytest.raises(BeartypeCallHintParamViolation):
+        yaml_dump({}, stream=str(tmp_path / "data.yml"))